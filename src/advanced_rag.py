@@ -1,13 +1,15 @@
-from llama_index.core import VectorStoreIndex, StorageContext, load_index_from_storage
-from llama_index.core.chat_engine import ContextChatEngine
-from llama_index.llms import Ollama
-from llama_index.core.memory import ChatMemoryBuffer
-from llama_index.core.postprocessor import SimilarityPostprocessor
-from llama_index.core.prompts import PromptTemplate
-from config import INDEX_DIR, LLM_MODEL
+from config import (
+    INDEX_DIR, QUERY_EMBED_CACHE_SIZE, RETRIEVAL_CACHE_SIZE, RETRIEVAL_MODE,
+    RERANKER_ENABLED, RERANKER_CANDIDATES, RERANKER_TIME_BUDGET_MS
+)
+from utils.manifest import current_index_dir, get_index_version
+from utils.startup import StartupReport, load_persisted_index
+from utils.tracing import format_timings, print_cache_stats
 import os
 import argparse
 
+# llama_index・faiss・torchなどの重いモジュールは、引数の解析とインデックスの確認の後に読み込む
+
 # 高度なプロンプトテンプレート
 SYSTEM_PROMPT = """あなたは日本語で応答する知識豊富なアシスタントです。
 以下の情報源を参考にして、ユーザーの質問に正確に答えてください。
@@ -24,51 +26,59 @@ SYSTEM_PROMPT = """あなたは日本語で応答する知識豊富なアシス
 
 """
 
-def load_index():
-    """インデックスをロードする関数"""
-    if not os.path.exists(INDEX_DIR):
-        print(f"エラー: インデックスディレクトリ '{INDEX_DIR}' が見つかりません。")
-        print("先にmain.pyを実行してインデックスを作成してください。")
-        return None
-    
-    try:
-        storage_context = StorageContext.from_defaults(persist_dir=INDEX_DIR)
-        index = load_index_from_storage(storage_context)
-        return index
-    except Exception as e:
-        print(f"インデックスのロード中にエラーが発生しました: {e}")
-        return None
+def create_query_pipeline(index, index_dir, similarity_top_k=3, similarity_cutoff=0.7, verbose=False, query_cache=None,
+                          mode=RETRIEVAL_MODE, rerank=False, rerank_budget_ms=RERANKER_TIME_BUDGET_MS):
+    """クエリパイプラインを作成する関数
 
-def create_chat_engine(index, similarity_top_k=3, similarity_cutoff=0.7, verbose=False):
-    """チャットエンジンを作成する関数"""
+    rerankの場合はRERANKER_CANDIDATES件を検索し、クロスエンコーダーで採点し直した上位similarity_top_k件をLLMに渡す。
+    """
     if index is None:
         return None
+
+    from llama_index.core.prompts import PromptTemplate
+    from utils.query_cache import QueryCache
+    from utils.hybrid_retriever import create_retriever
+    from utils.query_pipeline import QueryPipeline
+    from utils.reranker import create_reranker
+    from utils.context_packer import create_context_packer
+
+    node_postprocessors = []
+    retrieval_top_k = similarity_top_k
+    if rerank:
+        reranker = create_reranker(top_n=similarity_top_k, time_budget=rerank_budget_ms / 1000)
+        if reranker is not None:
+            node_postprocessors.append(reranker)
+            retrieval_top_k = max(RERANKER_CANDIDATES, similarity_top_k)
+    # 重複を除き、隣り合うチャンクを連結してトークン数の上限内に詰める
+    node_postprocessors.append(create_context_packer())
     
     # LLMの設定
     from llm_integration import get_ollama_llm
     llm = get_ollama_llm(temperature=0.1)
     
-    # チャットメモリの設定
-    memory = ChatMemoryBuffer.from_defaults(token_limit=4096)
-    
     # テキスト生成用のプロンプト
     text_qa_template = PromptTemplate(SYSTEM_PROMPT)
     
-    # ポストプロセッサ - 類似度によるフィルタリング
-    postprocessor = SimilarityPostprocessor(similarity_cutoff=similarity_cutoff)
+    # 類似度によるフィルタリングはキャッシュ付きRetrieverで行い、フィルタ後の結果をキャッシュする
+    # hybridではベクトル検索とBM25（型番・専門用語の完全一致に強い）の結果を統合する
+    retriever = create_retriever(
+        index,
+        query_cache or QueryCache(QUERY_EMBED_CACHE_SIZE, RETRIEVAL_CACHE_SIZE),
+        index_version=get_index_version(index_dir),
+        similarity_top_k=retrieval_top_k,
+        similarity_cutoff=similarity_cutoff,
+        persist_dir=index_dir,
+        mode=mode
+    )
     
-    # コンテキストチャットエンジンの設定
-    chat_engine = ContextChatEngine.from_defaults(
-        index=index,
+    # 検索は1回だけ行い、取得したノードをそのままLLMに渡す
+    return QueryPipeline(
+        retriever=retriever,
         llm=llm,
-        memory=memory,
-        system_prompt=text_qa_template,
-        similarity_top_k=similarity_top_k,
-        node_postprocessors=[postprocessor],
+        context_template=text_qa_template,
+        node_postprocessors=node_postprocessors,
         verbose=verbose
     )
-    
-    return chat_engine
 
 def format_sources(nodes):
     """ソース情報を整形する関数"""
@@ -83,39 +93,135 @@ def format_sources(nodes):
             if isinstance(score, float):
                 score = round(score, 3)
                 
-            source_info = f"{i}. {os.path.basename(source)} (フォルダ: {os.path.basename(folder)}, 類似度: {score})"
+            page = node.metadata.get('page_label')
+            page_info = f", ページ: {page}" if page else ""
+            source_info = f"{i}. {os.path.basename(source)} (フォルダ: {os.path.basename(folder)}{page_info}, 類似度: {score})"
             sources.append(source_info)
         else:
             sources.append(f"{i}. 不明な情報源")
     return sources
 
+def format_filters(args):
+    """絞り込み条件を表示用の文字列にする関数"""
+    conditions = []
+    if args.folder:
+        conditions.append(f"フォルダ={', '.join(args.folder)}")
+    if args.file:
+        conditions.append(f"ファイル名={', '.join(args.file)}")
+    if args.date_from or args.date_to:
+        conditions.append(f"更新日={args.date_from or ''}〜{args.date_to or ''}")
+    return ", ".join(conditions)
+
 def main():
     # コマンドライン引数の解析
     parser = argparse.ArgumentParser(description='高度なRAGチャットシステム')
     parser.add_argument('--top-k', type=int, default=3, help='検索する類似ドキュメントの数')
-    parser.add_argument('--cutoff', type=float, default=0.7, help='類似度のカットオフ値')
+    parser.add_argument('--cutoff', type=float, default=None,
+                        help='類似度のカットオフ値（既定: 0.7、再ランキング時は使用しない）')
+    parser.add_argument('--mode', choices=['vector', 'hybrid'], default=RETRIEVAL_MODE, help='検索方式')
+    parser.add_argument('--rerank', action=argparse.BooleanOptionalAction, default=RERANKER_ENABLED,
+                        help='クロスエンコーダーで検索結果を採点し直す')
+    parser.add_argument('--rerank-budget-ms', type=float, default=RERANKER_TIME_BUDGET_MS,
+                        help='再ランキングの1クエリあたりの時間の上限（ミリ秒）')
+    parser.add_argument('--folder', action='append', default=[],
+                        help='検索対象のフォルダ（PDF_DIRからの相対パスまたはフォルダ名、複数指定可）')
+    parser.add_argument('--file', action='append', default=[],
+                        help='検索対象のファイル名（部分一致、*?のワイルドカード可、複数指定可）')
+    parser.add_argument('--date-from', help='この日付（YYYY-MM-DD）以降に更新されたファイルのみ検索')
+    parser.add_argument('--date-to', help='この日付（YYYY-MM-DD）以前に更新されたファイルのみ検索')
     parser.add_argument('--verbose', action='store_true', help='詳細な出力を表示')
+    parser.add_argument('--no-daemon', action='store_true', help='クエリデーモンに接続せず、インデックスをロードする')
     args = parser.parse_args()
+    startup = StartupReport()
+    raw_filters = None
+    if args.folder or args.file or args.date_from or args.date_to:
+        raw_filters = {'folders': args.folder, 'files': args.file, 'date_from': args.date_from, 'date_to': args.date_to}
+    if args.cutoff is None:
+        # 再ランキングでは候補を多めに取得して採点し直すため、エンベディングの類似度では絞らない
+        args.cutoff = None if args.rerank else 0.7
+    
+    # クエリデーモンが起動していれば、ロード済みのインデックス・モデルを使う
+    daemon = None
+    if not args.no_daemon:
+        from utils.daemon_client import connect_daemon
+        with startup.stage('daemon'):
+            daemon = connect_daemon(INDEX_DIR)
     
-    # インデックスのロード
+    if daemon is not None:
+        from utils.daemon_client import DaemonError
+        print(f"クエリデーモン（{daemon.url}）に接続しています...")
+        options = {
+            'top_k': args.top_k, 'cutoff': args.cutoff, 'mode': args.mode, 'rerank': args.rerank,
+            'rerank_budget_ms': args.rerank_budget_ms, 'verbose': args.verbose
+        }
+        try:
+            session = daemon.open_session('advanced', options, raw_filters)
+        except DaemonError as e:
+            if e.status == 400:
+                parser.error(str(e))
+            print(f"クエリデーモンでエラーが発生しました: {e}")
+            return
+        try:
+            chat_loop(args, session.chat, session, startup)
+        finally:
+            session.close()
+        return
+    
+    filters = None
+    if raw_filters:
+        with startup.stage('import'):
+            from utils.facet_index import normalize_filters
+        try:
+            filters = normalize_filters(raw_filters)
+        except ValueError as e:
+            parser.error(str(e))
+    
+    # インデックスのロード（公開中のバージョンは一度だけ解決し、検索用の索引も同じバージョンから読み込む）
     print("インデックスをロードしています...")
-    index = load_index()
+    index_dir = current_index_dir(INDEX_DIR)
+    index = load_persisted_index(index_dir, startup)
     if index is None:
         return
     
-    # チャットエンジンの作成
+    # クエリパイプラインの作成
     print("チャットエンジンを準備しています...")
-    chat_engine = create_chat_engine(
-        index, 
-        similarity_top_k=args.top_k, 
-        similarity_cutoff=args.cutoff, 
-        verbose=args.verbose
-    )
-    if chat_engine is None:
+    with startup.stage('import'):
+        from llama_index.core.memory import ChatMemoryBuffer
+        from utils.query_cache import QueryCache
+    query_cache = QueryCache(QUERY_EMBED_CACHE_SIZE, RETRIEVAL_CACHE_SIZE)
+    with startup.stage('pipeline'):
+        pipeline = create_query_pipeline(
+            index,
+            index_dir,
+            similarity_top_k=args.top_k, 
+            similarity_cutoff=args.cutoff, 
+            verbose=args.verbose,
+            query_cache=query_cache,
+            mode=args.mode,
+            rerank=args.rerank,
+            rerank_budget_ms=args.rerank_budget_ms
+        )
+    if pipeline is None:
+        return
+    if filters and pipeline.retriever.facet_index is None:
+        print("絞り込み用の索引がありません。main.py --full でインデックスを作成し直してください。")
         return
     
+    # チャットメモリの設定
+    memory = ChatMemoryBuffer.from_defaults(token_limit=4096)
+    chat_loop(args, lambda message: pipeline.chat(message, memory, filters=filters), query_cache, startup)
+
+def chat_loop(args, chat, cache_stats_source, startup):
+    """質問を受け付けて回答を表示するループ
+
+    chatは質問を受け取ってPipelineResultと同じ属性を持つ結果を返す関数（ローカルのパイプラインまたはデーモン）。
+    """
+    print(startup.summary())
     print("\n=== 高度なRAGチャットシステム ===")
-    print(f"設定: 検索数={args.top_k}, 類似度閾値={args.cutoff}, 詳細モード={args.verbose}")
+    print(f"設定: 検索数={args.top_k}, 類似度閾値={args.cutoff}, 検索方式={args.mode}, "
+          f"再ランキング={args.rerank}, 詳細モード={args.verbose}")
+    if args.folder or args.file or args.date_from or args.date_to:
+        print(f"絞り込み: {format_filters(args)}")
     print("質問を入力してください。終了するには 'exit' または 'quit' と入力してください。")
     
     while True:
@@ -124,6 +230,9 @@ def main():
         
         # 終了コマンドのチェック
         if user_input.lower() in ["exit", "quit", "終了"]:
+            if args.verbose:
+                print("キャッシュ統計:")
+                print_cache_stats(cache_stats_source)
             print("チャットを終了します。")
             break
         
@@ -133,8 +242,10 @@ def main():
         
         try:
             # クエリの実行
-            response = chat_engine.chat(user_input)
+            response = chat(user_input)
             print(f"\nアシスタント: {response.response}")
+            if args.verbose:
+                print(f"処理時間: {format_timings(response.timings)}")
             
             # 引用元の表示
             if hasattr(response, 'source_nodes') and response.source_nodes:
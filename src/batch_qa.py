@@ -0,0 +1,147 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import (
+    INDEX_DIR, LLM_MODEL, QUERY_EMBED_CACHE_SIZE, RETRIEVAL_CACHE_SIZE,
+    BATCH_SIZE, BATCH_CONCURRENCY
+)
+from utils.manifest import current_index_dir, get_index_version
+from utils.batch_io import load_queries, load_completed_ids, open_output, append_result
+from utils.startup import StartupReport, load_persisted_index
+from utils.tracing import span
+import argparse
+import os
+import time
+
+SYSTEM_PROMPT = (
+    "あなたは日本語で応答するアシスタントです。"
+    "以下の情報源を参考にして、ユーザーの質問に簡潔に答えてください。"
+    "情報源に含まれない内容についてはわからないと正直に答えてください。"
+)
+
+def create_query_pipeline(index, index_dir, similarity_top_k=3, similarity_cutoff=None):
+    """バッチ処理用のクエリパイプラインを作成する関数（index_dirはインデックスをロードした公開中のバージョンのディレクトリ）"""
+    from llm_integration import get_ollama_llm
+    from utils.query_cache import QueryCache
+    from utils.hybrid_retriever import create_retriever
+    from utils.query_pipeline import QueryPipeline
+    from utils.context_packer import create_context_packer
+    llm = get_ollama_llm(model_name=LLM_MODEL, temperature=0.1)
+    if llm is None:
+        return None
+
+    retriever = create_retriever(
+        index,
+        QueryCache(QUERY_EMBED_CACHE_SIZE, RETRIEVAL_CACHE_SIZE),
+        index_version=get_index_version(index_dir),
+        similarity_top_k=similarity_top_k,
+        similarity_cutoff=similarity_cutoff,
+        persist_dir=index_dir
+    )
+    return QueryPipeline(
+        retriever=retriever, llm=llm, node_postprocessors=[create_context_packer()], system_prompt=SYSTEM_PROMPT
+    )
+
+def answer_query(pipeline, query, nodes, timer):
+    """検索済みのノードを使って1件の質問に回答し、出力用のレコードを作成する関数"""
+    from llama_index.core.memory import ChatMemoryBuffer
+    record = {'id': query['id'], 'question': query['question']}
+    try:
+        # 質問どうしで会話履歴が混ざらないよう、1件ごとに新しいメモリを使う
+        memory = ChatMemoryBuffer.from_defaults(token_limit=4096)
+        with span('query', query_id=query['id']):
+            result = pipeline.generate(query['question'], nodes, memory, timer)
+        record['answer'] = result.response
+        record['sources'] = [
+            {
+                'file': os.path.basename(node.metadata.get('file_path', '')),
+                'page': node.metadata.get('page_label'),
+                'score': node.score,
+            }
+            for node in result.source_nodes
+        ]
+    except Exception as e:
+        record['error'] = str(e)
+    record['timings'] = {stage: round(seconds, 4) for stage, seconds in timer.timings.items()}
+    return record
+
+def run_batch(pipeline, queries, output_file, batch_size=BATCH_SIZE, concurrency=BATCH_CONCURRENCY):
+    """質問をバッチごとにまとめて検索し、LLMへの問い合わせを並列に実行する関数"""
+    completed = 0
+    failed = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for start in range(0, len(queries), batch_size):
+            batch = queries[start:start + batch_size]
+            retrieved = pipeline.retrieve_batch([query['question'] for query in batch])
+
+            futures = [
+                executor.submit(answer_query, pipeline, query, nodes, timer)
+                for query, (nodes, timer) in zip(batch, retrieved)
+            ]
+            # 終わった順に書き込むため、中断しても完了分は再実行されない
+            for future in as_completed(futures):
+                record = future.result()
+                append_result(output_file, record)
+                if record.get('error'):
+                    failed += 1
+                    print(f"  [{record['id']}] エラー: {record['error']}")
+                else:
+                    completed += 1
+            print(f"{min(start + batch_size, len(queries))}/{len(queries)}件を処理しました")
+    return completed, failed
+
+def main():
+    # コマンドライン引数の解析
+    parser = argparse.ArgumentParser(description='質問ファイルをまとめて処理するRAGバッチ質問応答')
+    parser.add_argument('input', help='質問ファイル（.jsonl または .csv、question列とid列）')
+    parser.add_argument('-o', '--output', default='answers.jsonl', help='回答の出力先（JSONL）')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='まとめて検索する質問数')
+    parser.add_argument('--concurrency', type=int, default=BATCH_CONCURRENCY, help='LLMへの同時リクエスト数')
+    parser.add_argument('--top-k', type=int, default=3, help='検索する類似ドキュメントの数')
+    parser.add_argument('--cutoff', type=float, default=None, help='類似度のカットオフ値')
+    parser.add_argument('--no-resume', action='store_true', help='出力済みの回答を無視して最初から実行')
+    args = parser.parse_args()
+
+    queries = load_queries(args.input)
+    if not args.no_resume:
+        completed_ids = load_completed_ids(args.output)
+        if completed_ids:
+            print(f"回答済みの{len(completed_ids)}件をスキップします")
+        queries = [query for query in queries if query['id'] not in completed_ids]
+    elif os.path.exists(args.output):
+        os.remove(args.output)
+
+    if not queries:
+        print("処理する質問はありません。")
+        return
+
+    print("インデックスをロードしています...")
+    startup = StartupReport()
+    # 公開中のバージョンは一度だけ解決し、検索用の索引も同じバージョンから読み込む
+    index_dir = current_index_dir(INDEX_DIR)
+    index = load_persisted_index(index_dir, startup)
+    if index is None:
+        return
+    with startup.stage('pipeline'):
+        pipeline = create_query_pipeline(index, index_dir, similarity_top_k=args.top_k, similarity_cutoff=args.cutoff)
+    if pipeline is None:
+        return
+    print(startup.summary())
+    # バッチ処理では質問を取りこぼさないよう、Ollamaの同時実行数を超えた分は時間制限なく順番を待つ
+    gateway = pipeline.llm.gateway
+    gateway.queue_timeout = None
+    gateway.max_queue = max(gateway.max_queue, args.concurrency)
+
+    print(f"{len(queries)}件の質問を処理します（バッチサイズ: {args.batch_size}, 同時実行数: {args.concurrency}）")
+    start_time = time.perf_counter()
+    with open_output(args.output) as output_file:
+        completed, failed = run_batch(
+            pipeline, queries, output_file, batch_size=args.batch_size, concurrency=args.concurrency
+        )
+    elapsed = time.perf_counter() - start_time
+
+    print(f"完了: 成功 {completed}件 / 失敗 {failed}件（{elapsed:.2f}秒）")
+    print(f"回答を {args.output} に保存しました")
+    if failed:
+        print("失敗した質問は同じコマンドを再実行すると再試行されます。")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+from llama_index.core import VectorStoreIndex, StorageContext, load_index_from_storage
+from llama_index.core.llms import MockLLM
+from llama_index.core.memory import ChatMemoryBuffer
+from llama_index.core.schema import Document, MetadataMode
+from utils.data_loader import load_documents
+from utils.metadata_handler import add_folder_metadata
+from utils.vector_store import create_vector_store, load_storage_context, QUANTIZATION_TYPES
+from utils.blob_store import BlobDocumentStore
+from utils.embedding_cache import EmbeddingStats, embed_texts
+from utils.sparse_index import SparseIndex
+from utils.query_cache import QueryCache
+from utils.hybrid_retriever import create_retriever, RETRIEVAL_MODES
+from utils.query_pipeline import QueryPipeline
+from utils.context_packer import ContextPacker
+from utils.chunking import create_node_parser, chunk_report
+from utils.benchmark import (
+    BENCHMARK_SCHEMA_VERSION, HashingEmbedding, generate_corpus, generate_queries, timed, latency_summary,
+    directory_bytes, environment_info, compare_results, save_results, load_results
+)
+from config import (
+    VECTOR_INDEX_TYPE, VECTOR_QUANTIZATION, RETRIEVAL_MODE, EMBED_BATCH_SIZE, LOADER_NUM_WORKERS, BM25_K1, BM25_B,
+    CHUNK_SIZE, CHUNK_OVERLAP
+)
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+def parse_int_list(value):
+    """カンマ区切りの整数リストを解析する関数"""
+    return [int(item) for item in value.split(',') if item.strip()]
+
+def create_benchmark_embed_model(name, batch_size):
+    """ベンチマークに使うエンベディングモデルを作成する関数（hashingはモデル不要）"""
+    if name == 'hashing':
+        return HashingEmbedding(embed_batch_size=batch_size)
+    from utils.embed_model import create_embed_model
+    return create_embed_model(batch_size=batch_size)
+
+def throughput(count, seconds):
+    return round(count / max(seconds, 1e-9), 2)
+
+def measure_latencies(func, queries):
+    """クエリごとに関数を実行して経過秒数のリストを返す関数"""
+    return [timed(func, query)[1] for query in queries]
+
+def benchmark_corpus(num_docs, work_dir, embed_model, node_parser, args):
+    """1つのコーパスサイズで各段階の時間と検索のレイテンシを計測する関数"""
+    corpus_dir = os.path.join(work_dir, f"corpus_{num_docs}")
+    persist_dir = os.path.join(work_dir, f"index_{num_docs}")
+    print(f"\n=== コーパスサイズ: {num_docs}文書 ===")
+    file_paths = generate_corpus(
+        corpus_dir, num_docs, pages_per_doc=args.pages, file_format=args.format, seed=args.seed
+    )
+    corpus_bytes = sum(os.path.getsize(path) for path in file_paths)
+    stages = {}
+
+    # 読み込み・解析
+    documents, seconds = timed(load_documents, input_files=file_paths, num_workers=args.num_workers)
+    documents = add_folder_metadata(documents)
+    stages['load'] = {
+        'seconds': round(seconds, 4),
+        'files_per_second': throughput(len(file_paths), seconds),
+        'mb_per_second': throughput(corpus_bytes / 1024 ** 2, seconds),
+    }
+
+    # チャンク分割
+    nodes, seconds = timed(node_parser.get_nodes_from_documents, documents)
+    stages['chunk'] = {'seconds': round(seconds, 4), 'nodes_per_second': throughput(len(nodes), seconds)}
+
+    # エンベディング（キャッシュは使わない）
+    texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+    embed_stats = EmbeddingStats()
+    embeddings, seconds = timed(embed_texts, texts, embed_model, stats=embed_stats, batch_size=args.embed_batch_size)
+    for node, embedding in zip(nodes, embeddings):
+        node.embedding = embedding
+    stages['embed'] = {
+        'seconds': round(seconds, 4),
+        'chunks_per_second': throughput(embed_stats.chunks, seconds),
+        'chars_per_second': throughput(embed_stats.chars, seconds),
+    }
+
+    # インデックス作成（FAISS + docstore + BM25）
+    def build():
+        vector_store = create_vector_store(args.index_type, embeddings=embeddings, quantization=args.quantization)
+        storage_context = StorageContext.from_defaults(docstore=BlobDocumentStore(), vector_store=vector_store)
+        index = VectorStoreIndex(nodes, storage_context=storage_context, embed_model=embed_model)
+        sparse_index = SparseIndex.build(
+            [node.node_id for node in nodes], texts, k1=BM25_K1, b=BM25_B
+        )
+        return index, sparse_index
+
+    (index, sparse_index), seconds = timed(build)
+    stages['build'] = {'seconds': round(seconds, 4), 'nodes_per_second': throughput(len(nodes), seconds)}
+
+    # 保存
+    def persist():
+        index.storage_context.persist(persist_dir=persist_dir)
+        sparse_index.save(persist_dir)
+
+    _, seconds = timed(persist)
+    stages['persist'] = {'seconds': round(seconds, 4), 'bytes': directory_bytes(persist_dir)}
+
+    # ロード（検索用と同じく読み取り専用で開く）
+    def load():
+        storage_context = load_storage_context(persist_dir, read_only=True)
+        return load_index_from_storage(storage_context, embed_model=embed_model)
+
+    loaded_index, seconds = timed(load)
+    stages['load_index'] = {'seconds': round(seconds, 4)}
+
+    for stage, values in stages.items():
+        print(f"  {stage}: {values['seconds']:.3f}秒")
+
+    # 検索・質問応答のレイテンシ（キャッシュは無効にし、毎回エンベディングと検索を行う）
+    queries = generate_queries(args.warmup + args.num_queries, seed=args.seed)
+    warmup_queries, measured_queries = queries[:args.warmup], queries[args.warmup:]
+    retrieval = {}
+    query = {}
+    for top_k in args.top_k:
+        retriever = create_retriever(
+            loaded_index, QueryCache(0, 0), index_version='benchmark', similarity_top_k=top_k,
+            embed_model=embed_model, persist_dir=persist_dir, mode=args.retrieval_mode
+        )
+        measure_latencies(retriever.retrieve, warmup_queries)
+        retrieval[str(top_k)] = latency_summary(measure_latencies(retriever.retrieve, measured_queries))
+
+        # LLMはスタブを使い、検索からプロンプト組み立てまでのパイプライン全体を計測する
+        pipeline = QueryPipeline(
+            retriever=retriever, llm=MockLLM(max_tokens=args.llm_tokens), node_postprocessors=[ContextPacker()]
+        )
+        chat = lambda message: pipeline.chat(message, ChatMemoryBuffer.from_defaults(token_limit=4096))
+        query[str(top_k)] = latency_summary(measure_latencies(chat, measured_queries[:args.num_pipeline_queries]))
+        print(f"  検索 top_k={top_k}: p50 {retrieval[str(top_k)]['p50_ms']:.2f}ms, "
+              f"p95 {retrieval[str(top_k)]['p95_ms']:.2f}ms, p99 {retrieval[str(top_k)]['p99_ms']:.2f}ms"
+              f"（質問応答 p50 {query[str(top_k)]['p50_ms']:.2f}ms）")
+
+    return {
+        'num_docs': num_docs,
+        'num_pages': num_docs * args.pages,
+        'num_documents': len(documents),
+        'num_nodes': len(nodes),
+        'chunks': chunk_report(nodes),
+        'corpus_bytes': corpus_bytes,
+        'stages': stages,
+        'retrieval': retrieval,
+        'query': query,
+    }
+
+def print_regressions(regressions, threshold):
+    """基準より遅くなった指標を表示する関数"""
+    if not regressions:
+        print(f"\n基準と比べて{threshold:.0%}以上遅くなった指標はありません。")
+        return
+    print(f"\n基準と比べて{threshold:.0%}以上遅くなった指標: {len(regressions)}件")
+    for name, baseline_value, current_value, ratio in regressions:
+        print(f"  {name}: {baseline_value} → {current_value}（+{ratio:.0%}）")
+
+def main():
+    # コマンドライン引数の解析
+    parser = argparse.ArgumentParser(description='RAGシステム ベンチマーク（合成コーパスでインデックス作成と検索を計測）')
+    parser.add_argument('--sizes', type=parse_int_list, default=[100, 1000], help='コーパスの文書数（カンマ区切り）')
+    parser.add_argument('--pages', type=int, default=3, help='1文書あたりのページ数')
+    parser.add_argument('--format', choices=['pdf', 'txt'], default='pdf', help='合成コーパスのファイル形式')
+    parser.add_argument('--top-k', type=parse_int_list, default=[1, 5, 10], help='検索する件数（カンマ区切り）')
+    parser.add_argument('--num-queries', type=int, default=200, help='レイテンシを計測するクエリ数')
+    parser.add_argument('--num-pipeline-queries', type=int, default=50, help='質問応答全体を計測するクエリ数')
+    parser.add_argument('--warmup', type=int, default=10, help='計測前に実行するクエリ数')
+    parser.add_argument('--embed-model', choices=['hashing', 'hf'], default='hashing',
+                        help='エンベディング（hashing: モデル不要のスタブ / hf: 設定のHuggingFaceモデル）')
+    parser.add_argument('--embed-batch-size', type=int, default=EMBED_BATCH_SIZE, help='エンベディングのバッチサイズ')
+    parser.add_argument('--llm-tokens', type=int, default=64, help='スタブLLMが生成するトークン数')
+    parser.add_argument('--index-type', default=VECTOR_INDEX_TYPE, help='FAISSインデックスの種類')
+    parser.add_argument('--quantization', choices=QUANTIZATION_TYPES, default=VECTOR_QUANTIZATION,
+                        help='ベクトルの圧縮方式')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='チャンクのトークン数')
+    parser.add_argument('--chunk-overlap', type=int, default=CHUNK_OVERLAP, help='隣り合うチャンクの重なりのトークン数')
+    parser.add_argument('--retrieval-mode', choices=RETRIEVAL_MODES, default=RETRIEVAL_MODE, help='検索方式')
+    parser.add_argument('--num-workers', type=int, default=LOADER_NUM_WORKERS, help='PDF解析に使うプロセス数')
+    parser.add_argument('--seed', type=int, default=0, help='合成コーパスの乱数シード')
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help='結果の出力先（JSON）')
+    parser.add_argument('--compare', help='比較する基準の結果ファイル（遅くなった指標があれば終了コード1）')
+    parser.add_argument('--threshold', type=float, default=0.2, help='遅くなったとみなす割合')
+    parser.add_argument('--work-dir', help='コーパスとインデックスの作成先（省略時は一時ディレクトリ、終了時に削除）')
+    args = parser.parse_args()
+
+    baseline = load_results(args.compare) if args.compare else None
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='rag_benchmark_')
+    print("=== RAGシステム ベンチマーク ===")
+    print(f"作業ディレクトリ: {work_dir}")
+
+    embed_model = create_benchmark_embed_model(args.embed_model, args.embed_batch_size)
+    # トークナイザーの初回ロードを計測に含めないよう、先に一度チャンク分割とエンベディングを行う
+    node_parser = create_node_parser(args.chunk_size, args.chunk_overlap)
+    warmup_nodes = node_parser.get_nodes_from_documents([Document(text="ベンチマークの準備。")])
+    embed_model.get_text_embedding_batch([node.get_content() for node in warmup_nodes])
+    results = {
+        'schema_version': BENCHMARK_SCHEMA_VERSION,
+        'environment': environment_info(),
+        'config': {
+            'sizes': args.sizes,
+            'pages_per_doc': args.pages,
+            'format': args.format,
+            'top_k': args.top_k,
+            'num_queries': args.num_queries,
+            'num_pipeline_queries': args.num_pipeline_queries,
+            'embed_model': args.embed_model,
+            'embed_batch_size': args.embed_batch_size,
+            'chunk_size': args.chunk_size,
+            'chunk_overlap': args.chunk_overlap,
+            'index_type': args.index_type,
+            'quantization': args.quantization,
+            'retrieval_mode': args.retrieval_mode,
+            'num_workers': args.num_workers,
+            'seed': args.seed,
+        },
+        'runs': [],
+    }
+    try:
+        for num_docs in args.sizes:
+            results['runs'].append(benchmark_corpus(num_docs, work_dir, embed_model, node_parser, args))
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    save_results(args.output, results)
+    print(f"\n結果を {args.output} に保存しました")
+
+    if baseline is not None:
+        if baseline.get('config') != results['config']:
+            print("警告: 基準の結果とベンチマークの設定が異なります。")
+        regressions = compare_results(baseline, results, threshold=args.threshold)
+        print_regressions(regressions, args.threshold)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,70 +1,124 @@
-from llama_index.core import StorageContext, load_index_from_storage
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from config import INDEX_DIR, EMBED_MODEL_NAME
+from config import INDEX_DIR
+from utils.manifest import current_index_dir
+from utils.startup import StartupReport, load_persisted_index
+import argparse
 import os
 
-def check_index():
+TEST_QUERY = "このプロジェクトについて教えてください"
+
+def collect_index_info(index):
+    """ロード済みのインデックスの診断情報を辞書で返す関数（query_daemon.pyからも使用する）"""
+    from utils.blob_store import list_node_ids
+    from utils.vector_store import get_base_index
+
+    faiss_index = index.vector_store.client
+    info = {
+        "index_type": type(index).__name__,
+        "faiss_type": type(get_base_index(faiss_index)).__name__,
+        "vector_count": faiss_index.ntotal,
+        "node_count": None,
+        "sample_node": None,
+    }
+
+    # ノード数の確認
+    if hasattr(index, 'docstore'):
+        node_ids = list_node_ids(index.docstore)
+        info["node_count"] = len(node_ids)
+        if node_ids:
+            # サンプルノードの内容確認（全ノードは読み込まない）
+            sample_node = index.docstore.get_node(node_ids[0])
+            info["sample_node"] = {
+                "id": sample_node.id_,
+                "text": getattr(sample_node, 'text', None),
+                "metadata": getattr(sample_node, 'metadata', None) or {},
+            }
+
+    # シンプルなクエリのテスト
+    retriever = index.as_retriever(similarity_top_k=2)
+    info["query_results"] = [
+        {"text": node.text, "score": node.score, "metadata": node.metadata or {}}
+        for node in retriever.retrieve(TEST_QUERY)
+    ]
+    return info
+
+def print_index_info(info):
+    """診断情報を表示する関数"""
+    # インデックスの基本情報
+    print(f"\nインデックスタイプ: {info['index_type']}")
+    print(f"FAISSインデックス: {info['faiss_type']} (ベクトル数: {info['vector_count']})")
+
+    if info["node_count"] is not None:
+        print(f"ノード数: {info['node_count']}")
+
+    sample_node = info["sample_node"]
+    if sample_node:
+        print(f"\nサンプルノード:")
+        print(f"  ID: {sample_node['id']}")
+        if sample_node['text'] is not None:
+            print(f"  テキスト長: {len(sample_node['text'])} 文字")
+            print(f"  テキストサンプル: {sample_node['text'][:100]}...")
+
+        # メタデータの確認
+        if sample_node['metadata']:
+            print(f"  メタデータ: {sample_node['metadata']}")
+
+    print("\nシンプルなクエリテスト:")
+    if info["query_results"]:
+        print(f"  結果数: {len(info['query_results'])}")
+        for i, node in enumerate(info["query_results"]):
+            print(f"  結果 {i+1}:")
+            print(f"    テキスト: {node['text'][:100]}...")
+            print(f"    スコア: {node['score']}")
+            if node['metadata']:
+                print(f"    メタデータ: {node['metadata']}")
+    else:
+        print("  クエリ結果がありません")
+
+def check_index(use_daemon=True):
     """インデックスの状態を診断する"""
     print("=== インデックス診断 ===")
-    
+
     if not os.path.exists(INDEX_DIR):
         print(f"エラー: インデックスディレクトリ '{INDEX_DIR}' が見つかりません")
         return
-    
+
     print(f"インデックスディレクトリ: {INDEX_DIR}")
-    print(f"ディレクトリ内のファイル: {os.listdir(INDEX_DIR)}")
-    
+    persist_dir = current_index_dir(INDEX_DIR)
+    if persist_dir != INDEX_DIR:
+        print(f"公開中のバージョン: {os.path.relpath(persist_dir, INDEX_DIR)}")
+    if os.path.isdir(persist_dir):
+        print(f"ディレクトリ内のファイル: {os.listdir(persist_dir)}")
+
     try:
-        print("\nエンベディングモデルを初期化しています...")
-        embed_model = HuggingFaceEmbedding(model_name=EMBED_MODEL_NAME)
-        
-        print("\nインデックスをロードしています...")
-        storage_context = StorageContext.from_defaults(persist_dir=INDEX_DIR)
-        index = load_index_from_storage(storage_context, embed_model=embed_model)
-        
-        # インデックスの基本情報
-        print(f"\nインデックスタイプ: {type(index).__name__}")
-        
-        # ノード数の確認
-        if hasattr(index, 'docstore'):
-            nodes = list(index.docstore.docs.values())
-            print(f"ノード数: {len(nodes)}")
-            
-            if nodes:
-                # サンプルノードの内容確認
-                sample_node = nodes[0]
-                print(f"\nサンプルノード:")
-                print(f"  ID: {sample_node.id_}")
-                if hasattr(sample_node, 'text'):
-                    print(f"  テキスト長: {len(sample_node.text)} 文字")
-                    print(f"  テキストサンプル: {sample_node.text[:100]}...")
-                
-                # メタデータの確認
-                if hasattr(sample_node, 'metadata') and sample_node.metadata:
-                    print(f"  メタデータ: {sample_node.metadata}")
-        
-        # シンプルなクエリのテスト
-        print("\nシンプルなクエリテスト:")
-        retriever = index.as_retriever(similarity_top_k=2)
-        nodes = retriever.retrieve("このプロジェクトについて教えてください")
-        
-        if nodes:
-            print(f"  結果数: {len(nodes)}")
-            for i, node in enumerate(nodes):
-                print(f"  結果 {i+1}:")
-                if hasattr(node, 'text'):
-                    print(f"    テキスト: {node.text[:100]}...")
-                if hasattr(node, 'score'):
-                    print(f"    スコア: {node.score}")
-                if hasattr(node, 'metadata') and node.metadata:
-                    print(f"    メタデータ: {node.metadata}")
+        startup = StartupReport()
+        daemon = None
+        if use_daemon:
+            from utils.daemon_client import connect_daemon
+            with startup.stage('daemon'):
+                daemon = connect_daemon(INDEX_DIR)
+
+        if daemon is not None:
+            # デーモンがロード済みのインデックスを診断する
+            print(f"\nデーモン（{daemon.url}）のインデックスを診断します")
+            info = daemon.index_info()
+            print(startup.summary())
         else:
-            print("  クエリ結果がありません")
-            
+            print("\nインデックスとエンベディングモデルをロードしています...")
+            index = load_persisted_index(persist_dir, startup)
+            if index is None:
+                return
+            print(startup.summary())
+            info = collect_index_info(index)
+
+        print_index_info(info)
+
     except Exception as e:
         print(f"\nエラーが発生しました: {e}")
         import traceback
         traceback.print_exc()
 
 if __name__ == "__main__":
-    check_index()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='インデックスの状態を診断する')
+    parser.add_argument('--no-daemon', action='store_true', help='クエリデーモンに接続せず、インデックスをロードして診断する')
+    args = parser.parse_args()
+    check_index(use_daemon=not args.no_daemon)
@@ -6,6 +6,44 @@ load_dotenv()
 PDF_DIR = os.getenv('PDF_DIR')
 INDEX_DIR = os.getenv('INDEX_DIR')
 EMBED_MODEL_NAME = 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2'
+EMBED_DIM = 384
+
+# エンベディング計算の設定（CPUではバッチサイズとスレッド数が再構築時間に大きく影響する）
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', '64'))
+# torchのスレッド数（0の場合はtorchの既定値）
+EMBED_NUM_THREADS = int(os.getenv('EMBED_NUM_THREADS', '0'))
+# 使用するデバイス（cpu / cuda / mps、未指定なら自動選択）
+EMBED_DEVICE = os.getenv('EMBED_DEVICE') or None
+
+# エンベディングの永続キャッシュ（チャンク内容が同じなら再計算しない）
+EMBED_CACHE_PATH = os.getenv(
+    'EMBED_CACHE_PATH',
+    os.path.join(INDEX_DIR, 'embedding_cache.sqlite') if INDEX_DIR else 'embedding_cache.sqlite'
+)
+
+# main.pyが残すインデックスのバージョン数（INDEX_DIR/versions/以下、公開中のものを含む）
+INDEX_KEEP_VERSIONS = int(os.getenv('INDEX_KEEP_VERSIONS', '2'))
+# Webインターフェースが新しいバージョンの公開を確認する間隔（秒、0で確認しない）
+INDEX_WATCH_INTERVAL = float(os.getenv('INDEX_WATCH_INTERVAL', '5'))
+
+# FAISSインデックスの種類: flat（厳密検索）/ ivf（クラスタ分割）/ hnsw（グラフ探索）
+VECTOR_INDEX_TYPE = os.getenv('VECTOR_INDEX_TYPE', 'flat').lower()
+IVF_NLIST = int(os.getenv('IVF_NLIST', '1024'))
+IVF_NPROBE = int(os.getenv('IVF_NPROBE', '16'))
+HNSW_M = int(os.getenv('HNSW_M', '32'))
+HNSW_EF_CONSTRUCTION = int(os.getenv('HNSW_EF_CONSTRUCTION', '200'))
+HNSW_EF_SEARCH = int(os.getenv('HNSW_EF_SEARCH', '64'))
+# 検索専用で読み込む場合にベクトルをmmapで参照する（起動が速く、複数プロセスでページキャッシュを共有できる）
+VECTOR_MMAP = os.getenv('VECTOR_MMAP', 'true').lower() in ('1', 'true', 'yes')
+# ベクトルの圧縮: none（float32のまま）/ int8（スカラー量子化、1/4のサイズ）/ pq（直積量子化、PQ_Mバイト/ベクトル）
+VECTOR_QUANTIZATION = os.getenv('VECTOR_QUANTIZATION', 'none').lower()
+PQ_M = int(os.getenv('PQ_M', '48'))
+# 圧縮時は上位 top_k × RERANK_FACTOR 件の候補をディスク上の元のベクトルで再スコアリングする（0で無効）
+RERANK_FACTOR = int(os.getenv('RERANK_FACTOR', '4'))
+
+# PDF解析の並列数（2以上でプロセスプールを使用）と1ファイルあたりのタイムアウト秒数
+LOADER_NUM_WORKERS = int(os.getenv('LOADER_NUM_WORKERS', '1'))
+LOADER_FILE_TIMEOUT = float(os.getenv('LOADER_FILE_TIMEOUT', '300'))
 
 # Dockerの場合は環境変数からOllamaのホスト名を取得
 OLLAMA_HOST = os.getenv('OLLAMA_HOST', 'localhost')
@@ -13,4 +51,103 @@ OLLAMA_PORT = os.getenv('OLLAMA_PORT', '11434')
 LLM_MODEL = 'mistral:7b'
 
 # Ollama APIのベースURLを構築
-OLLAMA_BASE_URL = f"http://{OLLAMA_HOST}:{OLLAMA_PORT}"
\ No newline at end of file
+OLLAMA_BASE_URL = f"http://{OLLAMA_HOST}:{OLLAMA_PORT}"
+
+# Ollamaへの同時生成数（Ollama側のOLLAMA_NUM_PARALLELに合わせる）と、順番待ちできるリクエスト数・待ち時間の上限
+OLLAMA_MAX_CONCURRENCY = int(os.getenv('OLLAMA_MAX_CONCURRENCY', '2'))
+OLLAMA_MAX_QUEUE = int(os.getenv('OLLAMA_MAX_QUEUE', '32'))
+OLLAMA_QUEUE_TIMEOUT = float(os.getenv('OLLAMA_QUEUE_TIMEOUT', '120'))
+OLLAMA_REQUEST_TIMEOUT = float(os.getenv('OLLAMA_REQUEST_TIMEOUT', '600'))
+
+# クエリのエンベディングと検索結果のキャッシュ件数
+QUERY_EMBED_CACHE_SIZE = int(os.getenv('QUERY_EMBED_CACHE_SIZE', '1024'))
+RETRIEVAL_CACHE_SIZE = int(os.getenv('RETRIEVAL_CACHE_SIZE', '1024'))
+
+# Webインターフェースのセッション管理（アイドルセッションはLRU + TTLで破棄）
+SESSION_MAX_COUNT = int(os.getenv('SESSION_MAX_COUNT', '256'))
+SESSION_TTL_SECONDS = int(os.getenv('SESSION_TTL_SECONDS', '3600'))
+
+# Webサーバー（serve.py）の設定: ワーカープロセス数・ワーカーあたりのスレッド数・終了時に処理中のリクエストを待つ秒数
+WEB_HOST = os.getenv('WEB_HOST', '0.0.0.0')
+WEB_PORT = int(os.getenv('WEB_PORT', '5000'))
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', '2'))
+WEB_THREADS = int(os.getenv('WEB_THREADS', '8'))
+WEB_GRACEFUL_TIMEOUT = int(os.getenv('WEB_GRACEFUL_TIMEOUT', '30'))
+# ワーカーを起動する前にインデックスをロードし、メモリをワーカー間で共有する（copy-on-write）
+WEB_PRELOAD = os.getenv('WEB_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+
+# 処理段階ごとのスパン（実行時間・件数・トークン数）をJSONで1行ずつ出力する先（stderr / stdout / ファイルパス、空なら出力しない）
+TRACE_LOG = os.getenv('TRACE_LOG', '')
+
+# バッチ質問応答（batch_qa.py）でまとめて検索する質問数とLLMへの同時リクエスト数
+BATCH_SIZE = int(os.getenv('BATCH_SIZE', '32'))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '2'))
+
+# 検索方式: vector（ベクトル検索のみ）/ hybrid（ベクトル検索 + BM25をRRFで統合）
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'hybrid').lower()
+HYBRID_DENSE_WEIGHT = float(os.getenv('HYBRID_DENSE_WEIGHT', '1.0'))
+HYBRID_SPARSE_WEIGHT = float(os.getenv('HYBRID_SPARSE_WEIGHT', '1.0'))
+HYBRID_RRF_K = int(os.getenv('HYBRID_RRF_K', '60'))
+# 統合前にそれぞれの検索で取得する候補数
+HYBRID_CANDIDATE_K = int(os.getenv('HYBRID_CANDIDATE_K', '20'))
+BM25_K1 = float(os.getenv('BM25_K1', '1.2'))
+BM25_B = float(os.getenv('BM25_B', '0.75'))
+
+# クロスエンコーダーによる再ランキング（検索した候補をクエリとの組で採点し直し、上位のみをLLMに渡す）
+RERANKER_ENABLED = os.getenv('RERANKER_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+RERANKER_MODEL = os.getenv('RERANKER_MODEL', 'cross-encoder/mmarco-mMiniLMv2-L12-H384-v1')
+# 採点する候補数（検索で取得する件数）と、LLMに渡す件数
+RERANKER_CANDIDATES = int(os.getenv('RERANKER_CANDIDATES', '20'))
+RERANKER_TOP_N = int(os.getenv('RERANKER_TOP_N', '3'))
+RERANKER_BATCH_SIZE = int(os.getenv('RERANKER_BATCH_SIZE', '16'))
+RERANKER_MAX_LENGTH = int(os.getenv('RERANKER_MAX_LENGTH', '512'))
+# 1クエリあたりの採点時間の上限（ミリ秒、0で無制限）。超えそうな場合は候補を検索順位の上位に絞る
+RERANKER_TIME_BUDGET_MS = float(os.getenv('RERANKER_TIME_BUDGET_MS', '300'))
+# このスコア（0〜1）未満の候補はLLMに渡さない（0で無効）
+RERANKER_MIN_SCORE = float(os.getenv('RERANKER_MIN_SCORE', '0'))
+RERANKER_CACHE_SIZE = int(os.getenv('RERANKER_CACHE_SIZE', '4096'))
+
+# LLMに渡すコンテキストの組み立て（重複除去・隣接チャンクの連結・トークン数の上限）
+# CPUではプロンプトのトークン数がそのまま最初のトークンまでの時間（prefill）になる
+LLM_CONTEXT_WINDOW = int(os.getenv('LLM_CONTEXT_WINDOW', '4096'))
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '1536'))
+# トークン数を数えるトークナイザー（LLMと同じもののディレクトリまたはHugging Faceのモデル名、空ならLlamaIndexの既定）
+# Mistralのリポジトリは利用規約への同意が必要で、起動のたびにダウンロードに失敗するため既定では使わない
+CONTEXT_TOKENIZER = os.getenv('CONTEXT_TOKENIZER', '')
+# 文字3-gramのJaccard係数がこの値以上のチャンクは重複とみなす（0で無効）
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv('CONTEXT_DEDUP_THRESHOLD', '0.85'))
+# 残りのトークン数がこれ未満になったらチャンクを追加しない
+CONTEXT_MIN_TOKENS = int(os.getenv('CONTEXT_MIN_TOKENS', '64'))
+
+# チャンク分割（LlamaIndexの既定のトークナイザーのトークン数）。日本語ではおよそ1トークン1文字
+CHUNK_SIZE = int(os.getenv('CHUNK_SIZE', '256'))
+CHUNK_OVERLAP = int(os.getenv('CHUNK_OVERLAP', '32'))
+# 分割済みのノードのキャッシュ（内容が同じファイルはPDFの解析とチャンク分割を省略する）
+NODE_CACHE_PATH = os.getenv(
+    'NODE_CACHE_PATH',
+    os.path.join(INDEX_DIR, 'node_cache.sqlite') if INDEX_DIR else 'node_cache.sqlite'
+)
+
+# フォルダ・ファイル名・日付による絞り込み検索で、条件ごとの対象ノードを保持する件数
+FACET_FILTER_CACHE_SIZE = int(os.getenv('FACET_FILTER_CACHE_SIZE', '256'))
+
+# 言い換えの質問に対する回答のキャッシュ（LLMの生成を省略する）
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+ANSWER_CACHE_PATH = os.getenv(
+    'ANSWER_CACHE_PATH',
+    os.path.join(INDEX_DIR, 'answer_cache.sqlite') if INDEX_DIR else 'answer_cache.sqlite'
+)
+# 質問のエンベディングのコサイン類似度がこの値以上で、検索されたノードが同じなら同じ質問とみなす
+ANSWER_CACHE_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', '0.95'))
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', '1000'))
+
+# クエリデーモン（query_daemon.py）: インデックス・エンベディングモデル・LLMをロードしたまま待ち受け、
+# interactive_rag.py・advanced_rag.py・check_index.pyはデーモンが起動していればそれに接続する
+DAEMON_HOST = os.getenv('DAEMON_HOST', '127.0.0.1')
+DAEMON_PORT = int(os.getenv('DAEMON_PORT', '5100'))
+DAEMON_URL = os.getenv('DAEMON_URL', f'http://{DAEMON_HOST}:{DAEMON_PORT}')
+# falseの場合、CLIはデーモンに接続せず自分でインデックスをロードする
+DAEMON_ENABLED = os.getenv('DAEMON_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# デーモンが起動しているかを確認する際の待ち時間（秒）と、質問1件の応答を待つ時間（秒）
+DAEMON_CONNECT_TIMEOUT = float(os.getenv('DAEMON_CONNECT_TIMEOUT', '0.5'))
+DAEMON_REQUEST_TIMEOUT = float(os.getenv('DAEMON_REQUEST_TIMEOUT', '900'))
@@ -1,47 +1,34 @@
-from llama_index.core import VectorStoreIndex, StorageContext, load_index_from_storage
-from llama_index.core.chat_engine import ContextChatEngine
-from llama_index.core.memory import ChatMemoryBuffer
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from config import INDEX_DIR, LLM_MODEL, EMBED_MODEL_NAME
+from config import INDEX_DIR, LLM_MODEL, EMBED_MODEL_NAME, QUERY_EMBED_CACHE_SIZE, RETRIEVAL_CACHE_SIZE
+from utils.manifest import current_index_dir, get_index_version
+from utils.startup import StartupReport, load_persisted_index
+from utils.tracing import span, format_timings, print_cache_stats
+import argparse
 import os
 import time
 
-# llm_integration.pyからOllamaモデル取得関数をインポート
-from llm_integration import get_ollama_llm
+# llama_index・torch・Ollamaのクライアントなどの重いモジュールは、インデックスの存在を確認した後に読み込む
 
-def load_index():
-    """インデックスをロードする関数"""
+def load_index(index_dir, startup=None):
+    """インデックスをロードする関数（エンベディングモデルはインデックスが存在する場合のみ初期化する）"""
     start_time = time.time()
+    startup = startup or StartupReport()
     
-    if not os.path.exists(INDEX_DIR):
-        print(f"エラー: インデックスディレクトリ '{INDEX_DIR}' が見つかりません。")
-        print("先にmain.pyを実行してインデックスを作成してください。")
+    print(f"インデックスとエンベディングモデル（{EMBED_MODEL_NAME}）をロードしています...")
+    index = load_persisted_index(index_dir, startup)
+    if index is None:
         return None
     
     try:
-        # エンベディングモデルの設定（インデックスロード時にも必要）
-        print(f"エンベディングモデルを初期化しています: {EMBED_MODEL_NAME}")
-        embed_model = HuggingFaceEmbedding(model_name=EMBED_MODEL_NAME)
-        
-        # エンベディングモデルを指定してStorageContextを作成
-        print("インデックスストレージをロードしています...")
-        storage_context = StorageContext.from_defaults(persist_dir=INDEX_DIR)
-        
-        # エンベディングモデルを指定してインデックスをロード
-        print("インデックスをロードしています...")
-        index = load_index_from_storage(
-            storage_context,
-            embed_model=embed_model
-        )
+        from utils.blob_store import list_node_ids
         
         # インデックス情報の表示
         if hasattr(index, 'docstore'):
-            nodes = list(index.docstore.docs.values())
-            print(f"ロードされたノード数: {len(nodes)}")
+            node_ids = list_node_ids(index.docstore)
+            print(f"ロードされたノード数: {len(node_ids)}")
             
-            if nodes:
-                # サンプルノードの内容確認
-                sample_node = nodes[0]
+            if node_ids:
+                # サンプルノードの内容確認（全ノードは読み込まない）
+                sample_node = index.docstore.get_node(node_ids[0])
                 print(f"\nサンプルノード:")
                 print(f"  ID: {sample_node.id_}")
                 if hasattr(sample_node, 'text'):
@@ -51,20 +38,39 @@ def load_index():
         print(f"インデックスロード時間: {end_time - start_time:.2f}秒")
         return index
     except Exception as e:
-        print(f"インデックスのロード中にエラーが発生しました: {e}")
+        print(f"インデックスの確認中にエラーが発生しました: {e}")
         import traceback
         traceback.print_exc()
         return None
 
-def create_chat_engine(index):
-    """チャットエンジンを作成する関数"""
+# システムプロンプトを短くして軽量化
+SYSTEM_PROMPT = (
+    "あなたは簡潔に日本語で応答するアシスタントです。"
+    "情報源に基づいて短く答えてください。"
+    "情報源にない内容についてはわからないとだけ答えてください。"
+)
+
+def create_query_pipeline(index, index_dir, query_cache=None):
+    """クエリパイプラインを作成する関数（index_dirはインデックスをロードした公開中のバージョンのディレクトリ）"""
     if index is None:
         return None
     
     try:
-        # インデックスからretrieverを作成
+        from llm_integration import get_ollama_llm
+        from utils.query_cache import QueryCache
+        from utils.hybrid_retriever import create_retriever
+        from utils.query_pipeline import QueryPipeline
+        from utils.context_packer import create_context_packer
+        
+        # インデックスからretrieverを作成（同じ質問の再計算を避けるためキャッシュ付き）
         print("Retrieverを作成しています...")
-        retriever = index.as_retriever(similarity_top_k=2)  # 類似ドキュメント数を2に減らす
+        retriever = create_retriever(
+            index,
+            query_cache or QueryCache(QUERY_EMBED_CACHE_SIZE, RETRIEVAL_CACHE_SIZE),
+            index_version=get_index_version(index_dir),
+            similarity_top_k=2,  # 類似ドキュメント数を2に減らす
+            persist_dir=index_dir
+        )
         
         # LLMの設定
         print("LLMを初期化しています...")
@@ -72,47 +78,105 @@ def create_chat_engine(index):
         if llm is None:
             return None
         
-        # チャットメモリの設定
-        print("チャットメモリを設定しています...")
-        memory = ChatMemoryBuffer.from_defaults(token_limit=2048)  # メモリサイズを縮小
-        
-        # システムプロンプトを短くして軽量化
-        system_prompt = (
-            "あなたは簡潔に日本語で応答するアシスタントです。"
-            "情報源に基づいて短く答えてください。"
-            "情報源にない内容についてはわからないとだけ答えてください。"
-        )
-        
-        print("チャットエンジンを構築しています...")
-        # コンテキストチャットエンジンの設定
-        chat_engine = ContextChatEngine.from_defaults(
+        print("クエリパイプラインを構築しています...")
+        return QueryPipeline(
             retriever=retriever,
             llm=llm,
-            memory=memory,
-            context_prompt=system_prompt,
+            node_postprocessors=[create_context_packer()],
+            system_prompt=SYSTEM_PROMPT,
             verbose=True
         )
-        
-        return chat_engine
     except Exception as e:
-        print(f"チャットエンジンの作成中にエラーが発生しました: {e}")
+        print(f"クエリパイプラインの作成中にエラーが発生しました: {e}")
         import traceback
         traceback.print_exc()
         return None
 
+def print_nodes(nodes):
+    """検索されたノードの情報を表示する関数"""
+    for i, node in enumerate(nodes):
+        print(f"  ノード {i+1}:")
+        if hasattr(node, 'metadata') and 'file_path' in node.metadata:
+            print(f"    ファイル: {os.path.basename(node.metadata['file_path'])}")
+        if hasattr(node, 'score'):
+            print(f"    スコア: {node.score}")
+        if hasattr(node, 'text'):
+            print(f"    テキスト長: {len(node.text)} 文字")
+
 def main():
-    # インデックスのロード
+    parser = argparse.ArgumentParser(description='RAGチャットシステム')
+    parser.add_argument('--no-daemon', action='store_true', help='クエリデーモンに接続せず、インデックスをロードする')
+    args = parser.parse_args()
+    startup = StartupReport()
+    
+    # クエリデーモンが起動していれば、ロード済みのインデックス・モデルを使う
+    daemon = None
+    if not args.no_daemon:
+        from utils.daemon_client import connect_daemon
+        with startup.stage('daemon'):
+            daemon = connect_daemon(INDEX_DIR)
+    
+    if daemon is not None:
+        print(f"クエリデーモン（{daemon.url}）に接続しています...")
+        try:
+            session = daemon.open_session('interactive')
+        except Exception as e:
+            print(f"クエリデーモンでエラーが発生しました: {e}")
+            return
+        
+        def answer(user_input):
+            # 検索とLLM呼び出しはデーモンで行い、検索されたノードは回答と一緒に受け取る
+            print("関連ドキュメントを検索し、回答を生成中...")
+            response_obj = session.chat(user_input)
+            print(f"検索結果: {len(response_obj.source_nodes)}件のドキュメントが見つかりました")
+            print_nodes(response_obj.source_nodes)
+            return response_obj
+        
+        try:
+            chat_loop(answer, session, startup)
+        finally:
+            session.close()
+        return
+    
+    # インデックスのロード（公開中のバージョンは一度だけ解決し、検索用の索引も同じバージョンから読み込む）
     print("インデックスをロードしています...")
-    index = load_index()
+    index_dir = current_index_dir(INDEX_DIR)
+    index = load_index(index_dir, startup)
     if index is None:
         return
     
-    # チャットエンジンの作成
-    print("チャットエンジンを準備しています...")
-    chat_engine = create_chat_engine(index)
-    if chat_engine is None:
+    # クエリパイプラインの作成
+    print("クエリパイプラインを準備しています...")
+    with startup.stage('import'):
+        from llama_index.core.memory import ChatMemoryBuffer
+        from utils.query_cache import QueryCache
+    query_cache = QueryCache(QUERY_EMBED_CACHE_SIZE, RETRIEVAL_CACHE_SIZE)
+    with startup.stage('pipeline'):
+        pipeline = create_query_pipeline(index, index_dir, query_cache)
+    if pipeline is None:
         return
     
+    # チャットメモリの設定
+    print("チャットメモリを設定しています...")
+    memory = ChatMemoryBuffer.from_defaults(token_limit=2048)  # メモリサイズを縮小
+    
+    def answer(user_input):
+        # 1. 検索処理（ここで取得したノードをそのままLLMに渡す）
+        print("関連ドキュメントを検索中...")
+        nodes, timer = pipeline.retrieve(user_input)
+        print(f"検索時間: {format_timings(timer.timings)}")
+        print(f"検索結果: {len(nodes)}件のドキュメントが見つかりました")
+        print_nodes(nodes)
+        
+        # 2. LLM呼び出し
+        print("LLMによる回答生成中...")
+        return pipeline.generate(user_input, nodes, memory, timer)
+    
+    chat_loop(answer, query_cache, startup)
+
+def chat_loop(answer, cache_stats_source, startup):
+    """質問を受け付けて回答を表示するループ（answerは質問を受け取って回答の結果を返す関数）"""
+    print(startup.summary())
     print("\n=== RAGチャットシステム ===")
     print("質問を入力してください。終了するには 'exit' または 'quit' と入力してください。")
     
@@ -122,6 +186,8 @@ def main():
         
         # 終了コマンドのチェック
         if user_input.lower() in ["exit", "quit", "終了"]:
+            print("キャッシュ統計:")
+            print_cache_stats(cache_stats_source)
             print("チャットを終了します。")
             break
         
@@ -133,39 +199,11 @@ def main():
             # デバッグ情報
             print("クエリを処理しています...")
             
-            # 1. 検索処理
-            print("関連ドキュメントを検索中...")
-            search_start_time = time.time()
-            nodes = chat_engine._retriever.retrieve(user_input)
-            search_end_time = time.time()
-            print(f"検索時間: {search_end_time - search_start_time:.2f}秒")
-            print(f"検索結果: {len(nodes)}件のドキュメントが見つかりました")
-            
-            # ノード情報の表示
-            for i, node in enumerate(nodes):
-                print(f"  ノード {i+1}:")
-                if hasattr(node, 'metadata') and 'file_path' in node.metadata:
-                    print(f"    ファイル: {os.path.basename(node.metadata['file_path'])}")
-                if hasattr(node, 'score'):
-                    print(f"    スコア: {node.score}")
-                if hasattr(node, 'text'):
-                    print(f"    テキスト長: {len(node.text)} 文字")
-            
-            # 2. 短いコンテキスト生成
-            context_text = "\n\n".join([node.get_text()[:500] for node in nodes])
-            print(f"生成されたコンテキスト（トークン数削減）: {len(context_text)}文字")
-            
-            # 3. LLM呼び出し
-            print("LLMによる回答生成中...")
-            llm_start_time = time.time()
-            
-            # チャットエンジンからの応答を取得
-            response_obj = chat_engine.chat(user_input)
-            
-            llm_end_time = time.time()
-            print(f"LLM応答時間: {llm_end_time - llm_start_time:.2f}秒")
+            with span('query'):
+                response_obj = answer(user_input)
+                print(f"処理時間: {format_timings(response_obj.timings)}")
             
-            print(f"\nアシスタント: {response_obj.response}")
+                print(f"\nアシスタント: {response_obj.response}")
             
             # 引用元の表示
             if hasattr(response_obj, 'source_nodes') and response_obj.source_nodes:
@@ -173,7 +211,8 @@ def main():
                 for i, node in enumerate(response_obj.source_nodes, 1):
                     if hasattr(node, 'metadata') and 'file_path' in node.metadata:
                         source = node.metadata['file_path']
-                        print(f"  {i}. {os.path.basename(source)}")
+                        page = node.metadata.get('page_label')
+                        print(f"  {i}. {os.path.basename(source)}" + (f"（ページ: {page}）" if page else ""))
                     else:
                         print(f"  {i}. 不明な情報源")
         except Exception as e:
@@ -182,4 +221,4 @@ def main():
             traceback.print_exc()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
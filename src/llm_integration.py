@@ -1,33 +1,94 @@
 from llama_index.llms.ollama import Ollama
+from ollama import Client
+from config import (
+    OLLAMA_MAX_CONCURRENCY, OLLAMA_MAX_QUEUE, OLLAMA_QUEUE_TIMEOUT, OLLAMA_REQUEST_TIMEOUT, LLM_CONTEXT_WINDOW
+)
+from utils.llm_gateway import LLMGateway, GatedLLM
+import httpx
 import os
+import threading
+
+# プロセス内で共有するHTTPクライアント・LLM・実行枠（エンジンやリクエストごとには作らない）
+_shared_lock = threading.Lock()
+_shared_clients = {}
+_shared_llms = {}
+_shared_gateway = None
+
+def get_ollama_host():
+    """環境変数からOllamaの接続先URLを取得する関数（デフォルトはlocalhost）"""
+    ollama_host = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+
+    # スキーム（http://）がない場合は追加
+    if not ollama_host.startswith(('http://', 'https://')):
+        ollama_host = f"http://{ollama_host}"
+
+    # ポート番号がない場合は追加
+    if not any(ollama_host.endswith(f":{port}") for port in ["11434"]) and ":" not in ollama_host.split("/")[-1]:
+        ollama_host = f"{ollama_host}:11434"
+    return ollama_host
+
+def get_llm_gateway():
+    """LLMへの同時リクエスト数を制限するゲートウェイを取得する関数（プロセスで1つ）"""
+    global _shared_gateway
+    with _shared_lock:
+        if _shared_gateway is None:
+            _shared_gateway = LLMGateway(
+                max_concurrency=OLLAMA_MAX_CONCURRENCY,
+                max_queue=OLLAMA_MAX_QUEUE,
+                queue_timeout=OLLAMA_QUEUE_TIMEOUT
+            )
+        return _shared_gateway
+
+def get_ollama_client(base_url):
+    """接続先ごとに共有するOllamaのHTTPクライアントを取得する関数（接続はkeep-aliveで再利用）"""
+    with _shared_lock:
+        if base_url not in _shared_clients:
+            # 生成の同時実行数に加え、モデル情報の取得などに使う分の接続を確保する
+            max_connections = OLLAMA_MAX_CONCURRENCY + 2
+            _shared_clients[base_url] = Client(
+                host=base_url,
+                timeout=httpx.Timeout(OLLAMA_REQUEST_TIMEOUT, connect=10.0),
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+            )
+        return _shared_clients[base_url]
+
+def close_ollama_clients():
+    """共有しているHTTPクライアントの接続を閉じる関数（終了時用）"""
+    with _shared_lock:
+        clients = list(_shared_clients.values())
+        _shared_clients.clear()
+        _shared_llms.clear()
+    for client in clients:
+        client._client.close()
 
 def get_ollama_llm(model_name="mistral:7b", temperature=0.1):
-    """Ollamaベースのモデルを取得する関数"""
+    """Ollamaベースのモデルを取得する関数
+
+    同じモデル・温度のLLMはプロセス内で共有し、全ての生成はLLMGatewayで同時実行数を制限する。
+    """
     try:
-        # 環境変数からOllamaのホストを取得（デフォルトはlocalhost）
-        ollama_host = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
-        
-        # スキーム（http://）がない場合は追加
-        if not ollama_host.startswith(('http://', 'https://')):
-            ollama_host = f"http://{ollama_host}"
-        
-        # ポート番号がない場合は追加
-        if not any(ollama_host.endswith(f":{port}") for port in ["11434"]) and ":" not in ollama_host.split("/")[-1]:
-            ollama_host = f"{ollama_host}:11434"
-            
+        ollama_host = get_ollama_host()
+        key = (ollama_host, model_name, temperature)
+        with _shared_lock:
+            if key in _shared_llms:
+                return _shared_llms[key]
+
         print(f"Ollama接続先: {ollama_host}")
-        
-        # タイムアウト設定を大幅に増やしたOllamaインスタンスを返す
-        return Ollama(
+
+        llm = Ollama(
             model=model_name,
             temperature=temperature,
             base_url=ollama_host,
-            request_timeout=600.0,  # タイムアウトを10分に延長
-            context_window=4096,    # コンテキストウィンドウサイズを明示的に設定
+            request_timeout=OLLAMA_REQUEST_TIMEOUT,
+            client=get_ollama_client(ollama_host),
+            context_window=LLM_CONTEXT_WINDOW,    # コンテキストウィンドウサイズを明示的に設定
             max_tokens=2048        # 最大生成トークン数を制限
         )
+        gated_llm = GatedLLM(llm, get_llm_gateway())
+        with _shared_lock:
+            return _shared_llms.setdefault(key, gated_llm)
     except Exception as e:
         print(f"Ollamaモデルの初期化中にエラーが発生しました: {e}")
         import traceback
         traceback.print_exc()
-        return None
\ No newline at end of file
+        return None
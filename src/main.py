@@ -1,71 +1,404 @@
-from llama_index.core import VectorStoreIndex
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from llama_index.core import VectorStoreIndex, StorageContext, load_index_from_storage
+from llama_index.core.schema import MetadataMode
 from utils.data_loader import load_documents
 from utils.metadata_handler import add_folder_metadata
-from config import INDEX_DIR, EMBED_MODEL_NAME
+from utils.manifest import (
+    scan_pdf_files, load_manifest, save_manifest, new_manifest, diff_manifest, update_manifest,
+    new_index_version, current_index_dir, version_dir, publish_index_version, remove_old_versions
+)
+from utils.vector_store import (
+    create_vector_store, load_storage_context, vector_store_exists, docstore_exists, supports_delete,
+    delete_documents, faiss_index_bytes, evaluate_quantization, QUANTIZATION_TYPES
+)
+from utils.blob_store import BlobDocumentStore, list_node_ids
+from utils.embedding_cache import EmbeddingCache, EmbeddingStats, embed_texts
+from utils.embed_model import create_embed_model
+from utils.sparse_index import SparseIndex
+from utils.facet_index import FacetIndex
+from utils.answer_cache import AnswerCache
+from utils.chunking import (
+    NodeCache, create_node_parser, chunking_signature, group_nodes_by_file, group_ref_doc_ids_by_file,
+    chunk_report, format_chunk_report
+)
+from utils.tracing import span
+from config import (
+    PDF_DIR, INDEX_DIR, EMBED_MODEL_NAME, EMBED_CACHE_PATH, VECTOR_INDEX_TYPE, LOADER_NUM_WORKERS,
+    EMBED_BATCH_SIZE, EMBED_NUM_THREADS, VECTOR_QUANTIZATION, PQ_M, RERANK_FACTOR,
+    BM25_K1, BM25_B, CHUNK_SIZE, CHUNK_OVERLAP, NODE_CACHE_PATH, ANSWER_CACHE_PATH, INDEX_KEEP_VERSIONS
+)
+import argparse
 import os
 import time
 
-def main():
-    start_time = time.time()
-    print("=== RAGシステム インデックス作成 ===")
-    
-    # フォルダの確認と作成
-    if not os.path.exists(INDEX_DIR):
-        os.makedirs(INDEX_DIR, exist_ok=True)
-        print(f"インデックスディレクトリを作成しました: {INDEX_DIR}")
+def index_exists(index_dir):
+    """永続化済みのインデックスが存在するか確認する関数"""
+    return docstore_exists(index_dir) and vector_store_exists(index_dir)
 
-    # ドキュメントの読み込み
-    print("ドキュメントを読み込んでいます...")
-    documents = load_documents()
-    if not documents:
-        print("警告: ドキュメントが読み込めませんでした。PDF_DIRの設定を確認してください。")
-        return
-    
-    print(f"読み込んだドキュメント数: {len(documents)}")
-    
-    # サンプルドキュメントの内容確認
+def print_sample_document(documents):
+    """サンプルドキュメントの内容を表示する関数"""
     sample_doc = documents[0]
     print(f"\nサンプルドキュメント:")
     print(f"  メタデータ: {sample_doc.metadata}")
     print(f"  テキスト長: {len(sample_doc.text)} 文字")
     print(f"  テキストサンプル: {sample_doc.text[:200]}...")
 
-    # メタデータの追加
-    print("\nメタデータを追加しています...")
-    documents = add_folder_metadata(documents)
+def embed_nodes(nodes, embed_model, embed_cache=None, embed_stats=None):
+    """ノードのエンベディングをまとめて計算する関数（キャッシュがあれば再利用）"""
+    texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+    with span('embed_documents', chunks=len(texts)) as embed_span:
+        embeddings = embed_texts(
+            texts, embed_model, cache=embed_cache, show_progress=True,
+            stats=embed_stats, batch_size=embed_model.embed_batch_size
+        )
+        if embed_cache is not None:
+            embed_span.set(cache_hits=embed_cache.hits, cache_misses=embed_cache.misses)
+    for node, embedding in zip(nodes, embeddings):
+        node.embedding = embedding
+    return embeddings
 
-    # エンベディングモデルの設定
-    print(f"エンベディングモデルを初期化しています: {EMBED_MODEL_NAME}")
-    embed_model = HuggingFaceEmbedding(model_name=EMBED_MODEL_NAME)
+def load_and_prepare_documents(file_entries, num_workers):
+    """ドキュメントを読み込んでメタデータを追加する関数"""
+    with span('load_documents', files=len(file_entries)) as load_span:
+        documents = load_documents(input_files=[entry['path'] for entry in file_entries], num_workers=num_workers)
+        load_span.set(documents=len(documents))
+    if documents:
+        with span('add_metadata'):
+            documents = add_folder_metadata(documents)
+    return documents
 
-    # インデックスの作成（エンベディングモデルを明示的に指定）
-    print("インデックスを作成しています...")
-    index_start_time = time.time()
-    index = VectorStoreIndex.from_documents(
-        documents,
-        embed_model=embed_model
+def split_documents(documents, node_parser):
+    """ドキュメントをチャンク（ノード）に分割する関数"""
+    with span('chunk', documents=len(documents)) as chunk_span:
+        nodes = node_parser.get_nodes_from_documents(documents)
+        chunk_span.set(nodes=len(nodes))
+    return nodes
+
+def prepare_nodes(file_entries, num_workers, node_parser, node_cache=None):
+    """ファイルを読み込んでチャンクに分割する関数
+
+    ノードのキャッシュにハッシュが一致するファイルがあれば、PDFの解析と分割を省略してキャッシュのノードを使う。
+    (ノード, 新たに読み込んだドキュメント, 読み込めたファイルのエントリ) を返す。ノードはfile_entriesの順に並べる。
+    読み込みに失敗したファイルはエントリに含めず、マニフェストに記録しないことで次回に再試行する。
+    """
+    nodes_by_path = {}
+    if node_cache is not None:
+        with span('load_node_cache', files=len(file_entries)) as cache_span:
+            nodes_by_path = node_cache.get_many(file_entries)
+            cache_span.set(hits=len(nodes_by_path))
+    missing_entries = [entry for entry in file_entries if entry['path'] not in nodes_by_path]
+    if nodes_by_path:
+        print(f"分割済みのノードをキャッシュから読み込みました: {len(nodes_by_path)}ファイル")
+
+    documents = []
+    if missing_entries:
+        documents = load_and_prepare_documents(missing_entries, num_workers)
+        parsed_nodes = group_nodes_by_file(split_documents(documents, node_parser))
+        if node_cache is not None:
+            # 読み込みに失敗したファイルは次回に再試行するため保存しない
+            node_cache.put_many(
+                [(entry, parsed_nodes[entry['path']]) for entry in missing_entries if entry['path'] in parsed_nodes]
+            )
+        nodes_by_path.update(parsed_nodes)
+
+    loaded_paths = set(nodes_by_path) | {doc.metadata.get('file_path') for doc in documents}
+    loaded_entries = [entry for entry in file_entries if entry['path'] in loaded_paths]
+    nodes = [node for entry in file_entries for node in nodes_by_path.get(entry['path'], [])]
+    return nodes, documents, loaded_entries
+
+def print_chunk_report(nodes):
+    """チャンク数と長さの分布を表示する関数（検索の精度とエンベディングのコストの調整用）"""
+    with span('chunk_report', nodes=len(nodes)):
+        report = chunk_report(nodes)
+    print(format_chunk_report(report))
+
+def build_sparse_index(nodes):
+    """インデックスの全ノードからBM25の転置インデックスを作成する関数"""
+    return SparseIndex.build(
+        [node.node_id for node in nodes],
+        [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes],
+        k1=BM25_K1,
+        b=BM25_B
     )
+
+def build_facet_index(nodes, vector_store):
+    """インデックスの全ノードからフォルダ・ファイル名・日付で絞り込むための索引を作成する関数"""
+    node_ids = [node.node_id for node in nodes]
+    return FacetIndex.build(node_ids, [node.metadata for node in nodes], vector_store.faiss_ids(node_ids))
+
+def format_size(num_bytes):
+    """バイト数をMB単位の文字列にする関数"""
+    return f"{num_bytes / 1024 ** 2:.1f} MB"
+
+def print_quantization_report(vector_store, embeddings, node_ids, quantization):
+    """量子化したインデックスのメモリ使用量とrecall@kを表示する関数"""
+    exact_bytes = len(embeddings) * len(embeddings[0]) * 4
+    index_bytes = faiss_index_bytes(vector_store.client)
+    label = f"{quantization}（PQ_M={PQ_M}）" if quantization == 'pq' else quantization
+    print(f"\nベクトルの量子化: {label}")
+    print(f"  FAISSインデックス: {format_size(index_bytes)}（float32の場合: {format_size(exact_bytes)}, "
+          f"{index_bytes / exact_bytes:.1%}）")
+    if vector_store._exact_vectors is not None:
+        print(f"  再スコアリング用のベクトル（ディスク、mmapで参照）: {format_size(exact_bytes)}, 候補数: top_k × {RERANK_FACTOR}")
+
+    report = evaluate_quantization(vector_store, embeddings, node_ids)
+    recall = f"圧縮のみ {report['compressed']:.3f}"
+    if vector_store._exact_vectors is not None:
+        recall += f", 再スコアリング後 {report['reranked']:.3f}"
+    print(f"  recall@{report['top_k']}（厳密検索との比較、{report['num_queries']}クエリ）: {recall}")
+
+def build_full_index(file_entries, load_embed_model, num_workers, node_parser, node_cache=None, embed_cache=None,
+                     embed_stats=None, quantization=VECTOR_QUANTIZATION):
+    """全ファイルを読み込んでインデックスを新規作成する関数
+
+    load_embed_modelはエンベディングモデルを返す関数で、ドキュメントの読み込みが終わってから呼ぶ。
+    """
+    print("ドキュメントを読み込み、メタデータを追加しています...")
+    nodes, documents, loaded_entries = prepare_nodes(file_entries, num_workers, node_parser, node_cache)
+    if not nodes:
+        print("警告: ドキュメントが読み込めませんでした。PDF_DIRの設定を確認してください。")
+        return None, None
+
+    if documents:
+        print(f"読み込んだドキュメント数: {len(documents)}")
+        print_sample_document(documents)
+    print_chunk_report(nodes)
+    embed_model = load_embed_model()
+
+    # インデックスの作成（IVFの学習に使うため先にエンベディングを計算する）
+    print(f"インデックスを作成しています（FAISS: {VECTOR_INDEX_TYPE}, 量子化: {quantization}）...")
+    index_start_time = time.time()
+    embeddings = embed_nodes(nodes, embed_model, embed_cache, embed_stats)
+    with span('build_index', nodes=len(nodes)):
+        vector_store = create_vector_store(VECTOR_INDEX_TYPE, embeddings=embeddings, quantization=quantization)
+        # ノードはdocstore.bin（バイナリ形式）に保存し、読み込み時はアクセスされたノードのみを解析する
+        storage_context = StorageContext.from_defaults(docstore=BlobDocumentStore(), vector_store=vector_store)
+        index = VectorStoreIndex(
+            nodes,
+            storage_context=storage_context,
+            embed_model=embed_model
+        )
     index_end_time = time.time()
     print(f"インデックス作成時間: {index_end_time - index_start_time:.2f}秒")
 
-    # インデックスの保存
-    print(f"インデックスを保存しています: {INDEX_DIR}")
-    save_start_time = time.time()
-    index.storage_context.persist(persist_dir=INDEX_DIR)
-    save_end_time = time.time()
-    print(f"インデックス保存時間: {save_end_time - save_start_time:.2f}秒")
-    
+    if quantization != 'none':
+        print_quantization_report(vector_store, embeddings, [node.node_id for node in nodes], quantization)
+
+    manifest = update_manifest(new_manifest(), loaded_entries, group_ref_doc_ids_by_file(nodes))
+    return index, manifest
+
+def update_index(manifest, added, changed, removed, load_embed_model, num_workers, node_parser, node_cache=None,
+                 embed_cache=None, embed_stats=None):
+    """追加・変更・削除されたファイルのみをインデックスに反映する関数
+
+    公開中のバージョンをロードして更新し、保存は新しいバージョンのディレクトリに行う（公開中のファイルは変更しない）。
+    load_embed_modelはエンベディングモデルを返す関数で、ドキュメントの読み込みが終わってから呼ぶ。
+    """
+    # 追加・変更されたファイルを先に読み込む
+    new_entries = added + changed
+    if new_entries:
+        print("追加・変更されたドキュメントを読み込んでいます...")
+        nodes, documents, loaded_entries = prepare_nodes(new_entries, num_workers, node_parser, node_cache)
+        print_chunk_report(nodes)
+    embed_model = load_embed_model()
+
+    print("既存のインデックスをロードしています...")
+    with span('load_index'):
+        storage_context = load_storage_context(current_index_dir(INDEX_DIR))
+        index = load_index_from_storage(storage_context, embed_model=embed_model)
+
+    # 削除・変更されたファイルのノードをdocstoreとベクトルストアから除去
+    stale_paths = removed + [entry['path'] for entry in changed]
+    stale_doc_ids = []
+    for path in stale_paths:
+        stale_doc_ids.extend(manifest['files'].get(path, {}).get('doc_ids', []))
+        manifest['files'].pop(path, None)
+    if stale_paths:
+        with span('delete_documents', files=len(stale_paths)):
+            removed_nodes = delete_documents(index, stale_doc_ids)
+        print(f"削除したノード数: {removed_nodes}（{len(stale_paths)}ファイル）")
+
+    # 追加・変更されたファイルのノードをエンベディングして追加
+    if new_entries:
+        print("インデックスを更新しています...")
+        index_start_time = time.time()
+        embed_nodes(nodes, embed_model, embed_cache, embed_stats)
+        with span('build_index', nodes=len(nodes)):
+            index.insert_nodes(nodes)
+        index_end_time = time.time()
+        print(f"追加したノード数: {len(nodes)}（新たに読み込んだドキュメント数: {len(documents)}）")
+        print(f"インデックス更新時間: {index_end_time - index_start_time:.2f}秒")
+        update_manifest(manifest, loaded_entries, group_ref_doc_ids_by_file(nodes))
+
+    return index, manifest
+
+def main():
+    # コマンドライン引数の解析
+    parser = argparse.ArgumentParser(description='RAGシステム インデックス作成')
+    parser.add_argument('--full', action='store_true', help='マニフェストを無視してインデックスを全件再構築する')
+    parser.add_argument('--num-workers', type=int, default=LOADER_NUM_WORKERS, help='PDF解析に使うプロセス数')
+    parser.add_argument('--no-embed-cache', action='store_true', help='エンベディングキャッシュを使用しない')
+    parser.add_argument('--embed-batch-size', type=int, default=EMBED_BATCH_SIZE, help='エンベディングのバッチサイズ')
+    parser.add_argument('--embed-threads', type=int, default=EMBED_NUM_THREADS, help='torchのスレッド数（0は既定値）')
+    parser.add_argument('--quantization', choices=QUANTIZATION_TYPES, default=VECTOR_QUANTIZATION,
+                        help='ベクトルの圧縮方式（none / int8 / pq）')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='チャンクのトークン数')
+    parser.add_argument('--chunk-overlap', type=int, default=CHUNK_OVERLAP, help='隣り合うチャンクの重なりのトークン数')
+    parser.add_argument('--no-node-cache', action='store_true', help='分割済みのノードのキャッシュを使用しない')
+    args = parser.parse_args()
+
+    # インデックス作成全体を1つのトレースにまとめる（TRACE_LOGを設定すると各段階をJSONで出力）
+    with span('index', full=args.full, quantization=args.quantization):
+        run_indexing(args)
+
+def run_indexing(args):
+    """PDFの差分を確認し、インデックスを作成または更新して保存する関数"""
+    start_time = time.time()
+    print("=== RAGシステム インデックス作成 ===")
+
+    # フォルダの確認と作成
+    if not os.path.exists(INDEX_DIR):
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        print(f"インデックスディレクトリを作成しました: {INDEX_DIR}")
+
+    # PDFファイルの走査とマニフェストとの比較
+    print("PDFファイルを走査しています...")
+    file_paths = scan_pdf_files(PDF_DIR)
+    current_dir = current_index_dir(INDEX_DIR)
+    manifest = load_manifest(current_dir)
+    signature = chunking_signature(args.chunk_size, args.chunk_overlap)
+    if manifest is not None and not args.full and manifest.get('chunking') != signature:
+        print("チャンク分割の設定が変わったため、全件再構築します。")
+    incremental = (
+        not args.full
+        and manifest is not None
+        and manifest.get('vector_index_type') == VECTOR_INDEX_TYPE
+        and manifest.get('vector_quantization', 'none') == args.quantization
+        and manifest.get('chunking') == signature
+        and index_exists(current_dir)
+    )
+    added, changed, removed, unchanged = diff_manifest(manifest if incremental else None, file_paths)
+    print(f"PDFファイル数: {len(file_paths)}")
+
+    if incremental and (changed or removed) and not supports_delete(VECTOR_INDEX_TYPE):
+        # HNSWはベクトルを削除できないため全件再構築する
+        print(f"FAISS {VECTOR_INDEX_TYPE} はベクトルの削除に対応していないため、全件再構築します。")
+        incremental = False
+        added, changed, removed, unchanged = added + changed + unchanged, [], [], []
+
+    if incremental:
+        print(f"差分: 追加 {len(added)}件, 変更 {len(changed)}件, 削除 {len(removed)}件, 未変更 {len(unchanged)}件")
+        if not (added or changed or removed):
+            # 公開済みのバージョンのディレクトリは変更しないため、更新時刻だけが変わったファイルは
+            # 次にインデックスを保存するときにマニフェストに記録する（それまではハッシュで未変更と判定する）
+            touched = [
+                entry for entry in unchanged
+                if (manifest['files'][entry['path']]['size'], manifest['files'][entry['path']]['mtime_ns'])
+                != (entry['size'], entry['mtime_ns'])
+            ]
+            if touched:
+                print(f"内容は同じで更新時刻のみ変わったファイル: {len(touched)}件")
+            print("\n変更はありません。インデックスは最新です。")
+            print(f"合計処理時間: {time.time() - start_time:.2f}秒")
+            return
+
+    def load_embed_model():
+        """エンベディングモデルを初期化する関数
+
+        torch・OpenMPのスレッドを開始した後のプロセスをforkすると解析用のワーカーが停止することがあるため、
+        PDFの並列読み込みが終わってから呼ぶ。
+        """
+        print(f"エンベディングモデルを初期化しています: {EMBED_MODEL_NAME}")
+        return create_embed_model(batch_size=args.embed_batch_size, num_threads=args.embed_threads)
+
+    embed_stats = EmbeddingStats()
+    embed_cache = None
+    if not args.no_embed_cache:
+        embed_cache = EmbeddingCache(EMBED_CACHE_PATH, EMBED_MODEL_NAME)
+        print(f"エンベディングキャッシュ: {EMBED_CACHE_PATH}")
+    node_parser = create_node_parser(args.chunk_size, args.chunk_overlap)
+    node_cache = None
+    if not args.no_node_cache:
+        node_cache = NodeCache(NODE_CACHE_PATH, signature)
+        print(f"ノードのキャッシュ: {NODE_CACHE_PATH}")
+
+    if incremental:
+        index, manifest = update_index(
+            manifest, added, changed, removed, load_embed_model, args.num_workers, node_parser, node_cache,
+            embed_cache, embed_stats
+        )
+        update_manifest(manifest, unchanged)
+    else:
+        index, manifest = build_full_index(
+            added, load_embed_model, args.num_workers, node_parser, node_cache, embed_cache, embed_stats,
+            quantization=args.quantization
+        )
+        if index is None:
+            return
+
+    if node_cache is not None:
+        print(f"ノードのキャッシュ: ヒット {node_cache.hits}ファイル, ミス {node_cache.misses}ファイル")
+        node_cache.close()
+
+    if embed_cache is not None:
+        print(f"エンベディングキャッシュ: ヒット {embed_cache.hits}件, ミス {embed_cache.misses}件")
+        embed_cache.close()
+
+    manifest['vector_index_type'] = VECTOR_INDEX_TYPE
+    manifest['vector_quantization'] = args.quantization
+    manifest['chunking'] = signature
+    # 保存のたびにバージョンを更新し、検索キャッシュを無効化する
+    manifest['index_version'] = new_index_version()
+
+    # 転置インデックス・絞り込み用の索引の作成に使う全ノード（docstore.binから読み込むのは1回だけにする）
+    with span('load_nodes') as nodes_span:
+        all_nodes = list(index.docstore.docs.values())
+        nodes_span.set(nodes=len(all_nodes))
+
+    # BM25の転置インデックスは差分更新でも全ノードから作り直す（エンベディングに比べて十分速い）
+    print("BM25の転置インデックスを作成しています...")
+    with span('build_sparse_index') as sparse_span:
+        sparse_index = build_sparse_index(all_nodes)
+        sparse_span.set(vocabulary=len(sparse_index.vocabulary))
+    print(f"転置インデックス作成時間: {sparse_span.seconds:.2f}秒（語彙数: {len(sparse_index.vocabulary)}）")
+
+    # 絞り込み用の索引もノードのメタデータから作り直す
+    with span('build_facet_index') as facet_span:
+        facet_index = build_facet_index(all_nodes, index.vector_store)
+        facet_span.set(folders=len(facet_index.folders), files=len(facet_index.file_names))
+
+    # インデックスの保存（新しいバージョンのディレクトリに全て書き終えてからCURRENTを置き換えて公開する。
+    # 起動中のWebインターフェースは公開中のファイルを読み続け、新しいバージョンを検知して差し替える）
+    persist_dir = version_dir(INDEX_DIR, manifest['index_version'])
+    print(f"インデックスを保存しています: {persist_dir}")
+    with span('persist') as persist_span:
+        os.makedirs(persist_dir, exist_ok=True)
+        index.storage_context.persist(persist_dir=persist_dir)
+        sparse_index.save(persist_dir)
+        facet_index.save(persist_dir)
+        save_manifest(persist_dir, manifest)
+        publish_index_version(INDEX_DIR, manifest['index_version'])
+    print(f"インデックス保存時間: {persist_span.seconds:.2f}秒")
+    removed_versions = remove_old_versions(INDEX_DIR, INDEX_KEEP_VERSIONS)
+    if removed_versions:
+        print(f"古いバージョンのインデックスを削除しました: {', '.join(removed_versions)}")
+
+    # 古いインデックスから作った回答は使えないため、回答キャッシュから削除する
+    if os.path.exists(ANSWER_CACHE_PATH):
+        AnswerCache(ANSWER_CACHE_PATH, manifest['index_version']).close()
+
     # インデックス情報の表示
     print("\nインデックス情報:")
     if hasattr(index, 'docstore'):
-        nodes = list(index.docstore.docs.values())
-        print(f"ノード数: {len(nodes)}")
-    
+        print(f"ノード数: {len(list_node_ids(index.docstore))}")
+
+    # エンベディングのスループット（キャッシュにヒットしたチャンクは含まない）
+    print(f"エンベディング: {embed_stats.summary()}")
+    print(f"  バッチサイズ: {args.embed_batch_size}, torchスレッド数: {args.embed_threads or '既定値'}")
+
     end_time = time.time()
     print("\nインデックスの作成が完了しました！")
     print(f"合計処理時間: {end_time - start_time:.2f}秒")
     print(f"次のコマンドで対話型RAGシステムを起動できます: python src/interactive_rag.py")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,244 @@
+from flask import Flask, request, jsonify
+from config import (
+    INDEX_DIR, DAEMON_HOST, DAEMON_PORT, QUERY_EMBED_CACHE_SIZE, RETRIEVAL_CACHE_SIZE,
+    SESSION_MAX_COUNT, SESSION_TTL_SECONDS, RETRIEVAL_MODE, RERANKER_ENABLED, RERANKER_TIME_BUDGET_MS
+)
+from utils.manifest import current_index_dir, get_index_version
+from utils.session_store import SessionStore
+from utils.startup import StartupReport, load_persisted_index
+import argparse
+import os
+import signal
+import threading
+import time
+import uuid
+
+# CLIごとのチャット設定: 会話履歴のトークン数と、指定できるオプションの既定値（advanced_rag.pyの引数と同じ）
+PROFILES = {
+    'interactive': {'memory_token_limit': 2048, 'options': {}},
+    'advanced': {
+        'memory_token_limit': 4096,
+        'options': {
+            'top_k': 3,
+            'cutoff': 0.7,
+            'mode': RETRIEVAL_MODE,
+            'rerank': RERANKER_ENABLED,
+            'rerank_budget_ms': RERANKER_TIME_BUDGET_MS,
+            'verbose': False,
+        },
+    },
+}
+
+def create_profile_pipeline(index, index_dir, query_cache, profile, options):
+    """CLIと同じ設定のクエリパイプラインを作成する関数（各CLIのcreate_query_pipelineを使う）"""
+    if profile == 'interactive':
+        from interactive_rag import create_query_pipeline
+        return create_query_pipeline(index, index_dir, query_cache)
+    from advanced_rag import create_query_pipeline
+    return create_query_pipeline(
+        index,
+        index_dir,
+        similarity_top_k=options['top_k'],
+        similarity_cutoff=options['cutoff'],
+        verbose=options['verbose'],
+        query_cache=query_cache,
+        mode=options['mode'],
+        rerank=options['rerank'],
+        rerank_budget_ms=options['rerank_budget_ms']
+    )
+
+def serialize_node(node):
+    """参照ノードをJSONで返せる形にする関数（CLIの表示に使う属性のみ）"""
+    metadata = {
+        key: value for key, value in (node.metadata or {}).items()
+        if value is None or isinstance(value, (str, int, float, bool))
+    }
+    return {"metadata": metadata, "score": node.score, "text": node.text}
+
+class QueryDaemon:
+    """ロード済みのインデックスと、CLIの設定ごとのクエリパイプライン・セッションごとの会話履歴を保持するクラス
+
+    パイプラインは (CLI, オプション) ごとに初回のみ作成し、全セッションで共有する。
+    クエリのエンベディング・検索結果のキャッシュもセッション間で共有するため、
+    CLIを起動し直しても同じ質問は再計算しない。
+    """
+
+    def __init__(self, index, index_version, index_dir=INDEX_DIR, startup_summary='',
+                 pipeline_factory=create_profile_pipeline):
+        from utils.query_cache import QueryCache
+        self.index = index
+        self.index_version = index_version
+        self.index_dir = index_dir
+        self.startup_summary = startup_summary
+        self.started_at = time.time()
+        self.query_cache = QueryCache(QUERY_EMBED_CACHE_SIZE, RETRIEVAL_CACHE_SIZE)
+        self.sessions = SessionStore(max_sessions=SESSION_MAX_COUNT, ttl_seconds=SESSION_TTL_SECONDS)
+        self._pipeline_factory = pipeline_factory
+        self._pipelines = {}
+        self._pipelines_lock = threading.Lock()
+
+    def _resolve_options(self, profile, options):
+        if profile not in PROFILES:
+            raise ValueError(f"未対応のprofileです: {profile}（{', '.join(PROFILES)}のいずれか）")
+        defaults = PROFILES[profile]['options']
+        unknown = set(options or {}) - set(defaults)
+        if unknown:
+            raise ValueError(f"未対応のオプションです: {', '.join(sorted(unknown))}")
+        return dict(defaults, **(options or {}))
+
+    def get_pipeline(self, profile, options=None):
+        """CLIの設定に対応するクエリパイプラインを取得する関数（初回のみ作成する）"""
+        options = self._resolve_options(profile, options)
+        key = (profile, tuple(sorted(options.items())))
+        with self._pipelines_lock:
+            if key not in self._pipelines:
+                pipeline = self._pipeline_factory(self.index, self.index_dir, self.query_cache, profile, options)
+                if pipeline is None:
+                    raise RuntimeError("クエリパイプラインの作成に失敗しました。")
+                self._pipelines[key] = pipeline
+            return self._pipelines[key]
+
+    def open_session(self, profile, options=None, filters=None):
+        """セッションを作成し、セッションIDを返す関数"""
+        from llama_index.core.memory import ChatMemoryBuffer
+        from utils.facet_index import normalize_filters
+        filters = normalize_filters(filters)
+        pipeline = self.get_pipeline(profile, options)
+        if filters and pipeline.retriever.facet_index is None:
+            raise ValueError("絞り込み用の索引がありません。main.py --full でインデックスを作成し直してください。")
+        session_id = uuid.uuid4().hex
+        memory = ChatMemoryBuffer.from_defaults(token_limit=PROFILES[profile]['memory_token_limit'])
+        self.sessions.get_or_create(
+            session_id, lambda: {"pipeline": pipeline, "memory": memory, "filters": filters}
+        )
+        return session_id
+
+    def chat(self, session_id, message):
+        """セッションの会話履歴を使って質問に回答する関数（セッションがなければNone）"""
+        session = self.sessions.get(session_id)
+        if session is None:
+            return None
+        return session["pipeline"].chat(message, session["memory"], filters=session["filters"])
+
+    def close_session(self, session_id):
+        return self.sessions.pop(session_id) is not None
+
+    def warm_up(self):
+        """既定の設定のパイプラインを作成しておく関数（BM25・絞り込み用の索引や再ランキングのモデルを読み込む）"""
+        for profile in PROFILES:
+            self.get_pipeline(profile)
+
+    def status(self):
+        return {
+            "status": "ready",
+            "index_version": self.index_version,
+            "index_dir": INDEX_DIR,
+            "pid": os.getpid(),
+            "startup": self.startup_summary,
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "sessions": len(self.sessions),
+            "pipelines": len(self._pipelines),
+        }
+
+def create_app(daemon):
+    """デーモンのHTTP APIのFlaskアプリを作成する関数"""
+    from utils.llm_gateway import LLMOverloadedError
+    app = Flask(__name__)
+    # 処理段階の時間は実行順に表示するため、キーを並べ替えない
+    app.json.sort_keys = False
+
+    @app.route('/status')
+    def status():
+        """デーモンの状態を返すエンドポイント（CLIは接続前にインデックスのバージョンを確認する）"""
+        return jsonify(daemon.status())
+
+    @app.route('/api/sessions', methods=['POST'])
+    def open_session():
+        data = request.json or {}
+        try:
+            session_id = daemon.open_session(data.get('profile'), data.get('options'), data.get('filters'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            return jsonify({"error": f"セッションの作成中にエラーが発生しました: {str(e)}"}), 500
+        return jsonify({"session_id": session_id})
+
+    @app.route('/api/sessions/<session_id>/chat', methods=['POST'])
+    def chat(session_id):
+        data = request.json or {}
+        try:
+            response = daemon.chat(session_id, data.get('message', ''))
+        except LLMOverloadedError as e:
+            return jsonify({"error": str(e)}), 503, {"Retry-After": "10"}
+        except Exception as e:
+            return jsonify({"error": f"エラーが発生しました: {str(e)}"}), 500
+        if response is None:
+            return jsonify({"error": "セッションが見つかりません（期限切れの可能性があります）"}), 404
+        return jsonify({
+            "response": response.response,
+            "source_nodes": [serialize_node(node) for node in response.source_nodes or []],
+            "timings": response.timings,
+            "cached": response.cached,
+        })
+
+    @app.route('/api/sessions/<session_id>', methods=['DELETE'])
+    def close_session(session_id):
+        return jsonify({"closed": daemon.close_session(session_id)})
+
+    @app.route('/api/cache_stats')
+    def cache_stats():
+        return jsonify(daemon.query_cache.stats())
+
+    @app.route('/api/index_info')
+    def index_info():
+        from check_index import collect_index_info
+        try:
+            return jsonify(collect_index_info(daemon.index))
+        except Exception as e:
+            return jsonify({"error": f"インデックスの診断中にエラーが発生しました: {str(e)}"}), 500
+
+    return app
+
+def close_daemon(daemon):
+    """終了時にOllamaへの接続とmmapしたファイルを閉じる関数"""
+    from llm_integration import close_ollama_clients
+    close_ollama_clients()
+    docstore = daemon.index.docstore
+    if hasattr(docstore, "close"):
+        docstore.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='クエリデーモン（インデックス・モデルをロードしたままCLIからの質問を処理する）')
+    parser.add_argument('--host', default=DAEMON_HOST, help='待ち受けるアドレス')
+    parser.add_argument('--port', type=int, default=DAEMON_PORT, help='待ち受けるポート番号')
+    args = parser.parse_args()
+
+    startup = StartupReport()
+    print("インデックスをロードしています...")
+    # 公開中のバージョンは一度だけ解決し、検索用の索引とバージョンも同じディレクトリから読み込む
+    index_dir = current_index_dir(INDEX_DIR)
+    index = load_persisted_index(index_dir, startup)
+    if index is None:
+        return
+    daemon = QueryDaemon(index, get_index_version(index_dir), index_dir)
+    with startup.stage('pipeline'):
+        daemon.warm_up()
+    daemon.startup_summary = startup.summary()
+    print(daemon.startup_summary)
+
+    from werkzeug.serving import make_server
+    server = make_server(args.host, args.port, create_app(daemon), threaded=True)
+    # SIGTERM（docker stopなど）でも処理中のリクエストを終えてから停止する
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    print(f"クエリデーモンを起動しました: http://{args.host}:{args.port}（インデックス: {INDEX_DIR}）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        close_daemon(daemon)
+        print("クエリデーモンを停止しました。")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+from gunicorn.app.base import BaseApplication
+from config import (
+    WEB_HOST, WEB_PORT, WEB_WORKERS, WEB_THREADS, WEB_GRACEFUL_TIMEOUT, WEB_PRELOAD, EMBED_NUM_THREADS
+)
+import argparse
+import os
+
+def torch_threads_per_worker(workers):
+    """ワーカーごとのtorchのスレッド数（全ワーカーの合計がCPUコア数を超えないようにする）"""
+    if EMBED_NUM_THREADS > 0:
+        return EMBED_NUM_THREADS
+    return max(1, (os.cpu_count() or 1) // workers)
+
+def post_fork(server, worker):
+    """fork直後のワーカーでtorchのスレッド数を設定し、インデックスの監視を開始するフック
+
+    監視のスレッドはforkで引き継がれないため、ワーカーごとに開始する（マスターでは新しいインデックスをロードしない）。
+    """
+    from utils.embed_model import configure_torch_threads
+    from web_interface import start_index_watcher
+    configure_torch_threads(torch_threads_per_worker(server.cfg.workers))
+    start_index_watcher()
+
+def worker_exit(server, worker):
+    """ワーカー終了時（処理中のリクエストが終わった後）に共有リソースを解放するフック"""
+    from web_interface import close_shared_resources
+    close_shared_resources()
+
+class RAGWebServer(BaseApplication):
+    """web_interfaceのFlaskアプリをgunicornのマルチワーカーで実行するサーバー
+
+    preload_appの場合はワーカーをforkする前にインデックス・エンベディングモデル・LLMを
+    ロードするため、各ワーカーはそのメモリをcopy-on-writeで共有する。
+    preloadしない場合は各ワーカーの起動時にロードする。
+    """
+
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        import web_interface
+        # 最初のリクエストを待たずにロードしておく（失敗した場合は/readyzが503を返し、リクエスト時に再試行する）
+        resources = web_interface.get_shared_resources()
+        if "error" in resources:
+            print(resources["error"])
+        return web_interface.app
+
+def main():
+    parser = argparse.ArgumentParser(description='RAG Webインターフェース（本番用マルチワーカーサーバー）')
+    parser.add_argument('--bind', default=f"{WEB_HOST}:{WEB_PORT}", help='待ち受けるアドレス（host:port）')
+    parser.add_argument('--workers', type=int, default=WEB_WORKERS, help='ワーカープロセス数')
+    parser.add_argument('--threads', type=int, default=WEB_THREADS, help='ワーカーあたりのスレッド数（同時接続数）')
+    parser.add_argument('--no-preload', action='store_true', help='fork前にインデックスをロードしない')
+    args = parser.parse_args()
+
+    options = {
+        'bind': args.bind,
+        'workers': args.workers,
+        # ストリーミング応答は生成が終わるまで接続を保持するため、スレッドで同時接続を処理する
+        'worker_class': 'gthread',
+        'threads': args.threads,
+        'preload_app': WEB_PRELOAD and not args.no_preload,
+        # SIGTERMを受けたら新しい接続の受け付けを止め、処理中のリクエストを最大この秒数まで待つ
+        'graceful_timeout': WEB_GRACEFUL_TIMEOUT,
+        'timeout': 120,
+        'keepalive': 5,
+        'accesslog': '-',
+        'post_fork': post_fork,
+        'worker_exit': worker_exit,
+    }
+    print(f"Webサーバーを起動します: {args.bind}（ワーカー: {args.workers}, スレッド: {args.threads}, "
+          f"preload: {options['preload_app']}）")
+    RAGWebServer(options).run()
+
+if __name__ == "__main__":
+    main()
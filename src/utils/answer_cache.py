@@ -0,0 +1,204 @@
+from config import ANSWER_CACHE_PATH, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_SIZE
+import json
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+
+class AnswerCache:
+    """言い換えの質問にLLMを呼ばずに答えるための、回答の永続キャッシュ
+
+    (質問のエンベディング, LLMに渡したノードのID, 回答) をSQLiteに保存し、メモリ上に
+    エンベディングの行列を持つ。新しい質問は、エンベディングのコサイン類似度がthreshold以上で、
+    かつ検索されたノードのIDの集合が一致するエントリの回答を返す（同じ資料から答えた質問のみ）。
+    エントリはインデックスのバージョンごとに保存し、バージョンが変わった古いエントリは開いたときに削除する。
+    max_entriesを超えたら最後に使われた時刻が古いものから削除する。
+
+    gunicornのワーカーのように複数のプロセスで同じファイルを使う場合は、forkした後のプロセスで接続を開き直し、
+    他のプロセスが書き込んだ（追加・削除した）ことを検知したらメモリ上のエントリを読み込み直す。
+    """
+
+    def __init__(self, path, index_version, threshold=ANSWER_CACHE_THRESHOLD, max_entries=ANSWER_CACHE_SIZE):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.index_version = index_version
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        # forkで引き継いだ接続（閉じると親プロセスの接続に影響するため、参照を残したまま使わない）
+        self._inherited_conns = []
+        self._conn = self._connect()
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS answers ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' index_version TEXT NOT NULL,'
+            ' question TEXT NOT NULL,'
+            ' embedding BLOB NOT NULL,'
+            ' node_ids TEXT NOT NULL,'
+            ' answer TEXT NOT NULL,'
+            ' llm_seconds REAL NOT NULL,'
+            ' last_used REAL NOT NULL'
+            ')'
+        )
+        # インデックスを作り直した後の回答は、同じノードIDでも内容が変わっている可能性があるため破棄する
+        self._conn.execute('DELETE FROM answers WHERE index_version != ?', [str(index_version)])
+        self._conn.commit()
+        self._data_version = self._read_data_version()
+        self._load()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _read_data_version(self):
+        """他の接続がコミットするたびに変わる値を返す関数（自分の接続のコミットでは変わらない）"""
+        return self._conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def _sync(self):
+        """プロセスごとの接続と、他のプロセスの書き込みを反映したエントリを用意する関数（_lockを保持して呼ぶ）
+
+        SQLiteの接続はforkをまたいで使えないため、forkした後のプロセスでは接続を開き直す。
+        """
+        if self._pid != os.getpid():
+            self._inherited_conns.append(self._conn)
+            self._pid = os.getpid()
+            self._conn = self._connect()
+            self._data_version = None
+        data_version = self._read_data_version()
+        if data_version != self._data_version:
+            self._data_version = data_version
+            self._load()
+
+    def _load(self):
+        rows = self._conn.execute(
+            'SELECT id, embedding, node_ids, answer, llm_seconds, last_used FROM answers ORDER BY id'
+        ).fetchall()
+        self._ids = [row[0] for row in rows]
+        self._node_ids = [frozenset(json.loads(row[2])) for row in rows]
+        self._answers = [row[3] for row in rows]
+        self._llm_seconds = [row[4] for row in rows]
+        self._last_used = [row[5] for row in rows]
+        self._embeddings = (
+            np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+            if rows else np.zeros((0, 0), dtype=np.float32)
+        )
+        self._evict()
+
+    def __len__(self):
+        with self._lock:
+            self._sync()
+            return len(self._ids)
+
+    def _now(self):
+        """最後に使われた時刻として記録する値（同じ時刻でも後に使われた方が大きくなるようにする）"""
+        return max(time.time(), max(self._last_used, default=0.0) + 1e-6)
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup(self, embedding, node_ids):
+        """類似した質問で、同じノードから作られた回答を返す関数（なければNone）"""
+        node_ids = frozenset(node_ids)
+        with self._lock:
+            self._sync()
+            if not self._ids or not node_ids:
+                self.misses += 1
+                return None
+            similarities = self._embeddings @ self._normalize(embedding)
+            for row in np.argsort(-similarities, kind='stable'):
+                if similarities[row] < self.threshold:
+                    break
+                if self._node_ids[row] != node_ids:
+                    continue
+                self.hits += 1
+                self.saved_seconds += self._llm_seconds[row]
+                self._last_used[row] = self._now()
+                self._conn.execute(
+                    'UPDATE answers SET last_used = ? WHERE id = ?', [self._last_used[row], self._ids[row]]
+                )
+                self._conn.commit()
+                return self._answers[row]
+            self.misses += 1
+            return None
+
+    def put(self, question, embedding, node_ids, answer, llm_seconds=0.0):
+        """回答を保存する関数（空の回答やノードがない場合は保存しない）"""
+        node_ids = sorted(set(node_ids))
+        if not answer or not answer.strip() or not node_ids:
+            return
+        vector = self._normalize(embedding)
+        with self._lock:
+            self._sync()
+            now = self._now()
+            cursor = self._conn.execute(
+                'INSERT INTO answers (index_version, question, embedding, node_ids, answer, llm_seconds, last_used)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [str(self.index_version), question, vector.tobytes(), json.dumps(node_ids), answer, llm_seconds, now]
+            )
+            self._ids.append(cursor.lastrowid)
+            self._node_ids.append(frozenset(node_ids))
+            self._answers.append(answer)
+            self._llm_seconds.append(llm_seconds)
+            self._last_used.append(now)
+            self._embeddings = (
+                np.vstack([self._embeddings, vector]) if len(self._embeddings) else vector[np.newaxis, :].copy()
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """max_entriesを超えた分を、最後に使われた時刻が古いものから削除する関数"""
+        excess = len(self._ids) - self.max_entries
+        if excess <= 0:
+            return
+        evicted = set(np.argsort(self._last_used, kind='stable')[:excess].tolist())
+        self._conn.executemany('DELETE FROM answers WHERE id = ?', [[self._ids[row]] for row in evicted])
+        self._conn.commit()
+        kept = [row for row in range(len(self._ids)) if row not in evicted]
+        self._ids = [self._ids[row] for row in kept]
+        self._node_ids = [self._node_ids[row] for row in kept]
+        self._answers = [self._answers[row] for row in kept]
+        self._llm_seconds = [self._llm_seconds[row] for row in kept]
+        self._last_used = [self._last_used[row] for row in kept]
+        self._embeddings = self._embeddings[kept]
+
+    def clear(self):
+        with self._lock:
+            self._sync()
+            self._conn.execute('DELETE FROM answers')
+            self._conn.commit()
+            self._load()
+
+    def stats(self):
+        """統計情報を辞書で返す関数（QueryCacheの各キャッシュと同じ形式）"""
+        with self._lock:
+            self._sync()
+            total = self.hits + self.misses
+            return {
+                "size": len(self._ids),
+                "maxsize": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "saved_seconds": round(self.saved_seconds, 4),
+            }
+
+    def close(self):
+        with self._lock:
+            # forkで引き継いだまま開き直していない接続は閉じない
+            if self._pid == os.getpid():
+                self._conn.close()
+
+def create_answer_cache(index_version, path=ANSWER_CACHE_PATH):
+    """インデックスのバージョンに対応する回答キャッシュを開く関数"""
+    return AnswerCache(path, index_version)
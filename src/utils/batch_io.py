@@ -0,0 +1,73 @@
+import csv
+import json
+import os
+
+QUESTION_FIELDS = ('question', 'query')
+
+def load_queries(input_path):
+    """JSONLまたはCSVファイルから質問を読み込む関数
+
+    各行の質問は question（または query）列から取得する。id列がなければ行番号をIDにする。
+    戻り値は {'id', 'question'} の辞書のリスト。
+    """
+    ext = os.path.splitext(input_path)[1].lower()
+    if ext == '.csv':
+        with open(input_path, 'r', encoding='utf-8-sig', newline='') as f:
+            rows = list(csv.DictReader(f))
+    elif ext in ('.jsonl', '.json'):
+        rows = []
+        with open(input_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    rows.append(json.loads(line))
+    else:
+        raise ValueError(f"未対応の入力形式です: {input_path}（.jsonl または .csv を指定してください）")
+
+    queries = []
+    seen_ids = set()
+    for line_no, row in enumerate(rows, 1):
+        question = next((row[field] for field in QUESTION_FIELDS if row.get(field)), None)
+        if question is None or not str(question).strip():
+            print(f"警告: {line_no}行目に質問がないためスキップします")
+            continue
+        query_id = str(row.get('id') or line_no)
+        if query_id in seen_ids:
+            raise ValueError(f"IDが重複しています: {query_id}")
+        seen_ids.add(query_id)
+        queries.append({'id': query_id, 'question': str(question).strip()})
+    return queries
+
+def load_completed_ids(output_path):
+    """出力済みのJSONLから、エラーなく回答できたIDを読み込む関数（再開用）"""
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 中断時に途中まで書かれた行は無視する
+                continue
+            if not record.get('error'):
+                completed.add(str(record['id']))
+    return completed
+
+def append_result(f, record):
+    """結果を1行のJSONとして追記する関数（中断に備えて毎回フラッシュする）"""
+    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    f.flush()
+
+def open_output(output_path):
+    """結果ファイルを追記モードで開く関数（中断で改行が欠けていれば補う）"""
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(output_dir, exist_ok=True)
+    needs_newline = False
+    if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+        with open(output_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b'\n'
+    f = open(output_path, 'a', encoding='utf-8')
+    if needs_newline:
+        f.write('\n')
+    return f
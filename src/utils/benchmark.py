@@ -0,0 +1,269 @@
+from llama_index.core.embeddings import BaseEmbedding
+from config import EMBED_DIM
+import numpy as np
+import json
+import os
+import platform
+import subprocess
+import time
+import zlib
+
+# 結果ファイルの形式が変わったら上げる（比較時に形式の違う結果を区別する）
+BENCHMARK_SCHEMA_VERSION = 1
+
+# 合成コーパスの分野ごとの語彙（分野が同じ文書は語彙を共有し、検索で区別できる程度の偏りを持たせる）
+SYNTHETIC_TOPICS = {
+    '宇宙': (['人工衛星', '軌道', 'ロケット', '探査機', '太陽電池', '観測データ', '姿勢制御', '地上局'],
+             ['計算する', '打ち上げる', '観測する', '制御する', '解析する', '送信する']),
+    '医療': (['臨床試験', '診断', '副作用', '投薬', '患者', '検査値', '治療計画', '電子カルテ'],
+             ['評価する', '記録する', '確認する', '投与する', '比較する', '報告する']),
+    '金融': (['決済', '為替', '与信', '利回り', '債券', '口座', 'リスク管理', '監査'],
+             ['算出する', '承認する', '照合する', '開示する', '運用する', '見直す']),
+    '農業': (['土壌', '収穫量', '灌漑', '品種', '肥料', '気象条件', '病害虫', '出荷'],
+             ['改良する', '予測する', '散布する', '管理する', '調査する', '計画する']),
+    '製造': (['生産ライン', '品質検査', '歩留まり', '部品', '在庫', '設備保全', '工程', '不良率'],
+             ['改善する', '点検する', '削減する', '標準化する', '自動化する', '測定する']),
+    '教育': (['カリキュラム', '学習履歴', '評価基準', '教材', '講義', '演習', '成績', '受講者'],
+             ['設計する', '分析する', '更新する', '配布する', '指導する', '集計する']),
+}
+
+def synthetic_sentence(rng, topic):
+    """分野の語彙から1文を作る関数"""
+    nouns, verbs = SYNTHETIC_TOPICS[topic]
+    first, second, third = rng.choice(len(nouns), size=3, replace=False)
+    return f"{nouns[first]}は{nouns[second]}に基づいて{nouns[third]}を{verbs[rng.integers(len(verbs))]}。"
+
+def synthetic_query(rng, topic):
+    """分野の語彙から質問文を作る関数"""
+    nouns, verbs = SYNTHETIC_TOPICS[topic]
+    first, second = rng.choice(len(nouns), size=2, replace=False)
+    return f"{nouns[first]}の{nouns[second]}はどのように{verbs[rng.integers(len(verbs))][:-2]}しますか？"
+
+def synthetic_pages(rng, topic, num_pages, lines_per_page, sentences_per_line=2):
+    """ページごとの行のリストを作る関数"""
+    return [
+        ["".join(synthetic_sentence(rng, topic) for _ in range(sentences_per_line)) for _ in range(lines_per_page)]
+        for _ in range(num_pages)
+    ]
+
+def write_pdf(path, pages):
+    """日本語のテキストだけを含むPDFを書き出す関数（pagesはページごとの行のリスト）
+
+    フォントは埋め込まず、UniJIS-UCS2-Hエンコーディングで文字をUTF-16のまま書き込む。
+    pypdf・pdfminer.sixのどちらでもテキストを抽出できる。
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        b"<< /Type /Font /Subtype /Type0 /BaseFont /HeiseiKakuGo-W5 /Encoding /UniJIS-UCS2-H "
+        b"/DescendantFonts [4 0 R] >>",
+        b"<< /Type /Font /Subtype /CIDFontType0 /BaseFont /HeiseiKakuGo-W5 "
+        b"/CIDSystemInfo << /Registry (Adobe) /Ordering (Japan1) /Supplement 2 >> /FontDescriptor 5 0 R /DW 1000 >>",
+        b"<< /Type /FontDescriptor /FontName /HeiseiKakuGo-W5 /Flags 4 /FontBBox [0 -140 1000 880] "
+        b"/ItalicAngle 0 /Ascent 880 /Descent -120 /CapHeight 700 /StemV 80 >>",
+    ]
+    page_ids = []
+    for lines in pages:
+        operations = ["BT /F1 10.5 Tf 14 TL 56 780 Td"]
+        operations.extend(f"<{line.encode('utf-16-be').hex()}> Tj T*" for line in lines)
+        operations.append("ET")
+        content = "\n".join(operations).encode('ascii')
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents %d 0 R "
+            b"/Resources << /Font << /F1 3 0 R >> >> >>" % len(objects)
+        )
+        page_ids.append(len(objects))
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for object_id, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % object_id + obj + b"\nendobj\n"
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    with open(path, 'wb') as f:
+        f.write(out)
+
+def generate_corpus(output_dir, num_docs, pages_per_doc=3, lines_per_page=20, file_format='pdf', seed=0):
+    """合成コーパス（PDFまたはテキストファイル）を作成する関数
+
+    同じ引数なら同じ内容になる。作成したファイルのパスのリストを返す。
+    """
+    if file_format not in ('pdf', 'txt'):
+        raise ValueError(f"未対応のファイル形式です: {file_format}（pdf / txt）")
+    rng = np.random.default_rng(seed)
+    topics = list(SYNTHETIC_TOPICS)
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    for i in range(num_docs):
+        topic = topics[i % len(topics)]
+        pages = synthetic_pages(rng, topic, pages_per_doc, lines_per_page)
+        # フォルダのメタデータも付くよう、分野ごとのサブフォルダに置く
+        path = os.path.join(output_dir, topic, f"doc_{i:06d}.{file_format}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if file_format == 'pdf':
+            write_pdf(path, pages)
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write("\n\n".join("\n".join(lines) for lines in pages))
+        paths.append(path)
+    return paths
+
+def generate_queries(num_queries, seed=0):
+    """合成コーパスの語彙を使った質問文を作る関数（重複しないためキャッシュに当たらない）"""
+    rng = np.random.default_rng(seed + 1)
+    topics = list(SYNTHETIC_TOPICS)
+    queries = []
+    seen = set()
+    while len(queries) < num_queries:
+        query = synthetic_query(rng, topics[rng.integers(len(topics))])
+        if query in seen:
+            query = f"{query}（{len(queries)}）"
+        seen.add(query)
+        queries.append(query)
+    return queries
+
+class HashingEmbedding(BaseEmbedding):
+    """文字bigramをハッシュでdim次元に集約するエンベディング（モデル不要、ベンチマーク用）
+
+    語彙の重なりが多いテキストほどコサイン類似度が高くなるため、検索結果にも意味がある。
+    """
+
+    dim: int = EMBED_DIM
+
+    def __init__(self, dim=EMBED_DIM, **kwargs):
+        super().__init__(model_name='hashing', dim=dim, **kwargs)
+
+    @classmethod
+    def class_name(cls):
+        return "HashingEmbedding"
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for i in range(len(text) - 1):
+            vector[zlib.crc32(text[i:i + 2].encode('utf-8')) % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector.tolist()
+
+    def _get_text_embedding(self, text):
+        return self._embed(text)
+
+    def _get_query_embedding(self, query):
+        return self._embed(query)
+
+    async def _aget_query_embedding(self, query):
+        return self._embed(query)
+
+def timed(func, *args, **kwargs):
+    """関数を実行して (戻り値, 経過秒数) を返す関数"""
+    start_time = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start_time
+
+def latency_summary(seconds_list):
+    """レイテンシのリスト（秒）からp50/p95/p99などをミリ秒で集計する関数"""
+    if not seconds_list:
+        return {'count': 0}
+    values = np.asarray(seconds_list, dtype=np.float64) * 1000.0
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        'count': len(values),
+        'mean_ms': round(float(values.mean()), 3),
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+        'max_ms': round(float(values.max()), 3),
+    }
+
+def directory_bytes(path):
+    """ディレクトリ内のファイルの合計サイズを返す関数"""
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+def environment_info():
+    """結果を比較するための実行環境の情報（コミット・Python・CPU数）を返す関数"""
+    info = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'commit': None,
+        'dirty': None,
+    }
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    try:
+        info['commit'] = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=repo_dir, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        status = subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'], cwd=repo_dir,
+            capture_output=True, text=True, check=True
+        ).stdout
+        info['dirty'] = bool(status.strip())
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return info
+
+def flatten_metrics(results):
+    """結果から比較対象の時間の指標を {名前: 値} で取り出す関数
+
+    名前は「docs=コーパスサイズ/段階/指標」（検索は「docs=…/retrieval/top_k=…/p95_ms」）。
+    秒数とミリ秒の指標のみを対象とし、スループットは含めない（時間と重複するため）。
+    """
+    metrics = {}
+    for run in results.get('runs', []):
+        prefix = f"docs={run['num_docs']}"
+        for stage, values in run.get('stages', {}).items():
+            if 'seconds' in values:
+                metrics[f"{prefix}/{stage}/seconds"] = values['seconds']
+        for section in ('retrieval', 'query'):
+            for top_k, summary in run.get(section, {}).items():
+                for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+                    if key in summary:
+                        metrics[f"{prefix}/{section}/top_k={top_k}/{key}"] = summary[key]
+    return metrics
+
+def compare_results(baseline, current, threshold=0.2, min_seconds=0.005):
+    """基準の結果と比べて遅くなった指標を返す関数
+
+    threshold（割合）を超えて遅くなり、差がmin_seconds以上ある指標を
+    [(名前, 基準の値, 今回の値, 変化率), ...] で変化率の大きい順に返す。
+    """
+    baseline_metrics = flatten_metrics(baseline)
+    current_metrics = flatten_metrics(current)
+    regressions = []
+    for name, current_value in current_metrics.items():
+        baseline_value = baseline_metrics.get(name)
+        if baseline_value is None or baseline_value <= 0:
+            continue
+        delta = current_value - baseline_value
+        if name.endswith('_ms'):
+            delta /= 1000.0
+        ratio = current_value / baseline_value - 1.0
+        if ratio > threshold and delta >= min_seconds:
+            regressions.append((name, baseline_value, current_value, ratio))
+    return sorted(regressions, key=lambda item: item[3], reverse=True)
+
+def save_results(path, results):
+    """結果をJSONファイルに保存する関数"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+def load_results(path):
+    """保存した結果を読み込む関数"""
+    with open(path, 'r', encoding='utf-8') as f:
+        results = json.load(f)
+    if results.get('schema_version') != BENCHMARK_SCHEMA_VERSION:
+        raise ValueError(f"結果ファイルの形式が異なります: {path}（schema_version: {results.get('schema_version')}）")
+    return results
@@ -0,0 +1,211 @@
+from llama_index.core.storage.docstore.keyval_docstore import KVDocumentStore
+from llama_index.core.storage.docstore.types import DEFAULT_BATCH_SIZE, DEFAULT_PERSIST_FNAME
+from llama_index.core.storage.kvstore.types import BaseKVStore, DEFAULT_COLLECTION
+import io
+import json
+import mmap
+import os
+import struct
+import numpy as np
+
+BLOB_STORE_FILENAME = 'docstore.bin'
+LEGACY_DOCSTORE_FILENAME = DEFAULT_PERSIST_FNAME  # docstore.json
+
+# ファイル形式: MAGIC | 値（JSONのUTF-8バイト列）を連結したもの | キー索引（npz） | 索引の位置・長さ | MAGIC
+MAGIC = b'RAGBLOB1'
+TRAILER = struct.Struct('<QQ8s')
+
+class BlobKVStore(BaseKVStore):
+    """値を1つのバイナリファイルに連結して保存し、mmap経由で必要な値だけを読み込むKVストア
+
+    ロード時に読むのはキーと (オフセット, 長さ) の索引のみで、値のJSONはget()されたときに
+    初めて解析する。追加・削除はメモリ上に保持し、persist()で新しいファイルに書き出す。
+    """
+
+    def __init__(self, path=None):
+        self._path = path
+        self._file = None
+        self._mmap = None
+        self._index = {}    # collection -> ({key: 行番号}, (n, 2)のint64配列)
+        self._added = {}    # collection -> {key: dict}
+        self._deleted = {}  # collection -> set(key)
+        if path is not None and os.path.exists(path):
+            self._open(path)
+
+    def _open(self, path):
+        self._file = open(path, 'rb')
+        if os.fstat(self._file.fileno()).st_size == 0:
+            raise ValueError(f"ブロブストアが空です: {path}")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        index_offset, index_length, magic = TRAILER.unpack(self._mmap[-TRAILER.size:])
+        if self._mmap[:len(MAGIC)] != MAGIC or magic != MAGIC:
+            raise ValueError(f"ブロブストアの形式が不正です: {path}")
+
+        with np.load(io.BytesIO(self._mmap[index_offset:index_offset + index_length])) as data:
+            for i, collection in enumerate(data['collections'].tolist()):
+                keys = data[f'keys_{i}'].tolist()
+                self._index[collection] = ({key: row for row, key in enumerate(keys)}, data[f'spans_{i}'])
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+        self._mmap = None
+        self._file = None
+
+    def _read(self, collection, key):
+        rows, spans = self._index[collection]
+        offset, length = spans[rows[key]].tolist()
+        return self._mmap[offset:offset + length]
+
+    def _stored_keys(self, collection):
+        """ファイル上にあり、削除・上書きされていないキー"""
+        if collection not in self._index:
+            return []
+        deleted = self._deleted.get(collection, ())
+        added = self._added.get(collection, {})
+        return [key for key in self._index[collection][0] if key not in deleted and key not in added]
+
+    def put(self, key, val, collection=DEFAULT_COLLECTION):
+        self._added.setdefault(collection, {})[key] = val.copy()
+        self._deleted.get(collection, set()).discard(key)
+
+    async def aput(self, key, val, collection=DEFAULT_COLLECTION):
+        self.put(key, val, collection)
+
+    def get(self, key, collection=DEFAULT_COLLECTION):
+        added = self._added.get(collection)
+        if added is not None and key in added:
+            return added[key].copy()
+        if key in self._deleted.get(collection, ()):
+            return None
+        if collection not in self._index or key not in self._index[collection][0]:
+            return None
+        return json.loads(self._read(collection, key))
+
+    async def aget(self, key, collection=DEFAULT_COLLECTION):
+        return self.get(key, collection)
+
+    def get_all(self, collection=DEFAULT_COLLECTION):
+        values = {key: json.loads(self._read(collection, key)) for key in self._stored_keys(collection)}
+        for key, val in self._added.get(collection, {}).items():
+            values[key] = val.copy()
+        return values
+
+    async def aget_all(self, collection=DEFAULT_COLLECTION):
+        return self.get_all(collection)
+
+    def delete(self, key, collection=DEFAULT_COLLECTION):
+        existed = self._added.get(collection, {}).pop(key, None) is not None
+        if collection in self._index and key in self._index[collection][0]:
+            deleted = self._deleted.setdefault(collection, set())
+            existed = existed or key not in deleted
+            deleted.add(key)
+        return existed
+
+    async def adelete(self, key, collection=DEFAULT_COLLECTION):
+        return self.delete(key, collection)
+
+    def keys(self, collection=DEFAULT_COLLECTION):
+        """値を読み込まずにキーの一覧を返す関数"""
+        return self._stored_keys(collection) + list(self._added.get(collection, {}))
+
+    def count(self, collection=DEFAULT_COLLECTION):
+        return len(self.keys(collection))
+
+    def persist(self, persist_path):
+        """全ての値を新しいファイルに書き出す関数（一時ファイル経由で置き換え）
+
+        変更のない値はJSONを解析せずにバイト列のままコピーする。
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(persist_path)), exist_ok=True)
+        tmp_path = persist_path + '.tmp'
+        collections = list(dict.fromkeys(list(self._index) + list(self._added)))
+        arrays = {'collections': np.array(collections, dtype=str)}
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            offset = len(MAGIC)
+            for i, collection in enumerate(collections):
+                keys = []
+                spans = []
+                items = [(key, self._read(collection, key)) for key in self._stored_keys(collection)]
+                items += [
+                    (key, json.dumps(val, ensure_ascii=False).encode('utf-8'))
+                    for key, val in self._added.get(collection, {}).items()
+                ]
+                for key, data in items:
+                    f.write(data)
+                    keys.append(key)
+                    spans.append((offset, len(data)))
+                    offset += len(data)
+                arrays[f'keys_{i}'] = np.array(keys, dtype=str)
+                arrays[f'spans_{i}'] = np.array(spans, dtype=np.int64).reshape(-1, 2)
+
+            buffer = io.BytesIO()
+            np.savez(buffer, **arrays)
+            f.write(buffer.getvalue())
+            f.write(TRAILER.pack(offset, len(buffer.getvalue()), MAGIC))
+
+        # 書き出したファイルに切り替える（古いファイルをmmapしている他プロセスはそのまま読み続けられる）
+        self.close()
+        os.replace(tmp_path, persist_path)
+        self._path = persist_path
+        self._index = {}
+        self._added = {}
+        self._deleted = {}
+        self._open(persist_path)
+
+    @classmethod
+    def from_dict(cls, save_dict):
+        """{collection: {key: dict}} からストアを作成する関数（JSON形式からの移行用）"""
+        kvstore = cls()
+        for collection, values in save_dict.items():
+            for key, val in values.items():
+                kvstore.put(key, val, collection)
+        return kvstore
+
+class BlobDocumentStore(KVDocumentStore):
+    """BlobKVStoreを使うdocstore（ノードのテキストとメタデータはアクセス時に読み込む）"""
+
+    def __init__(self, blob_kvstore=None, namespace=None, batch_size=DEFAULT_BATCH_SIZE):
+        super().__init__(blob_kvstore or BlobKVStore(), namespace=namespace, batch_size=batch_size)
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir, namespace=None):
+        return cls(BlobKVStore(os.path.join(persist_dir, BLOB_STORE_FILENAME)), namespace=namespace)
+
+    @classmethod
+    def from_simple_docstore(cls, docstore):
+        """SimpleDocumentStore（docstore.json）の内容を移し替える関数"""
+        return cls(BlobKVStore.from_dict(docstore.to_dict()))
+
+    def persist(self, persist_path=None, fs=None):
+        """docstore.jsonの代わりに同じディレクトリのdocstore.binへ保存する関数"""
+        persist_dir = os.path.dirname(persist_path)
+        self._kvstore.persist(os.path.join(persist_dir, BLOB_STORE_FILENAME))
+        # JSON形式から移行した場合は古いファイルを削除する
+        legacy_path = os.path.join(persist_dir, LEGACY_DOCSTORE_FILENAME)
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+
+    def close(self):
+        """mmapしたファイルを閉じる関数"""
+        self._kvstore.close()
+
+    def node_ids(self):
+        """ノードを読み込まずにIDの一覧を返す関数"""
+        return self._kvstore.keys(self._node_collection)
+
+    def node_count(self):
+        # __len__にすると空のストアが偽になり、StorageContext.from_defaultsで置き換えられてしまう
+        return self._kvstore.count(self._node_collection)
+
+def blob_store_exists(persist_dir):
+    """docstore.binが保存済みか確認する関数"""
+    return os.path.exists(os.path.join(persist_dir, BLOB_STORE_FILENAME))
+
+def list_node_ids(docstore):
+    """docstoreのノードIDを一覧する関数（BlobDocumentStoreではノード本体を読み込まない）"""
+    if isinstance(docstore, BlobDocumentStore):
+        return docstore.node_ids()
+    return list(docstore.docs)
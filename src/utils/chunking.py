@@ -0,0 +1,155 @@
+from llama_index.core import Settings
+from llama_index.core.constants import DATA_KEY
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.storage.docstore.utils import doc_to_json, json_to_doc
+from config import CHUNK_SIZE, CHUNK_OVERLAP
+import json
+import os
+import re
+import sqlite3
+import zlib
+import numpy as np
+
+# チャンク分割の処理を変更したら更新する（キャッシュしたノードとマニフェストを無効にする）
+CHUNKER_VERSION = 1
+
+# 文の区切り: 句点・感嘆符・疑問符（全角・半角）と続く閉じ括弧、または改行
+# 半角のピリオドは後ろに空白がある場合のみ文末とする（小数点や略語で区切らない）
+SENTENCE_PATTERN = re.compile(
+    r'(?:[^。．！？!?.\n]|\.(?![ \t]|$))*'
+    r'(?:[。．！？!?.]+[」』）)】"\']*[ \t]*|\n+|$)'
+)
+
+# 1文がチャンクサイズを超える場合は読点・カンマでさらに区切る
+CLAUSE_PATTERN = r'[^,.;、。，．？！!?]+[,.;、。，．？！!?]?'
+
+def split_sentences(text):
+    """テキストを文ごとに分割する関数（連結すると元のテキストに戻る）"""
+    return [sentence for sentence in SENTENCE_PATTERN.findall(text) if sentence]
+
+def create_node_parser(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """日本語の文の区切りを考慮してチャンクに分割するノードパーサーを作成する関数
+
+    チャンクサイズ・重なりはLlamaIndexの既定のトークナイザーのトークン数。
+    PDFはページごとのドキュメントとして読み込まれるため、チャンクはページをまたがず、
+    ページ番号（page_label）などのメタデータはそのままノードに引き継がれる。
+    """
+    return SentenceSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        paragraph_separator="\n\n",
+        chunking_tokenizer_fn=split_sentences,
+        secondary_chunking_regex=CLAUSE_PATTERN,
+    )
+
+def chunking_signature(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """チャンク分割の設定を表す文字列を返す関数（設定が変わったらノードを作り直す）"""
+    return f"sentence-ja-v{CHUNKER_VERSION}:{chunk_size}:{chunk_overlap}"
+
+def group_nodes_by_file(nodes):
+    """ノードを元ファイルのパスごとにまとめる関数"""
+    nodes_by_path = {}
+    for node in nodes:
+        nodes_by_path.setdefault(node.metadata.get('file_path'), []).append(node)
+    return nodes_by_path
+
+def group_ref_doc_ids_by_file(nodes):
+    """ノードの元ドキュメントのIDをファイルのパスごとにまとめる関数（マニフェスト用）"""
+    doc_ids_by_path = {}
+    for node in nodes:
+        doc_ids = doc_ids_by_path.setdefault(node.metadata.get('file_path'), [])
+        if node.ref_doc_id not in doc_ids:
+            doc_ids.append(node.ref_doc_id)
+    return doc_ids_by_path
+
+def _summary(values):
+    values = np.asarray(values, dtype=np.float64)
+    return {
+        'min': int(values.min()),
+        'mean': round(float(values.mean()), 1),
+        'p50': int(np.percentile(values, 50)),
+        'p95': int(np.percentile(values, 95)),
+        'max': int(values.max()),
+    }
+
+def chunk_report(nodes, tokenizer=None):
+    """チャンク数と、チャンクの文字数・トークン数の分布を返す関数"""
+    if not nodes:
+        return {'chunks': 0}
+    tokenizer = tokenizer or Settings.tokenizer
+    texts = [node.get_content() for node in nodes]
+    return {
+        'chunks': len(nodes),
+        'chars': _summary([len(text) for text in texts]),
+        'tokens': _summary([len(tokenizer(text)) for text in texts]),
+    }
+
+def format_chunk_report(report):
+    """チャンクの分布を表示用の文字列にする関数"""
+    if not report['chunks']:
+        return "チャンクはありません"
+    lines = [f"チャンク数: {report['chunks']}"]
+    for key, label in (('chars', '文字数'), ('tokens', 'トークン数')):
+        values = report[key]
+        lines.append(
+            f"  {label}: 平均 {values['mean']}, 中央値 {values['p50']}, p95 {values['p95']}, "
+            f"最小 {values['min']}, 最大 {values['max']}"
+        )
+    return "\n".join(lines)
+
+class NodeCache:
+    """(ファイルのパス, チャンク分割の設定) ごとに、分割済みのノードをファイルのハッシュとともに保存するキャッシュ
+
+    ハッシュが一致するファイルは、PDFの解析とチャンク分割を行わずにキャッシュのノードを使う。
+    ノードはエンベディングを含まないJSONをzlibで圧縮してSQLiteに保存する。
+    """
+
+    def __init__(self, path, signature):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.signature = signature
+        self.hits = 0
+        self.misses = 0
+        self._conn = sqlite3.connect(path)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS nodes ('
+            ' path TEXT NOT NULL,'
+            ' signature TEXT NOT NULL,'
+            ' sha256 TEXT NOT NULL,'
+            ' data BLOB NOT NULL,'
+            ' PRIMARY KEY (path, signature)'
+            ') WITHOUT ROWID'
+        )
+        self._conn.commit()
+
+    def get_many(self, file_entries):
+        """ハッシュが一致するファイルのノードを {パス: [ノード]} で返す関数"""
+        found = {}
+        for entry in file_entries:
+            row = self._conn.execute(
+                'SELECT data FROM nodes WHERE path = ? AND signature = ? AND sha256 = ?',
+                [entry['path'], self.signature, entry['sha256']]
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                continue
+            found[entry['path']] = [json_to_doc(data) for data in json.loads(zlib.decompress(row[0]))]
+            self.hits += 1
+        return found
+
+    def put_many(self, items):
+        """(ファイルのエントリ, ノードのリスト) の組をまとめて保存する関数"""
+        rows = []
+        for entry, nodes in items:
+            data = [doc_to_json(node) for node in nodes]
+            for node_data in data:
+                # エンベディングはEmbeddingCacheに保存されるため含めない
+                node_data[DATA_KEY].pop('embedding', None)
+            rows.append((entry['path'], self.signature, entry['sha256'], zlib.compress(json.dumps(data).encode('utf-8'))))
+        self._conn.executemany('INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?)', rows)
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,197 @@
+from llama_index.core import Settings
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import MetadataMode, NodeWithScore, TextNode
+from config import CONTEXT_TOKEN_BUDGET, CONTEXT_TOKENIZER, CONTEXT_DEDUP_THRESHOLD, CONTEXT_MIN_TOKENS
+from utils.tracing import span
+import threading
+
+# 読み込んだトークナイザー（プロセス内で共有する）
+_tokenizers = {}
+_tokenizers_lock = threading.Lock()
+
+def load_tokenizer(name=CONTEXT_TOKENIZER):
+    """テキストをトークン列にする関数を返す関数
+
+    nameにはLLMと同じトークナイザーのディレクトリまたはHugging Faceのモデル名を指定する。
+    空の場合やロードできない場合はLlamaIndexの既定のトークナイザー（tiktoken）を使う。
+    """
+    with _tokenizers_lock:
+        if name in _tokenizers:
+            return _tokenizers[name]
+        tokenizer = None
+        if name:
+            try:
+                from transformers import AutoTokenizer
+                hf_tokenizer = AutoTokenizer.from_pretrained(name)
+                tokenizer = lambda text: hf_tokenizer.encode(text, add_special_tokens=False)
+            except Exception as e:
+                print(f"トークナイザー '{name}' をロードできないため、既定のトークナイザーを使用します: {e}")
+        _tokenizers[name] = tokenizer or Settings.tokenizer
+        return _tokenizers[name]
+
+def shingles(text, size=3):
+    """空白を除いたテキストの文字n-gramの集合を返す関数（重複判定用）"""
+    text = "".join(text.split())
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def _overlap_length(previous_text, next_text, max_length=2000):
+    """previous_textの末尾とnext_textの先頭で重なっている文字数を返す関数"""
+    for length in range(min(len(previous_text), len(next_text), max_length), 0, -1):
+        if previous_text.endswith(next_text[:length]):
+            return length
+    return 0
+
+def _join_chunks(previous, following):
+    """隣り合うチャンクのテキストを、チャンク分割時の重なりを除いて連結する関数"""
+    previous_end, following_start = previous.end_char_idx, following.start_char_idx
+    if previous_end is not None and following_start is not None and following_start <= previous_end:
+        overlap = previous_end - following_start
+    else:
+        overlap = _overlap_length(previous.text, following.text)
+    return previous.text + following.text[overlap:]
+
+class ContextPacker(BaseNodePostprocessor):
+    """LLMに渡す前にノードを重複除去・連結し、トークン数の上限内に詰めるノードポストプロセッサ
+
+    1. 内容がほぼ同じノード（重複したPDFの同じ箇所など）はスコアが高い方だけを残す
+    2. 同じファイルの隣り合うチャンクは重なりを除いて1つのノードにまとめる
+    3. スコアの高い順にtoken_budgetまで詰め、収まらないノードは文の区切りで切り詰めるか除く
+    トークン数はLLMに渡す形式（メタデータ付き）のテキストで数える。
+    """
+
+    token_budget: int = CONTEXT_TOKEN_BUDGET
+    dedup_threshold: float = CONTEXT_DEDUP_THRESHOLD
+    min_tokens: int = CONTEXT_MIN_TOKENS
+    _tokenizer: object = PrivateAttr()
+
+    def __init__(self, tokenizer=None, token_budget=CONTEXT_TOKEN_BUDGET, dedup_threshold=CONTEXT_DEDUP_THRESHOLD,
+                 min_tokens=CONTEXT_MIN_TOKENS):
+        super().__init__(token_budget=token_budget, dedup_threshold=dedup_threshold, min_tokens=min_tokens)
+        self._tokenizer = tokenizer or Settings.tokenizer
+
+    @classmethod
+    def class_name(cls):
+        return "ContextPacker"
+
+    def count_tokens(self, node):
+        return len(self._tokenizer(node.get_content(metadata_mode=MetadataMode.LLM)))
+
+    def deduplicate(self, nodes):
+        """ほぼ同じ内容のノードを除く関数（スコアの高い順に比較し、先に残したノードを優先する）"""
+        if self.dedup_threshold <= 0:
+            return list(nodes)
+        kept = []
+        kept_shingles = []
+        for node_with_score in sorted(nodes, key=lambda n: n.score or 0.0, reverse=True):
+            node_shingles = shingles(node_with_score.node.get_content(metadata_mode=MetadataMode.NONE))
+            if any(jaccard(node_shingles, other) >= self.dedup_threshold for other in kept_shingles):
+                continue
+            kept.append(node_with_score)
+            kept_shingles.append(node_shingles)
+        return kept
+
+    def merge_adjacent(self, nodes):
+        """同じファイルの隣り合うチャンクを1つのノードにまとめる関数（スコアは最大値を使う）"""
+        by_id = {node_with_score.node.node_id: node_with_score for node_with_score in nodes}
+        merged = []
+        for node_with_score in nodes:
+            previous = node_with_score.node.prev_node
+            if previous is not None and previous.node_id in by_id:
+                # 前のチャンクから連結するため、ここでは処理しない
+                continue
+            chain = [node_with_score]
+            following = node_with_score.node.next_node
+            while following is not None and following.node_id in by_id and len(chain) < len(nodes):
+                chain.append(by_id[following.node_id])
+                following = chain[-1].node.next_node
+            if len(chain) == 1:
+                merged.append(node_with_score)
+                continue
+            text = chain[0].node.text
+            for previous_node, next_node in zip(chain, chain[1:]):
+                text = _join_chunks(
+                    TextNode(text=text, end_char_idx=previous_node.node.end_char_idx), next_node.node
+                )
+            first = chain[0].node
+            node = TextNode(
+                id_=first.node_id,
+                text=text,
+                metadata=dict(first.metadata),
+                excluded_llm_metadata_keys=first.excluded_llm_metadata_keys,
+                excluded_embed_metadata_keys=first.excluded_embed_metadata_keys,
+                relationships=dict(first.relationships),
+                start_char_idx=first.start_char_idx,
+                end_char_idx=chain[-1].node.end_char_idx,
+            )
+            merged.append(NodeWithScore(node=node, score=max(n.score or 0.0 for n in chain)))
+        return merged
+
+    def truncate(self, node_with_score, max_tokens):
+        """ノードをmax_tokens以内に収まるよう文の区切りで切り詰める関数（収まらなければNone）"""
+        node = node_with_score.node
+        text = node.text
+        low, high = 0, len(text)
+        # メタデータを含めたトークン数が上限以内になる最長の先頭部分を二分探索で求める
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count_tokens(TextNode(text=text[:middle], metadata=node.metadata,
+                                          excluded_llm_metadata_keys=node.excluded_llm_metadata_keys)) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        boundary = max(text.rfind(mark, 0, low) for mark in ("。", "\n", ". "))
+        if boundary >= low // 2:
+            low = boundary + 1
+        if low == 0:
+            return None
+        truncated = node.model_copy()
+        truncated.text = text[:low]
+        truncated.end_char_idx = node.start_char_idx + low if node.start_char_idx is not None else None
+        return NodeWithScore(node=truncated, score=node_with_score.score)
+
+    def _postprocess_nodes(self, nodes, query_bundle=None):
+        if not nodes:
+            return nodes
+
+        with span('pack', nodes=len(nodes)) as pack_span:
+            unique_nodes = self.deduplicate(nodes)
+            merged_nodes = self.merge_adjacent(unique_nodes)
+            merged_nodes.sort(key=lambda n: n.score or 0.0, reverse=True)
+
+            packed = []
+            total_tokens = 0
+            truncated = 0
+            for node_with_score in merged_nodes:
+                remaining = self.token_budget - total_tokens
+                if remaining < self.min_tokens:
+                    break
+                tokens = self.count_tokens(node_with_score.node)
+                if tokens > remaining:
+                    node_with_score = self.truncate(node_with_score, remaining)
+                    if node_with_score is None:
+                        continue
+                    tokens = self.count_tokens(node_with_score.node)
+                    truncated += 1
+                packed.append(node_with_score)
+                total_tokens += tokens
+
+            pack_span.set(
+                duplicates=len(nodes) - len(unique_nodes),
+                merged=len(unique_nodes) - len(merged_nodes),
+                truncated=truncated,
+                returned=len(packed),
+                tokens=total_tokens,
+            )
+        return packed
+
+def create_context_packer(token_budget=CONTEXT_TOKEN_BUDGET, tokenizer_name=CONTEXT_TOKENIZER):
+    """LLMのトークナイザーでトークン数を数えるContextPackerを作成する関数"""
+    return ContextPacker(tokenizer=load_tokenizer(tokenizer_name), token_budget=token_budget)
@@ -0,0 +1,106 @@
+from config import (
+    INDEX_DIR, DAEMON_URL, DAEMON_ENABLED, DAEMON_CONNECT_TIMEOUT, DAEMON_REQUEST_TIMEOUT
+)
+from types import SimpleNamespace
+from utils.manifest import get_index_version
+import json
+import urllib.error
+import urllib.request
+
+# CLIの起動を速くするため、このモジュールでは標準ライブラリ以外（llama_index・torchなど）を読み込まない
+
+# デーモンはローカル（またはdocker-composeの内部ネットワーク）で動くため、環境変数のHTTPプロキシを経由しない
+_opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+
+class DaemonError(Exception):
+    """デーモンがエラーを返した場合の例外（statusはHTTPのステータスコード）"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+class DaemonClient:
+    """query_daemon.pyにHTTP（JSON）で問い合わせるクライアント"""
+
+    def __init__(self, url=DAEMON_URL, timeout=DAEMON_REQUEST_TIMEOUT):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def _request(self, method, path, payload=None, timeout=None):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8') if payload is not None else None
+        req = urllib.request.Request(
+            self.url + path, data=data, method=method, headers={'Content-Type': 'application/json'}
+        )
+        try:
+            with _opener.open(req, timeout=timeout or self.timeout) as response:
+                return json.loads(response.read().decode('utf-8'))
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read().decode('utf-8')).get('error', str(e))
+            except ValueError:
+                message = str(e)
+            raise DaemonError(message, e.code)
+
+    def status(self, timeout=DAEMON_CONNECT_TIMEOUT):
+        """デーモンの状態（インデックスのバージョン・起動時間など）を取得する関数"""
+        return self._request('GET', '/status', timeout=timeout)
+
+    def open_session(self, profile, options=None, filters=None):
+        """チャットのセッションを開始する関数（会話履歴はデーモン側で保持する）"""
+        result = self._request(
+            'POST', '/api/sessions', {'profile': profile, 'options': options or {}, 'filters': filters}
+        )
+        return DaemonSession(self, result['session_id'])
+
+    def index_info(self):
+        """インデックスの診断情報を取得する関数"""
+        return self._request('GET', '/api/index_info')
+
+class DaemonSession:
+    """デーモン上のチャットセッション（chatの結果はPipelineResultと同じ属性を持つ）"""
+
+    def __init__(self, client, session_id):
+        self.client = client
+        self.session_id = session_id
+
+    def chat(self, message):
+        """質問を送り、検索とLLMによる回答の結果を返す関数"""
+        result = self.client._request('POST', f'/api/sessions/{self.session_id}/chat', {'message': message})
+        return SimpleNamespace(
+            response=result['response'],
+            source_nodes=[SimpleNamespace(**node) for node in result['source_nodes']],
+            timings=result['timings'],
+            cached=result['cached'],
+        )
+
+    def stats(self):
+        """デーモンのキャッシュの統計情報を返す関数（print_cache_statsに渡せる）"""
+        return self.client._request('GET', '/api/cache_stats')
+
+    def close(self):
+        """セッションを終了する関数（デーモンが停止していても例外にしない）"""
+        try:
+            self.client._request('DELETE', f'/api/sessions/{self.session_id}', timeout=DAEMON_CONNECT_TIMEOUT)
+        except (OSError, DaemonError):
+            pass
+
+def connect_daemon(index_dir=INDEX_DIR, url=DAEMON_URL):
+    """起動中のデーモンに接続する関数（使えない場合はNone）
+
+    デーモンが起動していない・ロード中・別のバージョンのインデックスを持っている場合は、
+    呼び出し側が自分でインデックスをロードできるようにNoneを返す。
+    """
+    if not DAEMON_ENABLED:
+        return None
+    client = DaemonClient(url)
+    try:
+        status = client.status()
+    except (OSError, ValueError, DaemonError):
+        return None
+    if status.get('status') != 'ready':
+        return None
+    if status.get('index_version') != get_index_version(index_dir):
+        print(f"デーモン（{client.url}）のインデックスが '{index_dir}' と異なるため、使用しません。")
+        print("インデックスを作り直した場合はデーモンを再起動してください。")
+        return None
+    return client
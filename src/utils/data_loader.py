@@ -1,16 +1,40 @@
 from llama_index.core.readers import SimpleDirectoryReader
-from config import PDF_DIR
+from multiprocessing.connection import wait
+from config import PDF_DIR, LOADER_NUM_WORKERS, LOADER_FILE_TIMEOUT
+from utils.manifest import scan_pdf_files
+from collections import deque
+import multiprocessing
 import os
+import time
+
+def load_documents(input_files=None, num_workers=LOADER_NUM_WORKERS, timeout=LOADER_FILE_TIMEOUT):
+    """PDFファイルを読み込む関数
+
+    input_filesを指定した場合はそのファイルのみを読み込む（差分インデックス用）。
+    ドキュメントIDはファイルパスから決定されるため、再実行しても同じIDになる。
+    num_workersが2以上の場合はプロセスプールで並列に解析する。
+    """
+    if num_workers > 1:
+        if input_files is None:
+            input_files = scan_pdf_files(PDF_DIR)
+        return load_documents_parallel(input_files, num_workers=num_workers, timeout=timeout)
 
-def load_documents():
-    """PDFファイルを読み込む関数"""
     try:
         # 正しい引数を使用 (llama_index.core v0.12.25)
-        reader = SimpleDirectoryReader(
-            input_dir=PDF_DIR,
-            recursive=True,
-            required_exts=['.pdf']
-        )
+        if input_files is not None:
+            if not input_files:
+                return []
+            reader = SimpleDirectoryReader(
+                input_files=input_files,
+                filename_as_id=True
+            )
+        else:
+            reader = SimpleDirectoryReader(
+                input_dir=PDF_DIR,
+                recursive=True,
+                required_exts=['.pdf'],
+                filename_as_id=True
+            )
         documents = reader.load_data()
         if documents:
             print(f"PDFファイルを{len(documents)}件読み込みました")
@@ -24,4 +48,123 @@ def load_documents():
             print(f"指定されたPDF_DIR '{PDF_DIR}' が存在しません。")
         else:
             print(f"PDF_DIRの内容: {os.listdir(PDF_DIR) if os.path.isdir(PDF_DIR) else '(ディレクトリではありません)'}")
-        return []
\ No newline at end of file
+        return []
+
+def _extract_documents_worker(conn):
+    """ワーカープロセス: 受け取ったファイルを解析してドキュメントを返す"""
+    while True:
+        path = conn.recv()
+        if path is None:
+            break
+        try:
+            reader = SimpleDirectoryReader(
+                input_files=[path],
+                filename_as_id=True,
+                raise_on_error=True
+            )
+            conn.send((path, reader.load_data(), None))
+        except Exception as e:
+            conn.send((path, [], f"{type(e).__name__}: {e}"))
+    conn.close()
+
+class _ExtractionWorker:
+    """1ファイルずつ処理を割り当てる解析用ワーカープロセス"""
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_extract_documents_worker, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.path = None
+        self.started_at = None
+
+    def assign(self, path):
+        self.path = path
+        self.started_at = time.monotonic()
+        self.conn.send(path)
+
+    def release(self):
+        self.path = None
+        self.started_at = None
+
+    def stop(self, force=False):
+        if not force and self.process.is_alive():
+            try:
+                self.conn.send(None)
+            except (OSError, ValueError):
+                force = True
+            self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
+
+def iter_documents_parallel(input_files, num_workers=LOADER_NUM_WORKERS, timeout=LOADER_FILE_TIMEOUT):
+    """PDFをプロセスプールで並列に解析し、完了した順に (パス, ドキュメント, エラー) を返すジェネレータ
+
+    各ワーカーには1ファイルずつ割り当て、timeout秒を超えたファイルやワーカーの
+    異常終了はそのファイルのみ失敗として扱い、ワーカーを作り直して処理を続ける。
+    """
+    pending = deque(input_files)
+    if not pending:
+        return
+    context = multiprocessing.get_context()
+    workers = [_ExtractionWorker(context) for _ in range(min(num_workers, len(pending)))]
+
+    def replace(worker):
+        worker.stop(force=True)
+        workers[workers.index(worker)] = _ExtractionWorker(context)
+
+    try:
+        while True:
+            # 空いているワーカーに次のファイルを割り当てる
+            for worker in workers:
+                if worker.path is None and pending:
+                    worker.assign(pending.popleft())
+            busy = [worker for worker in workers if worker.path is not None]
+            if not busy:
+                break
+
+            now = time.monotonic()
+            wait_timeout = None
+            if timeout:
+                wait_timeout = max(0.0, min(worker.started_at + timeout for worker in busy) - now)
+            ready = wait([worker.conn for worker in busy] + [worker.process.sentinel for worker in busy], wait_timeout)
+
+            for worker in busy:
+                path = worker.path
+                if worker.conn in ready:
+                    try:
+                        result = worker.conn.recv()
+                    except (EOFError, OSError):
+                        result = (path, [], f"ワーカープロセスが異常終了しました (exit code: {worker.process.exitcode})")
+                        replace(worker)
+                    else:
+                        worker.release()
+                    yield result
+                elif worker.process.sentinel in ready:
+                    worker.process.join()
+                    yield (path, [], f"ワーカープロセスが異常終了しました (exit code: {worker.process.exitcode})")
+                    replace(worker)
+                elif timeout and time.monotonic() - worker.started_at > timeout:
+                    yield (path, [], f"解析が{timeout:.0f}秒以内に終わらなかったため中断しました")
+                    replace(worker)
+    finally:
+        for worker in workers:
+            worker.stop(force=worker.path is not None)
+
+def load_documents_parallel(input_files, num_workers=LOADER_NUM_WORKERS, timeout=LOADER_FILE_TIMEOUT):
+    """PDFファイルをプロセスプールで並列に読み込む関数"""
+    print(f"PDFファイルを{num_workers}プロセスで並列に解析しています...")
+    documents = []
+    failed = []
+    for i, (path, docs, error) in enumerate(iter_documents_parallel(input_files, num_workers, timeout), 1):
+        if error:
+            failed.append(path)
+            print(f"  スキップ: {path} ({error})")
+        documents.extend(docs)
+        if i % 100 == 0:
+            print(f"  {i}/{len(input_files)}ファイル処理済み")
+
+    print(f"PDFファイルを{len(documents)}件読み込みました（失敗: {len(failed)}ファイル）")
+    return documents
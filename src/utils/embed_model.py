@@ -0,0 +1,21 @@
+from config import EMBED_MODEL_NAME, EMBED_BATCH_SIZE, EMBED_NUM_THREADS, EMBED_DEVICE
+
+def configure_torch_threads(num_threads=EMBED_NUM_THREADS):
+    """torchのスレッド数を設定する関数（0以下なら既定値のまま）"""
+    if num_threads <= 0:
+        return
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(num_threads)
+
+def create_embed_model(model_name=EMBED_MODEL_NAME, batch_size=EMBED_BATCH_SIZE, device=EMBED_DEVICE,
+                       num_threads=EMBED_NUM_THREADS):
+    """設定に従ってエンベディングモデルを作成する関数
+
+    sentence-transformers・torchの読み込みには時間がかかるため、モデルを作成する時点で読み込む。
+    """
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+    configure_torch_threads(num_threads)
+    return HuggingFaceEmbedding(model_name=model_name, embed_batch_size=batch_size, device=device)
@@ -0,0 +1,174 @@
+from config import EMBED_BATCH_SIZE
+from tqdm import tqdm
+import hashlib
+import os
+import sqlite3
+import time
+import unicodedata
+import numpy as np
+
+# SQLiteのIN句に一度に渡すキー数
+LOOKUP_BATCH_SIZE = 500
+
+def normalize_text(text):
+    """キャッシュキー用にチャンクテキストを正規化する関数（Unicode正規化・改行コード・前後の空白）"""
+    return unicodedata.normalize('NFC', text).replace('\r\n', '\n').strip()
+
+def text_hash(text):
+    """正規化したチャンクテキストのSHA-256ハッシュを返す関数"""
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+class EmbeddingCache:
+    """(モデル名, チャンクテキストのハッシュ) をキーにしたエンベディングの永続キャッシュ
+
+    ベクトルはfloat32のバイト列としてSQLiteに保存する。インデックスを全件再構築しても
+    キャッシュは残るため、内容が同じチャンクはモデルを呼ばずに再利用される。
+    """
+
+    def __init__(self, path, model_name):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.model_name = model_name
+        self.hits = 0
+        self.misses = 0
+        self._conn = sqlite3.connect(path)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS embeddings ('
+            ' model TEXT NOT NULL,'
+            ' hash TEXT NOT NULL,'
+            ' dim INTEGER NOT NULL,'
+            ' vector BLOB NOT NULL,'
+            ' PRIMARY KEY (model, hash)'
+            ') WITHOUT ROWID'
+        )
+        self._conn.commit()
+
+    def get_many(self, hashes):
+        """ハッシュに対応するエンベディングを {hash: np.ndarray} で返す関数"""
+        found = {}
+        unique_hashes = list(dict.fromkeys(hashes))
+        for start in range(0, len(unique_hashes), LOOKUP_BATCH_SIZE):
+            batch = unique_hashes[start:start + LOOKUP_BATCH_SIZE]
+            placeholders = ','.join('?' * len(batch))
+            rows = self._conn.execute(
+                f'SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})',
+                [self.model_name] + batch
+            )
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, items):
+        """(hash, embedding) の組をまとめて保存する関数"""
+        rows = []
+        for key, embedding in items:
+            vector = np.asarray(embedding, dtype=np.float32)
+            rows.append((self.model_name, key, vector.shape[0], vector.tobytes()))
+        self._conn.executemany('INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)', rows)
+        self._conn.commit()
+
+    def __len__(self):
+        row = self._conn.execute('SELECT COUNT(*) FROM embeddings WHERE model = ?', [self.model_name]).fetchone()
+        return row[0]
+
+    def close(self):
+        self._conn.close()
+
+class EmbeddingStats:
+    """エンベディング計算のスループット（チャンク数・トークン数・モデルの処理時間）を集計するクラス"""
+
+    def __init__(self):
+        self.chunks = 0
+        self.tokens = 0
+        self.chars = 0
+        self.seconds = 0.0
+        self.batches = 0
+
+    def add(self, texts, tokens, seconds):
+        self.chunks += len(texts)
+        self.chars += sum(len(text) for text in texts)
+        if tokens is not None:
+            self.tokens += tokens
+        self.seconds += seconds
+        self.batches += 1
+
+    def summary(self):
+        """表示用の集計結果を返す関数"""
+        if not self.chunks:
+            return "エンベディングを計算したチャンクはありません"
+        seconds = max(self.seconds, 1e-9)
+        text = (
+            f"{self.chunks}チャンク / {self.batches}バッチ / {self.seconds:.2f}秒"
+            f" ({self.chunks / seconds:.1f} チャンク/秒"
+        )
+        if self.tokens:
+            text += f", {self.tokens / seconds:.0f} トークン/秒"
+        else:
+            text += f", {self.chars / seconds:.0f} 文字/秒"
+        return text + ")"
+
+def count_tokens(embed_model, texts):
+    """モデルのトークナイザーでトークン数を数える関数（トークナイザーがなければNone）"""
+    model = getattr(embed_model, '_model', None)
+    tokenizer = getattr(model, 'tokenizer', None)
+    if tokenizer is None:
+        return None
+    max_length = getattr(model, 'max_seq_length', None)
+    lengths = [len(ids) for ids in tokenizer(texts, add_special_tokens=True)['input_ids']]
+    if max_length:
+        lengths = [min(length, max_length) for length in lengths]
+    return sum(lengths)
+
+def embed_in_batches(texts, embed_model, batch_size=EMBED_BATCH_SIZE, stats=None, show_progress=False):
+    """テキストを長さ順に並べてバッチごとにエンベディングを計算する関数
+
+    バッチ内のテキストは最長のものに合わせてパディングされるため、長さの近いものを
+    同じバッチにまとめると無駄な計算が減る。結果は元の順序で返す。
+    """
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+    embeddings = [None] * len(texts)
+    batch_starts = range(0, len(order), batch_size)
+    if show_progress:
+        batch_starts = tqdm(batch_starts, desc="エンベディング計算", unit="batch")
+    for start in batch_starts:
+        indices = order[start:start + batch_size]
+        batch = [texts[i] for i in indices]
+        start_time = time.perf_counter()
+        batch_embeddings = embed_model.get_text_embedding_batch(batch)
+        elapsed = time.perf_counter() - start_time
+        if stats is not None:
+            stats.add(batch, count_tokens(embed_model, batch), elapsed)
+        for i, embedding in zip(indices, batch_embeddings):
+            embeddings[i] = embedding
+    return embeddings
+
+def embed_texts(texts, embed_model, cache=None, show_progress=False, stats=None, batch_size=EMBED_BATCH_SIZE):
+    """キャッシュを参照しながらテキストのエンベディングを計算する関数
+
+    同一テキストの重複は1回だけモデルに渡し、新たに計算した結果はキャッシュに保存する。
+    """
+    if cache is None:
+        return embed_in_batches(texts, embed_model, batch_size, stats=stats, show_progress=show_progress)
+
+    hashes = [text_hash(text) for text in texts]
+    cached = cache.get_many(hashes)
+
+    # キャッシュにないテキストを重複なしで計算する
+    missing = {}
+    for key, text in zip(hashes, texts):
+        if key not in cached and key not in missing:
+            missing[key] = text
+    cache.hits += sum(1 for key in hashes if key in cached)
+    cache.misses += len(hashes) - sum(1 for key in hashes if key in cached)
+
+    if missing:
+        new_embeddings = embed_in_batches(
+            list(missing.values()), embed_model, batch_size, stats=stats, show_progress=show_progress
+        )
+        cache.put_many(zip(missing.keys(), new_embeddings))
+        for key, embedding in zip(missing.keys(), new_embeddings):
+            cached[key] = np.asarray(embedding, dtype=np.float32)
+
+    return [cached[key].tolist() for key in hashes]
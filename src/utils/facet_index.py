@@ -0,0 +1,233 @@
+from config import PDF_DIR, FACET_FILTER_CACHE_SIZE
+from utils.query_cache import LRUCache
+import datetime
+import fnmatch
+import os
+import numpy as np
+
+FACET_INDEX_FILENAME = 'facet_index.npz'
+FILTER_KEYS = ('folders', 'files', 'date_from', 'date_to')
+# 日付が不明なノード（日付の範囲で絞り込むと除外される）
+MISSING_DATE = np.iinfo(np.int32).min
+
+def _parse_date(value):
+    """YYYY-MM-DD形式の日付を1970-01-01からの日数に変換する関数"""
+    try:
+        return (datetime.date.fromisoformat(str(value)[:10]) - datetime.date(1970, 1, 1)).days
+    except ValueError:
+        raise ValueError(f"日付はYYYY-MM-DD形式で指定してください: {value}")
+
+def normalize_filters(filters):
+    """絞り込み条件を検証し、正規化した辞書を返す関数（条件がなければNone）
+
+    filtersは {'folders': [...], 'files': [...], 'date_from': 'YYYY-MM-DD', 'date_to': 'YYYY-MM-DD'}。
+    同じ項目の複数の値はいずれかに一致すればよく（OR）、異なる項目はすべてを満たす必要がある（AND）。
+    """
+    if not filters:
+        return None
+    if not isinstance(filters, dict):
+        raise ValueError("filtersはオブジェクトで指定してください")
+    unknown = set(filters) - set(FILTER_KEYS)
+    if unknown:
+        raise ValueError(f"未対応の絞り込み条件です: {', '.join(sorted(unknown))}（{', '.join(FILTER_KEYS)}のいずれか）")
+
+    normalized = {}
+    for key in ('folders', 'files'):
+        values = filters.get(key) or []
+        if isinstance(values, str):
+            values = [values]
+        values = sorted({str(value).strip().strip('/\\') for value in values if str(value).strip()})
+        if values:
+            normalized[key] = tuple(values)
+    for key in ('date_from', 'date_to'):
+        if filters.get(key):
+            normalized[key] = _parse_date(filters[key])
+    if 'date_from' in normalized and 'date_to' in normalized and normalized['date_from'] > normalized['date_to']:
+        raise ValueError("date_fromはdate_to以前の日付を指定してください")
+    return normalized or None
+
+def filters_key(filters):
+    """正規化した絞り込み条件をキャッシュキーにする関数"""
+    if not filters:
+        return None
+    return tuple(sorted(filters.items()))
+
+def _relative_folder(folder, root_dir=PDF_DIR):
+    """フォルダのパスをPDF_DIRからの相対パス（'/'区切り）にする関数（PDF_DIRの外ならそのまま）"""
+    if root_dir:
+        root = os.path.abspath(root_dir)
+        if folder == root or folder.startswith(root + os.sep):
+            return os.path.relpath(folder, root).replace(os.sep, '/')
+    return folder.replace(os.sep, '/')
+
+def folder_matches(folder, relative_folder, value):
+    """フォルダが指定値（PDF_DIRからの相対パス・フォルダ名・絶対パス）またはその配下に一致するか判定する関数"""
+    value = value.replace('\\', '/')
+    if relative_folder == value or relative_folder.startswith(value + '/'):
+        return True
+    absolute_folder = folder.replace(os.sep, '/')
+    if absolute_folder == '/' + value or absolute_folder.startswith('/' + value + '/'):
+        return True
+    # フォルダ名だけを指定した場合は、途中の階層も含めて一致するフォルダとその配下
+    return value in relative_folder.split('/')
+
+def file_matches(file_name, pattern):
+    """ファイル名がパターンに一致するか判定する関数（ワイルドカードがなければ部分一致、大文字小文字は区別しない）"""
+    file_name = file_name.lower()
+    pattern = pattern.lower()
+    if not any(char in pattern for char in '*?['):
+        return pattern in file_name
+    return fnmatch.fnmatchcase(file_name, pattern)
+
+class FacetIndex:
+    """フォルダ・ファイル名・日付からノードを絞り込むための索引
+
+    フォルダは値ごとにノードのビットマップ（np.packbits）を事前に計算しておき、
+    ファイル名はノードごとのファイル番号、日付はノードごとの日数で保持する。
+    絞り込み結果はノードの行番号のbool配列で返し、ベクトル検索（FAISSのIDSelector）と
+    BM25の検索で、スコアを計算する前に対象外のノードを除くために使う。
+    """
+
+    def __init__(self, node_ids, faiss_ids, folders, relative_folders, folder_bitmaps, file_names, file_codes,
+                 dates):
+        self.node_ids = node_ids
+        self.faiss_ids = faiss_ids
+        self.folders = folders
+        self.relative_folders = relative_folders
+        self.folder_bitmaps = folder_bitmaps
+        self.file_names = file_names
+        self.file_codes = file_codes
+        self.dates = dates
+        self._masks = LRUCache(FACET_FILTER_CACHE_SIZE)
+        self._faiss_bitmaps = LRUCache(FACET_FILTER_CACHE_SIZE)
+
+    @classmethod
+    def build(cls, node_ids, metadatas, faiss_ids, root_dir=PDF_DIR):
+        """ノードIDとメタデータ、ノードのFAISS IDから索引を作成する関数（FAISS IDがないノードは-1）"""
+        folder_codes = {}
+        file_codes = {}
+        node_folders = np.empty(len(node_ids), dtype=np.int32)
+        node_files = np.empty(len(node_ids), dtype=np.int32)
+        dates = np.full(len(node_ids), MISSING_DATE, dtype=np.int32)
+        for row, metadata in enumerate(metadatas):
+            file_path = metadata.get('file_path', '')
+            folder = metadata.get('folder') or os.path.dirname(file_path)
+            file_name = metadata.get('file_name') or os.path.basename(file_path)
+            node_folders[row] = folder_codes.setdefault(folder, len(folder_codes))
+            node_files[row] = file_codes.setdefault(file_name, len(file_codes))
+            date = metadata.get('last_modified_date') or metadata.get('creation_date')
+            if date:
+                try:
+                    dates[row] = _parse_date(date)
+                except ValueError:
+                    pass
+
+        folders = list(folder_codes)
+        folder_bitmaps = np.stack([
+            np.packbits(node_folders == code, bitorder='little') for code in range(len(folders))
+        ]) if folders else np.zeros((0, 0), dtype=np.uint8)
+        return cls(
+            list(node_ids),
+            np.asarray(faiss_ids, dtype=np.int64),
+            folders,
+            [_relative_folder(folder, root_dir) for folder in folders],
+            folder_bitmaps,
+            list(file_codes),
+            node_files,
+            dates,
+        )
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def mask(self, filters):
+        """絞り込み条件に一致するノードの行番号のbool配列を返す関数（条件がなければNone）"""
+        if not filters:
+            return None
+        key = filters_key(filters)
+        cached = self._masks.get(key)
+        if cached is not None:
+            return cached
+
+        mask = np.ones(len(self.node_ids), dtype=bool)
+        if 'folders' in filters:
+            bitmap = np.zeros(self.folder_bitmaps.shape[1], dtype=np.uint8)
+            for code, (folder, relative_folder) in enumerate(zip(self.folders, self.relative_folders)):
+                if any(folder_matches(folder, relative_folder, value) for value in filters['folders']):
+                    bitmap |= self.folder_bitmaps[code]
+            mask &= np.unpackbits(bitmap, count=len(self.node_ids), bitorder='little').astype(bool)
+        if 'files' in filters:
+            codes = [
+                code for code, file_name in enumerate(self.file_names)
+                if any(file_matches(file_name, pattern) for pattern in filters['files'])
+            ]
+            mask &= np.isin(self.file_codes, codes)
+        if 'date_from' in filters:
+            mask &= (self.dates != MISSING_DATE) & (self.dates >= filters['date_from'])
+        if 'date_to' in filters:
+            mask &= (self.dates != MISSING_DATE) & (self.dates <= filters['date_to'])
+        self._masks.put(key, mask)
+        return mask
+
+    def faiss_bitmap(self, filters):
+        """絞り込み条件に一致するノードのFAISS IDのビットマップ（IDSelectorBitmap用）と対象のノード数を返す関数"""
+        key = filters_key(filters)
+        cached = self._faiss_bitmaps.get(key)
+        if cached is not None:
+            return cached
+        faiss_ids = self.faiss_ids[self.mask(filters)]
+        faiss_ids = faiss_ids[faiss_ids >= 0]
+        selected = np.zeros(int(self.faiss_ids.max()) + 1 if len(self.faiss_ids) else 0, dtype=bool)
+        selected[faiss_ids] = True
+        result = (np.packbits(selected, bitorder='little'), len(faiss_ids))
+        self._faiss_bitmaps.put(key, result)
+        return result
+
+    def facets(self):
+        """フォルダ（PDF_DIRからの相対パス）とファイル名ごとのノード数を返す関数"""
+        folder_counts = [
+            int(np.unpackbits(bitmap, count=len(self.node_ids), bitorder='little').sum())
+            for bitmap in self.folder_bitmaps
+        ]
+        file_counts = np.bincount(self.file_codes, minlength=len(self.file_names))
+        return {
+            'folders': {folder: int(count) for folder, count in zip(self.relative_folders, folder_counts)},
+            'files': {file_name: int(count) for file_name, count in zip(self.file_names, file_counts)},
+        }
+
+    def save(self, persist_dir):
+        """インデックスディレクトリに保存する関数（一時ファイル経由で置き換え）"""
+        path = os.path.join(persist_dir, FACET_INDEX_FILENAME)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                node_ids=np.array(self.node_ids, dtype=str),
+                faiss_ids=self.faiss_ids,
+                folders=np.array(self.folders, dtype=str),
+                relative_folders=np.array(self.relative_folders, dtype=str),
+                folder_bitmaps=self.folder_bitmaps,
+                file_names=np.array(self.file_names, dtype=str),
+                file_codes=self.file_codes,
+                dates=self.dates,
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, persist_dir):
+        """保存済みの索引を読み込む関数"""
+        with np.load(os.path.join(persist_dir, FACET_INDEX_FILENAME)) as data:
+            return cls(
+                data['node_ids'].tolist(),
+                data['faiss_ids'],
+                data['folders'].tolist(),
+                data['relative_folders'].tolist(),
+                data['folder_bitmaps'],
+                data['file_names'].tolist(),
+                data['file_codes'],
+                data['dates'],
+            )
+
+def facet_index_exists(persist_dir):
+    """絞り込み用の索引が保存済みか確認する関数"""
+    return os.path.exists(os.path.join(persist_dir, FACET_INDEX_FILENAME))
@@ -0,0 +1,131 @@
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore
+from config import (
+    INDEX_DIR, RETRIEVAL_MODE, HYBRID_DENSE_WEIGHT, HYBRID_SPARSE_WEIGHT, HYBRID_RRF_K, HYBRID_CANDIDATE_K
+)
+from utils.facet_index import FacetIndex, facet_index_exists
+from utils.query_cache import create_cached_retriever
+from utils.sparse_index import SparseIndex, sparse_index_exists
+import copy
+import numpy as np
+
+RETRIEVAL_MODES = ('vector', 'hybrid')
+
+def reciprocal_rank_fusion(ranked_lists, weights, rrf_k=HYBRID_RRF_K):
+    """複数の順位付きノードIDリストをReciprocal Rank Fusionで統合する関数
+
+    スコアは 重み / (rrf_k + 順位) の合計。[(ノードID, スコア), ...] をスコア順に返す。
+    """
+    scores = {}
+    for node_ids, weight in zip(ranked_lists, weights):
+        for rank, node_id in enumerate(node_ids, 1):
+            scores[node_id] = scores.get(node_id, 0.0) + weight / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+class HybridRetriever(BaseRetriever):
+    """ベクトル検索とBM25の検索結果をRRFで統合するRetriever
+
+    ベクトル検索にはCachedRetrieverを使うため、クエリのエンベディングと検索結果はキャッシュされる。
+    返すノードのスコアはRRFの統合スコア。
+    with_filters()で絞り込む場合は、ベクトル検索とBM25の両方で対象外のノードを除いてから検索する。
+    """
+
+    def __init__(self, dense_retriever, sparse_index, docstore, similarity_top_k,
+                 dense_weight=HYBRID_DENSE_WEIGHT, sparse_weight=HYBRID_SPARSE_WEIGHT,
+                 rrf_k=HYBRID_RRF_K, candidate_k=HYBRID_CANDIDATE_K):
+        super().__init__()
+        self._dense_retriever = dense_retriever
+        self._sparse_index = sparse_index
+        self._docstore = docstore
+        self._similarity_top_k = similarity_top_k
+        self._dense_weight = dense_weight
+        self._sparse_weight = sparse_weight
+        self._rrf_k = rrf_k
+        self._candidate_k = max(candidate_k, similarity_top_k)
+        self._sparse_allowed = None
+
+    @property
+    def facet_index(self):
+        return self._dense_retriever.facet_index
+
+    def with_filters(self, filters):
+        """絞り込み条件（normalize_filtersで正規化したもの）を適用したRetrieverを返す関数"""
+        if not filters:
+            return self
+        dense_retriever = self._dense_retriever.with_filters(filters)
+        facet_index = self.facet_index
+        mask = facet_index.mask(filters)
+        retriever = copy.copy(self)
+        retriever._dense_retriever = dense_retriever
+        if facet_index.node_ids == self._sparse_index.node_ids:
+            retriever._sparse_allowed = mask
+        else:
+            # 索引の作成時期が異なる場合はノードIDで対応付ける（絞り込み用の索引にないノードは除く）
+            rows = {node_id: row for row, node_id in enumerate(facet_index.node_ids)}
+            retriever._sparse_allowed = np.array([
+                node_id in rows and bool(mask[rows[node_id]]) for node_id in self._sparse_index.node_ids
+            ], dtype=bool)
+        return retriever
+
+    def get_query_embedding(self, query_str):
+        return self._dense_retriever.get_query_embedding(query_str)
+
+    def get_query_embeddings(self, query_strs):
+        return self._dense_retriever.get_query_embeddings(query_strs)
+
+    def _fuse(self, query_str, dense_results):
+        sparse_results = self._sparse_index.search(query_str, self._candidate_k, self._sparse_allowed)
+        fused = reciprocal_rank_fusion(
+            [[result.node.node_id for result in dense_results], [node_id for node_id, _ in sparse_results]],
+            [self._dense_weight, self._sparse_weight],
+            rrf_k=self._rrf_k,
+        )[:self._similarity_top_k]
+
+        # ベクトル検索で取得済みのノードはそのまま使い、BM25のみのノードはdocstoreから取り出す
+        known_nodes = {result.node.node_id: result.node for result in dense_results}
+        missing_ids = [node_id for node_id, _ in fused if node_id not in known_nodes]
+        for node in self._docstore.get_nodes(missing_ids, raise_error=False):
+            known_nodes[node.node_id] = node
+        return [
+            NodeWithScore(node=known_nodes[node_id], score=score)
+            for node_id, score in fused if node_id in known_nodes
+        ]
+
+    def retrieve_batch(self, query_strs, embeddings=None):
+        """複数クエリをまとめて検索する関数（ベクトル検索はバッチで実行）"""
+        dense_lists = self._dense_retriever.retrieve_batch(query_strs, embeddings)
+        return [self._fuse(query_str, dense_results) for query_str, dense_results in zip(query_strs, dense_lists)]
+
+    def _retrieve(self, query_bundle):
+        dense_results = self._dense_retriever.retrieve(query_bundle)
+        return self._fuse(query_bundle.query_str, dense_results)
+
+def create_retriever(index, query_cache, index_version, similarity_top_k, similarity_cutoff=None,
+                     embed_model=None, persist_dir=INDEX_DIR, mode=RETRIEVAL_MODE):
+    """設定された検索方式のRetrieverを作成する関数
+
+    hybridでも転置インデックスが作成されていない場合はベクトル検索のみを使う。
+    similarity_cutoffはベクトル検索の類似度にのみ適用される。
+    絞り込み用の索引が作成されていれば読み込み、with_filters()で絞り込めるようにする。
+    persist_dirには公開中のバージョンのディレクトリ（current_index_dirで解決済みのもの）を渡し、
+    ベクトル・BM25・絞り込み用の索引とindex_versionが同じバージョンを指すようにする。
+    """
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"未対応のRETRIEVAL_MODEです: {mode}（{', '.join(RETRIEVAL_MODES)}のいずれか）")
+
+    if mode == 'hybrid' and not sparse_index_exists(persist_dir):
+        print("BM25の転置インデックスがないため、ベクトル検索のみを使用します（main.py --full で作成できます）")
+        mode = 'vector'
+
+    facet_index = FacetIndex.load(persist_dir) if facet_index_exists(persist_dir) else None
+    if mode == 'vector':
+        return create_cached_retriever(
+            index, query_cache, index_version, similarity_top_k,
+            similarity_cutoff=similarity_cutoff, embed_model=embed_model, facet_index=facet_index
+        )
+
+    dense_retriever = create_cached_retriever(
+        index, query_cache, index_version, max(HYBRID_CANDIDATE_K, similarity_top_k),
+        similarity_cutoff=similarity_cutoff, embed_model=embed_model, facet_index=facet_index
+    )
+    return HybridRetriever(dense_retriever, SparseIndex.load(persist_dir), index.docstore, similarity_top_k)
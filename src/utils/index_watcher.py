@@ -0,0 +1,62 @@
+from config import INDEX_DIR, INDEX_WATCH_INTERVAL
+from utils.manifest import get_index_version
+import threading
+
+class IndexWatcher:
+    """公開中のインデックスのバージョンを定期的に確認し、変わっていればreloadを呼ぶバックグラウンドスレッド
+
+    current_version()は使用中のバージョン（ロード前ならNone）を返す関数、reload(version)は新しいバージョンを
+    ロードして差し替える関数で、失敗した場合は例外を送出する。ロードに失敗したバージョンは、
+    次のバージョンが公開されるまで再試行しない。
+    """
+
+    def __init__(self, current_version, reload, index_dir=INDEX_DIR, interval=INDEX_WATCH_INTERVAL):
+        self.index_dir = index_dir
+        self.interval = interval
+        self.reloads = 0
+        self.failed_version = None
+        self.last_error = None
+        self._current_version = current_version
+        self._reload = reload
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def check(self):
+        """新しいバージョンが公開されていればロードする関数（差し替えた場合はTrue）"""
+        current = self._current_version()
+        version = get_index_version(self.index_dir)
+        if current is None or version is None or version in (current, self.failed_version):
+            return False
+        try:
+            self._reload(version)
+        except Exception as e:
+            self.failed_version = version
+            self.last_error = str(e)
+            print(f"インデックス（{version}）のロードに失敗しました。使用中のインデックス（{current}）を使い続けます: {e}")
+            return False
+        self.reloads += 1
+        self.failed_version = None
+        self.last_error = None
+        return True
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                # バージョンの確認自体に失敗した場合（ファイルの置き換え中など）は次の確認で再試行する
+                self.last_error = str(e)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='index-watcher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        return {"reloads": self.reloads, "failed_version": self.failed_version, "last_error": self.last_error}
@@ -0,0 +1,367 @@
+from contextlib import asynccontextmanager, contextmanager
+from llama_index.core.bridge.pydantic import PrivateAttr, SerializeAsAny
+from llama_index.core.llms.llm import LLM
+from utils.tracing import Span, span, current_span, llm_usage, record_llm_usage
+from collections import deque
+import asyncio
+import threading
+import time
+
+class LLMOverloadedError(RuntimeError):
+    """待ち行列が一杯、または待ち時間の上限を超えたためLLMへのリクエストを受け付けられない"""
+
+class LLMCancelledError(RuntimeError):
+    """クライアントの切断などで生成が中止された"""
+
+class LLMGateway:
+    """LLMへの同時リクエスト数を制限するクラス
+
+    同時に実行できる生成はmax_concurrency件までで、それを超えたリクエストは最大max_queue件まで待機する。
+    待ち行列が一杯の場合や、queue_timeout秒待っても順番が来ない場合はLLMOverloadedErrorになる。
+    空いた実行枠は待ち行列の先頭から順に割り当て、後から来たリクエストが待機中のリクエストを追い越さない。
+    スレッド（Flask・バッチ処理）とasyncioの両方から使える。
+    """
+
+    def __init__(self, max_concurrency, max_queue, queue_timeout=None, poll_interval=0.05):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrencyは1以上を指定してください")
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.poll_interval = poll_interval
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._waiters = deque()
+        self._max_queued = 0
+        self._started = 0
+        self._completed = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._cancelled = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def _enqueue(self):
+        """待ち行列の末尾に入り、順番を表すオブジェクトを返す（一杯なら拒否する）。呼び出し時は_conditionを保持していること"""
+        if self._in_flight >= self.max_concurrency and len(self._waiters) >= self.max_queue:
+            self._rejected += 1
+            raise LLMOverloadedError(
+                f"LLMが混雑しています（実行中 {self._in_flight}件, 待機中 {len(self._waiters)}件）"
+            )
+        waiter = object()
+        self._waiters.append(waiter)
+        self._max_queued = max(self._max_queued, len(self._waiters))
+        return waiter
+
+    def _try_start(self, start_time, waiter=None):
+        """空きがあり、自分の順番であれば実行中に移る。呼び出し時は_conditionを保持していること
+
+        waiterを省略した場合（待ち行列に入る前）は、待機中のリクエストがないときだけ実行中に移る。
+        """
+        if self._in_flight >= self.max_concurrency:
+            return False
+        if (self._waiters[0] if self._waiters else None) is not waiter:
+            return False
+        if waiter is not None:
+            self._waiters.popleft()
+            # 次の先頭のリクエストも空きがあればすぐに実行できるよう起こす
+            self._condition.notify_all()
+        self._in_flight += 1
+        self._started += 1
+        waited = time.monotonic() - start_time
+        self._total_wait += waited
+        self._max_wait = max(self._max_wait, waited)
+        return True
+
+    def _leave(self, waiter):
+        """実行中に移らずに待ち行列を抜ける。呼び出し時は_conditionを保持していること"""
+        if waiter in self._waiters:
+            self._waiters.remove(waiter)
+            self._condition.notify_all()
+
+    def _check_timeout(self, start_time, timeout):
+        if timeout is not None and time.monotonic() - start_time >= timeout:
+            self._timed_out += 1
+            raise LLMOverloadedError(f"LLMの順番待ちが{timeout:.0f}秒を超えました")
+
+    def acquire(self, cancel_event=None, timeout=None):
+        """実行枠が空くまで待つ関数（cancel_eventがセットされたらLLMCancelledError）"""
+        timeout = self.queue_timeout if timeout is None else timeout
+        start_time = time.monotonic()
+        with self._condition:
+            if self._try_start(start_time):
+                return
+            waiter = self._enqueue()
+            try:
+                while not self._try_start(start_time, waiter):
+                    if cancel_event is not None and cancel_event.is_set():
+                        self._cancelled += 1
+                        raise LLMCancelledError("順番待ちの間に中止されました")
+                    self._check_timeout(start_time, timeout)
+                    # 切断・タイムアウトを確認できるよう一定間隔で起きる
+                    self._condition.wait(self.poll_interval)
+            finally:
+                self._leave(waiter)
+
+    async def aacquire(self, timeout=None):
+        """acquire()のasyncio版（イベントループを止めずに待つ。タスクのキャンセルで待機を抜ける）"""
+        timeout = self.queue_timeout if timeout is None else timeout
+        start_time = time.monotonic()
+        with self._condition:
+            if self._try_start(start_time):
+                return
+            waiter = self._enqueue()
+        try:
+            while True:
+                await asyncio.sleep(self.poll_interval)
+                with self._condition:
+                    if self._try_start(start_time, waiter):
+                        return
+                    self._check_timeout(start_time, timeout)
+        except asyncio.CancelledError:
+            with self._condition:
+                self._cancelled += 1
+            raise
+        finally:
+            with self._condition:
+                self._leave(waiter)
+
+    def release(self, cancelled=False):
+        with self._condition:
+            self._in_flight -= 1
+            if cancelled:
+                self._cancelled += 1
+            else:
+                self._completed += 1
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self, cancel_event=None):
+        """実行枠を確保している間だけ処理を行うコンテキストマネージャ"""
+        self.acquire(cancel_event)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def aslot(self):
+        await self.aacquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        """実行中・待機中の件数と待ち時間の統計を返す関数"""
+        with self._condition:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "queued": len(self._waiters),
+                "max_queued": self._max_queued,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "timed_out": self._timed_out,
+                "cancelled": self._cancelled,
+                "avg_wait_seconds": self._total_wait / self._started if self._started else 0.0,
+                "max_wait_seconds": self._max_wait,
+            }
+
+class GatedStream:
+    """実行枠を確保したままLLMのストリームを読み進めるイテレータ
+
+    最後まで読むか、close()・cancel_eventのセットで元のストリーム（OllamaへのHTTP接続）を閉じ、
+    実行枠を解放する。閉じられたHTTP接続はOllama側でも生成が中止される。
+    中止した場合はそこまでの出力でストリームを終える。
+    trace_spanを渡した場合は、終了時に最後のチャンクのトークン数を記録してスパンを終える。
+    """
+
+    def __init__(self, gateway, stream, cancel_event=None, trace_span=None):
+        self._gateway = gateway
+        self._stream = stream
+        self._cancel_event = cancel_event
+        self._trace_span = trace_span
+        self._last_chunk = None
+        self._released = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._released:
+            raise StopIteration
+        if self._cancel_event is not None and self._cancel_event.is_set():
+            self._finish(cancelled=True)
+            raise StopIteration
+        try:
+            self._last_chunk = next(self._stream)
+            return self._last_chunk
+        except StopIteration:
+            self._finish()
+            raise
+        except BaseException as e:
+            self._finish(error=e)
+            raise
+
+    def _finish(self, cancelled=False, error=None):
+        if self._released:
+            return
+        self._released = True
+        try:
+            self._stream.close()
+        finally:
+            self._gateway.release(cancelled=cancelled)
+            if self._trace_span is not None:
+                # Ollamaはトークン数を最後のチャンクにのみ含める
+                usage = llm_usage(getattr(self._last_chunk, 'raw', None))
+                record_llm_usage(usage)
+                self._trace_span.set(**usage)
+                if cancelled:
+                    self._trace_span.set(cancelled=True)
+                if error is not None:
+                    self._trace_span.set(error=type(error).__name__)
+                self._trace_span.end()
+
+    def close(self):
+        self._finish(cancelled=True)
+
+    def __del__(self):
+        # 読み終える前に破棄された場合も実行枠を返す
+        if not getattr(self, '_released', True):
+            self._finish(cancelled=True)
+
+class GatedLLM(LLM):
+    """LLMGatewayを通してLLMを呼び出すラッパー
+
+    チャットエンジンから呼ばれる全ての生成（同期・非同期・ストリーミング）で実行枠を確保し、
+    ストリーミングではストリームを読み終えるか閉じられるまで実行枠を保持する。
+    for_request()で作るリクエストごとのラッパーでは、reserve()で先に順番を待っておける
+    （チャットエンジンはストリームを別スレッドで読むため、待機はリクエストのスレッドで済ませる）。
+    生成はgenerateスパンとして記録し、Ollamaが返すトークン数と生成速度を属性・メトリクスに加える。
+    """
+
+    llm: SerializeAsAny[LLM]
+    _gateway: LLMGateway = PrivateAttr()
+    _cancel_event: threading.Event = PrivateAttr(default=None)
+    _reserved: bool = PrivateAttr(default=False)
+    _reserve_lock: threading.Lock = PrivateAttr()
+    _trace_parent: Span = PrivateAttr(default=None)
+    _on_generation_start: object = PrivateAttr(default=None)
+
+    def __init__(self, llm, gateway, cancel_event=None, **kwargs):
+        super().__init__(llm=llm, callback_manager=llm.callback_manager, **kwargs)
+        self._gateway = gateway
+        self._cancel_event = cancel_event
+        self._reserved = False
+        self._reserve_lock = threading.Lock()
+        # チャットエンジンが別スレッドで生成する場合も、リクエストのスパンの子として記録する
+        self._trace_parent = current_span()
+        self._on_generation_start = None
+
+    @classmethod
+    def class_name(cls):
+        return "GatedLLM"
+
+    @property
+    def gateway(self):
+        return self._gateway
+
+    @property
+    def metadata(self):
+        return self.llm.metadata
+
+    def for_request(self, cancel_event=None):
+        """リクエストごとのラッパーを返す関数（LLM本体とHTTPクライアントは共有）"""
+        return GatedLLM(self.llm, self._gateway, cancel_event=cancel_event)
+
+    def on_generation_start(self, callback):
+        """次の生成の開始直前に一度だけ呼ぶ関数を登録する"""
+        self._on_generation_start = callback
+
+    def _generation_started(self):
+        callback, self._on_generation_start = self._on_generation_start, None
+        if callback is not None:
+            callback()
+
+    def reserve(self):
+        """次の生成のために実行枠を確保しておく関数"""
+        self._gateway.acquire(self._cancel_event)
+        with self._reserve_lock:
+            self._reserved = True
+
+    def release_reservation(self):
+        """確保したまま使われなかった実行枠を返す関数"""
+        with self._reserve_lock:
+            reserved, self._reserved = self._reserved, False
+        if reserved:
+            self._gateway.release(cancelled=True)
+
+    def _acquire(self):
+        with self._reserve_lock:
+            reserved, self._reserved = self._reserved, False
+        if not reserved:
+            self._gateway.acquire(self._cancel_event)
+
+    def _stream(self, func, *args, **kwargs):
+        self._acquire()
+        self._generation_started()
+        trace_span = Span('generate', current_span() or self._trace_parent)
+        try:
+            stream = func(*args, **kwargs)
+        except BaseException as e:
+            self._gateway.release()
+            trace_span.set(error=type(e).__name__)
+            trace_span.end()
+            raise
+        return GatedStream(self._gateway, stream, self._cancel_event, trace_span=trace_span)
+
+    def _call(self, func, *args, **kwargs):
+        self._acquire()
+        self._generation_started()
+        try:
+            with span('generate', parent=current_span() or self._trace_parent) as trace_span:
+                response = func(*args, **kwargs)
+                usage = llm_usage(getattr(response, 'raw', None))
+                record_llm_usage(usage)
+                trace_span.set(**usage)
+                return response
+        finally:
+            self._gateway.release()
+
+    def chat(self, messages, **kwargs):
+        return self._call(self.llm.chat, messages, **kwargs)
+
+    def complete(self, prompt, formatted=False, **kwargs):
+        return self._call(self.llm.complete, prompt, formatted=formatted, **kwargs)
+
+    def stream_chat(self, messages, **kwargs):
+        return self._stream(self.llm.stream_chat, messages, **kwargs)
+
+    def stream_complete(self, prompt, formatted=False, **kwargs):
+        return self._stream(self.llm.stream_complete, prompt, formatted=formatted, **kwargs)
+
+    async def achat(self, messages, **kwargs):
+        async with self._gateway.aslot():
+            return await self.llm.achat(messages, **kwargs)
+
+    async def acomplete(self, prompt, formatted=False, **kwargs):
+        async with self._gateway.aslot():
+            return await self.llm.acomplete(prompt, formatted=formatted, **kwargs)
+
+    async def _astream(self, func, *args, **kwargs):
+        # タスクがキャンセルされると元の非同期ストリームも閉じられる
+        async with self._gateway.aslot():
+            stream = await func(*args, **kwargs)
+            try:
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                await stream.aclose()
+
+    async def astream_chat(self, messages, **kwargs):
+        return self._astream(self.llm.astream_chat, messages, **kwargs)
+
+    async def astream_complete(self, prompt, formatted=False, **kwargs):
+        return self._astream(self.llm.astream_complete, prompt, formatted=formatted, **kwargs)
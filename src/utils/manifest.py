@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+MANIFEST_FILENAME = 'manifest.json'
+MANIFEST_VERSION = 1
+# main.pyはビルドごとにINDEX_DIR/versions/<バージョン>へ保存し、CURRENTに公開中のディレクトリを書く
+CURRENT_FILENAME = 'CURRENT'
+VERSIONS_DIRNAME = 'versions'
+
+def scan_pdf_files(root_dir):
+    """PDF_DIR以下のPDFファイルを再帰的に列挙する関数"""
+    pdf_files = []
+    for dirpath, dirnames, filenames in os.walk(os.path.abspath(root_dir)):
+        # 隠しディレクトリはSimpleDirectoryReaderと同様に除外
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        for filename in sorted(filenames):
+            if filename.startswith('.') or not filename.lower().endswith('.pdf'):
+                continue
+            pdf_files.append(os.path.join(dirpath, filename))
+    return pdf_files
+
+def file_sha256(file_path, chunk_size=1024 * 1024):
+    """ファイル内容のSHA-256ハッシュを計算する関数"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_manifest(index_dir):
+    """インデックスディレクトリからマニフェストを読み込む関数"""
+    manifest_path = os.path.join(index_dir, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"マニフェストの読み込みに失敗しました（全件再構築します）: {e}")
+        return None
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+def save_manifest(index_dir, manifest):
+    """マニフェストをインデックスディレクトリに保存する関数（一時ファイル経由で置き換え）"""
+    manifest_path = os.path.join(index_dir, MANIFEST_FILENAME)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, manifest_path)
+
+def new_manifest():
+    """空のマニフェストを作成する関数"""
+    return {'version': MANIFEST_VERSION, 'files': {}}
+
+def diff_manifest(manifest, file_paths):
+    """マニフェストと現在のファイル一覧を比較し、追加・変更・削除・未変更に分類する関数
+
+    サイズと更新時刻が一致するファイルはハッシュ計算を省略する。
+    一致しない場合のみハッシュを計算し、内容が同じなら未変更として扱う。
+    戻り値の各エントリは {'path', 'size', 'mtime_ns', 'sha256'} の辞書。
+    """
+    known_files = manifest['files'] if manifest else {}
+    added, changed, unchanged = [], [], []
+
+    for path in file_paths:
+        stat = os.stat(path)
+        entry = {'path': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        previous = known_files.get(path)
+
+        if previous and previous['size'] == stat.st_size and previous['mtime_ns'] == stat.st_mtime_ns:
+            entry['sha256'] = previous['sha256']
+            unchanged.append(entry)
+            continue
+
+        entry['sha256'] = file_sha256(path)
+        if previous is None:
+            added.append(entry)
+        elif previous['sha256'] == entry['sha256']:
+            # touchされただけのファイルは再エンベディング不要
+            unchanged.append(entry)
+        else:
+            changed.append(entry)
+
+    current = set(file_paths)
+    removed = [path for path in known_files if path not in current]
+    return added, changed, removed, unchanged
+
+def update_manifest(manifest, entries, doc_ids_by_path=None):
+    """エントリとドキュメントIDをマニフェストに反映する関数"""
+    doc_ids_by_path = doc_ids_by_path or {}
+    for entry in entries:
+        path = entry['path']
+        previous = manifest['files'].get(path, {})
+        manifest['files'][path] = {
+            'size': entry['size'],
+            'mtime_ns': entry['mtime_ns'],
+            'sha256': entry['sha256'],
+            'doc_ids': doc_ids_by_path.get(path, previous.get('doc_ids', [])),
+        }
+    return manifest
+
+def new_index_version():
+    """インデックスのバージョン文字列（保存ごとに一意）を作成する関数"""
+    return f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+def current_index_dir(index_dir):
+    """公開中のインデックスのディレクトリを返す関数
+
+    CURRENTがない場合（バージョンごとのディレクトリに分ける前の形式）はindex_dir自体を返す。
+    """
+    try:
+        with open(os.path.join(index_dir, CURRENT_FILENAME), 'r', encoding='utf-8') as f:
+            name = f.read().strip()
+    except OSError:
+        return index_dir
+    return os.path.join(index_dir, name) if name else index_dir
+
+def version_dir(index_dir, index_version):
+    """バージョンごとのインデックスを保存するディレクトリを返す関数"""
+    return os.path.join(index_dir, VERSIONS_DIRNAME, index_version)
+
+def publish_index_version(index_dir, index_version):
+    """CURRENTを置き換えて、保存が完了したバージョンを公開する関数
+
+    CURRENTは一時ファイル経由で置き換えるため、読み込む側は古いバージョンか新しいバージョンの
+    どちらかを見ることになり、書き込み途中のファイルを読むことはない。
+    """
+    current_path = os.path.join(index_dir, CURRENT_FILENAME)
+    tmp_path = current_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(f"{VERSIONS_DIRNAME}/{index_version}\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, current_path)
+
+def remove_old_versions(index_dir, keep):
+    """新しい順にkeep個と公開中のバージョンを残し、古いバージョンのディレクトリを削除する関数
+
+    バージョン名は作成時刻で始まるため、名前の順が作成順になる。
+    削除したバージョンを読み込み済みのプロセスは、開いているファイルをそのまま使い続けられる。
+    """
+    versions_dir = os.path.join(index_dir, VERSIONS_DIRNAME)
+    if not os.path.isdir(versions_dir):
+        return []
+    current = os.path.abspath(current_index_dir(index_dir))
+    removed = []
+    for name in sorted(os.listdir(versions_dir), reverse=True)[max(keep, 1):]:
+        path = os.path.join(versions_dir, name)
+        if os.path.abspath(path) == current:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed.append(name)
+    return removed
+
+def get_index_version(index_dir):
+    """公開中のインデックスのバージョンを取得する関数（キャッシュの無効化と、インデックスの差し替えの検知に使用）"""
+    index_dir = current_index_dir(index_dir)
+    manifest = load_manifest(index_dir)
+    if manifest and manifest.get('index_version'):
+        return manifest['index_version']
+    # マニフェストがない場合はdocstoreの更新時刻で代用する
+    for filename in ('docstore.bin', 'docstore.json'):
+        docstore_path = os.path.join(index_dir, filename)
+        if os.path.exists(docstore_path):
+            return str(os.stat(docstore_path).st_mtime_ns)
+    return None
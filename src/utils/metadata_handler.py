@@ -1,7 +1,15 @@
 import os
 
+# エンベディング対象のテキストに含めないメタデータ（パスは意味を持たず、重複ファイルのキャッシュも効かなくなるため）
+EMBED_EXCLUDED_KEYS = ['file_path', 'folder']
+
 def add_folder_metadata(documents):
     for doc in documents:
         folder = os.path.dirname(doc.metadata['file_path'])
         doc.metadata['folder'] = folder
-    return documents
\ No newline at end of file
+        excluded_keys = getattr(doc, 'excluded_embed_metadata_keys', None)
+        if excluded_keys is not None:
+            for key in EMBED_EXCLUDED_KEYS:
+                if key not in excluded_keys:
+                    excluded_keys.append(key)
+    return documents
@@ -0,0 +1,300 @@
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.vector_stores.faiss import FaissMapVectorStore
+from utils.vector_store import search_vector_store
+from collections import OrderedDict
+import copy
+import hashlib
+import threading
+import time
+import numpy as np
+
+class LRUCache:
+    """ヒット数・ミス数と削減できた時間を記録するスレッドセーフなLRUキャッシュ"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.miss_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    def get(self, key):
+        """値を取得する関数（なければNone）"""
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            # ヒット時はミス時の平均処理時間を削減できたとみなす
+            if self.misses:
+                self.saved_seconds += self.miss_seconds / self.misses
+            return self._data[key]
+
+    def put(self, key, value, elapsed=0.0):
+        """値を保存する関数（elapsedはミス時に値の計算にかかった秒数）"""
+        with self._lock:
+            self.miss_seconds += elapsed
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def stats(self):
+        """統計情報を辞書で返す関数"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "saved_seconds": round(self.saved_seconds, 4),
+            }
+
+class QueryCache:
+    """クエリ文字列 → エンベディング と 検索条件 → 検索結果（ノードIDとスコア）のキャッシュ
+
+    検索結果のキーにはインデックスのバージョンを含めるため、main.pyでインデックスを
+    再構築すると古い結果は参照されなくなる。invalidate()で明示的に破棄することもできる。
+    """
+
+    def __init__(self, embedding_maxsize=1024, retrieval_maxsize=1024):
+        self.embeddings = LRUCache(embedding_maxsize)
+        self.retrievals = LRUCache(retrieval_maxsize)
+
+    def invalidate(self):
+        """全てのキャッシュを破棄する関数"""
+        self.embeddings.clear()
+        self.retrievals.clear()
+
+    def stats(self):
+        return {
+            "query_embedding": self.embeddings.stats(),
+            "retrieval": self.retrievals.stats(),
+        }
+
+def normalize_query(query_str):
+    """キャッシュキー用にクエリを正規化する関数"""
+    return " ".join(query_str.split())
+
+def embedding_key(embedding):
+    """エンベディングからキャッシュキーを作成する関数"""
+    return hashlib.sha1(np.asarray(embedding, dtype=np.float32).tobytes()).hexdigest()
+
+class CachedRetriever(BaseRetriever):
+    """クエリのエンベディングと検索結果をキャッシュするRetriever
+
+    ヒットした場合は保存しておいたノードIDからdocstoreのノードを取り出すため、
+    エンベディング計算とベクトル検索の両方を省略できる。
+    similarity_cutoffを指定した場合は、閾値未満のノードを除いた結果をキャッシュする。
+    vector_storeを渡すとretrieve_batch()で複数クエリをまとめて検索できる。
+    facet_index（FacetIndex）を渡すとwith_filters()でフォルダ・ファイル名・日付による絞り込みができる。
+    """
+
+    def __init__(self, retriever, embed_model, docstore, query_cache, index_version,
+                 similarity_top_k, similarity_cutoff=None, vector_store=None, facet_index=None):
+        super().__init__()
+        self._retriever = retriever
+        self._embed_model = embed_model
+        self._docstore = docstore
+        self._query_cache = query_cache
+        self._index_version = index_version
+        self._similarity_top_k = similarity_top_k
+        self._similarity_cutoff = similarity_cutoff
+        self._vector_store = vector_store
+        self._facet_index = facet_index
+        self._filters = None
+
+    @property
+    def facet_index(self):
+        return self._facet_index
+
+    def with_filters(self, filters):
+        """絞り込み条件（normalize_filtersで正規化したもの）を適用したRetrieverを返す関数
+
+        キャッシュは元のRetrieverと共有し、検索結果のキーには絞り込み条件を含める。
+        """
+        if not filters:
+            return self
+        if self._facet_index is None or self._vector_store is None:
+            raise ValueError("絞り込み用の索引がありません（main.py --full で作成してください）")
+        retriever = copy.copy(self)
+        retriever._filters = filters
+        return retriever
+
+    def get_query_embedding(self, query_str):
+        """クエリのエンベディングをキャッシュから取得または計算する関数"""
+        key = normalize_query(query_str)
+        embedding = self._query_cache.embeddings.get(key)
+        if embedding is None:
+            start_time = time.perf_counter()
+            embedding = self._embed_model.get_query_embedding(query_str)
+            self._query_cache.embeddings.put(key, embedding, time.perf_counter() - start_time)
+        return embedding
+
+    def get_query_embeddings(self, query_strs):
+        """複数クエリのエンベディングをまとめて取得する関数（キャッシュにないものだけを1回で計算）"""
+        keys = [normalize_query(query_str) for query_str in query_strs]
+        embeddings = {}
+        missing = {}
+        for key, query_str in zip(keys, query_strs):
+            if key in embeddings or key in missing:
+                continue
+            embedding = self._query_cache.embeddings.get(key)
+            if embedding is None:
+                missing[key] = query_str
+            else:
+                embeddings[key] = embedding
+
+        if missing:
+            start_time = time.perf_counter()
+            if getattr(self._embed_model, 'query_instruction', None):
+                # クエリ用の指示文があるモデルはテキスト用のバッチ計算と結果が異なる
+                new_embeddings = [self._embed_model.get_query_embedding(q) for q in missing.values()]
+            else:
+                new_embeddings = self._embed_model.get_text_embedding_batch(list(missing.values()))
+            elapsed = (time.perf_counter() - start_time) / len(missing)
+            for key, embedding in zip(missing, new_embeddings):
+                self._query_cache.embeddings.put(key, embedding, elapsed)
+                embeddings[key] = embedding
+        return [embeddings[key] for key in keys]
+
+    def _retrieval_key(self, embedding):
+        return (
+            embedding_key(embedding),
+            self._similarity_top_k,
+            self._similarity_cutoff,
+            self._index_version,
+            tuple(sorted(self._filters.items())) if self._filters else None,
+        )
+
+    def _lookup(self, key):
+        """キャッシュ済みの検索結果をノードに戻す関数（ノードが欠けていればNone）"""
+        cached = self._query_cache.retrievals.get(key)
+        if cached is None:
+            return None
+        nodes = self._docstore.get_nodes([node_id for node_id, _ in cached], raise_error=False)
+        if len(nodes) != len(cached):
+            return None
+        return [NodeWithScore(node=node, score=score) for node, (_, score) in zip(nodes, cached)]
+
+    def _to_node_results(self, pairs):
+        """(ノードID, スコア) の組をdocstoreのノードに戻す関数（docstoreにないノードは除く）"""
+        results = []
+        for node_id, score in pairs:
+            node = self._docstore.get_node(node_id, raise_error=False)
+            if node is not None:
+                results.append(NodeWithScore(node=node, score=score))
+        return results
+
+    def _apply_cutoff(self, results):
+        if self._similarity_cutoff is None:
+            return results
+        return [
+            result for result in results
+            if result.score is not None and result.score >= self._similarity_cutoff
+        ]
+
+    def retrieve_batch(self, query_strs, embeddings=None):
+        """複数クエリの検索結果をまとめて取得する関数
+
+        キャッシュにないクエリはベクトルストアに1回で問い合わせる。
+        vector_storeがない場合はクエリごとに検索する。
+        """
+        if embeddings is None:
+            embeddings = self.get_query_embeddings(query_strs)
+
+        results = [None] * len(query_strs)
+        pending = []
+        for i, embedding in enumerate(embeddings):
+            results[i] = self._lookup(self._retrieval_key(embedding))
+            if results[i] is None:
+                pending.append(i)
+        if not pending:
+            return results
+
+        if self._vector_store is None:
+            for i in pending:
+                results[i] = self._retrieve(QueryBundle(query_str=query_strs[i], embedding=embeddings[i]))
+            return results
+
+        start_time = time.perf_counter()
+        matches = search_vector_store(
+            self._vector_store, [embeddings[i] for i in pending], self._similarity_top_k, self._selection()
+        )
+        elapsed = (time.perf_counter() - start_time) / len(pending)
+        for i, pairs in zip(pending, matches):
+            node_results = self._apply_cutoff(self._to_node_results(pairs))
+            self._query_cache.retrievals.put(
+                self._retrieval_key(embeddings[i]),
+                [(result.node.node_id, result.score) for result in node_results],
+                elapsed
+            )
+            results[i] = node_results
+        return results
+
+    def _selection(self):
+        """絞り込み条件に一致するノードのFAISS IDのビットマップを返す関数（条件がなければNone）"""
+        if not self._filters:
+            return None
+        return self._facet_index.faiss_bitmap(self._filters)
+
+    def _search_filtered(self, embedding):
+        """絞り込み条件に一致するノードだけをFAISSで検索する関数（スコアの計算前に対象外を除く）"""
+        pairs = search_vector_store(self._vector_store, [embedding], self._similarity_top_k, self._selection())[0]
+        return self._to_node_results(pairs)
+
+    def _retrieve(self, query_bundle):
+        if query_bundle.embedding is None:
+            query_bundle = QueryBundle(
+                query_str=query_bundle.query_str,
+                custom_embedding_strs=query_bundle.custom_embedding_strs,
+                embedding=self.get_query_embedding(query_bundle.query_str),
+            )
+
+        key = self._retrieval_key(query_bundle.embedding)
+        cached = self._lookup(key)
+        if cached is not None:
+            return cached
+
+        start_time = time.perf_counter()
+        if self._filters:
+            results = self._search_filtered(query_bundle.embedding)
+        else:
+            results = self._retriever.retrieve(query_bundle)
+        results = self._apply_cutoff(results)
+        self._query_cache.retrievals.put(
+            key,
+            [(result.node.node_id, result.score) for result in results],
+            time.perf_counter() - start_time
+        )
+        return results
+
+def create_cached_retriever(index, query_cache, index_version, similarity_top_k,
+                            similarity_cutoff=None, embed_model=None, facet_index=None):
+    """インデックスからキャッシュ付きRetrieverを作成する関数（embed_model省略時はインデックスのモデルを使用）"""
+    return CachedRetriever(
+        index.as_retriever(similarity_top_k=similarity_top_k),
+        embed_model=embed_model or index._embed_model,
+        docstore=index.docstore,
+        query_cache=query_cache,
+        index_version=index_version,
+        similarity_top_k=similarity_top_k,
+        similarity_cutoff=similarity_cutoff,
+        # まとめて検索できるのはFAISSのIDとノードIDを対応付けたベクトルストアのみ
+        vector_store=index.vector_store if isinstance(index.vector_store, FaissMapVectorStore) else None,
+        facet_index=facet_index,
+    )
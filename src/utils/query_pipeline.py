@@ -0,0 +1,287 @@
+from llama_index.core.chat_engine import ContextChatEngine
+from llama_index.core.llms import ChatMessage, MessageRole
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import QueryBundle
+from utils.tracing import Span, span, activate, current_span, record_span, format_timings
+import time
+
+class PrefetchedRetriever(BaseRetriever):
+    """検索済みのノードをそのまま返すRetriever（チャットエンジンでの再検索を防ぐ）"""
+
+    def __init__(self, nodes):
+        super().__init__()
+        self._nodes = nodes
+
+    def _retrieve(self, query_bundle):
+        return list(self._nodes)
+
+class StageTimer:
+    """処理段階ごとの経過時間を記録するクラス（各段階はスパンとしてメトリクスにも記録される）"""
+
+    def __init__(self):
+        self.timings = {}
+
+    def measure(self, stage, func, *args, **kwargs):
+        """funcを実行し、その時間をstageとして記録する関数"""
+        start_time = time.perf_counter()
+        try:
+            with span(stage):
+                return func(*args, **kwargs)
+        finally:
+            self.add(stage, time.perf_counter() - start_time)
+
+    def add(self, stage, seconds):
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+class PipelineResult:
+    """クエリパイプラインの結果（チャットエンジンの応答と同じ属性を持つ）"""
+
+    def __init__(self, response, source_nodes, timings, cached=False):
+        self.response = response
+        self.source_nodes = source_nodes
+        self.timings = timings
+        self.cached = cached
+
+    @property
+    def response_gen(self):
+        """回答をまとめて1回で返すジェネレータ（キャッシュした回答をストリーミングと同じ形で返す）"""
+        yield self.response
+
+class StreamingPipelineResult:
+    """ストリーミング応答の結果（response_genを最後まで読むとtimingsにLLMの時間が入る）
+
+    cancel_eventを渡した場合、response_genを途中で閉じる（クライアントの切断など）と生成を中止する。
+    """
+
+    def __init__(self, chat_response, source_nodes, timer, llm_start_time, cancel_event=None, on_close=None,
+                 query_span=None, on_complete=None):
+        self._chat_response = chat_response
+        self._on_close = on_close
+        self._on_complete = on_complete
+        self._query_span = query_span
+        self._timer = timer
+        self._llm_start_time = llm_start_time
+        self._cancel_event = cancel_event
+        self.source_nodes = source_nodes
+        self.timings = timer.timings
+        self.response = ''
+        self.cached = False
+
+    @property
+    def response_gen(self):
+        first_token = True
+        # 閉じられたときに中止を伝えてから元のジェネレータを閉じるよう、参照を保持しておく
+        tokens = self._chat_response.response_gen
+        finished = False
+        try:
+            for token in tokens:
+                if first_token:
+                    first_token_seconds = time.perf_counter() - self._llm_start_time
+                    self._timer.add('first_token', first_token_seconds)
+                    record_span('first_token', first_token_seconds, parent=self._query_span)
+                    first_token = False
+                self.response += token
+                yield token
+            finished = True
+        finally:
+            if not finished and self._cancel_event is not None:
+                self._cancel_event.set()
+            tokens.close()
+            if self._on_close is not None:
+                self._on_close()
+            llm_seconds = time.perf_counter() - self._llm_start_time
+            self._timer.add('llm', llm_seconds)
+            if finished and self._on_complete is not None:
+                self._on_complete(self.response, llm_seconds)
+            if self._query_span is not None:
+                record_span('llm', llm_seconds, parent=self._query_span)
+                if not finished:
+                    self._query_span.set(cancelled=True)
+                self._query_span.end()
+
+class QueryPipeline:
+    """検索を1回だけ行い、取得したノードをそのままLLMに渡すクエリパイプライン
+
+    embed（クエリのエンベディング）→ search（ベクトル検索）→ postprocess → llm の
+    各段階の時間をtimingsとして返す。retrieverにはCachedRetrieverを渡す。
+    パイプライン自体は状態を持たないため、チャットメモリは呼び出し側が管理する。
+    answer_cache（AnswerCache）を渡すと、会話の最初の質問は検索後に回答キャッシュを参照し、
+    ヒットすればLLMを呼ばずに回答する（会話履歴に依存する質問はキャッシュしない）。
+    """
+
+    def __init__(self, retriever, llm, node_postprocessors=None, context_template=None,
+                 system_prompt=None, verbose=False, answer_cache=None):
+        self.retriever = retriever
+        self.llm = llm
+        self.answer_cache = answer_cache
+        self.node_postprocessors = node_postprocessors or []
+        self.context_template = context_template
+        self.system_prompt = system_prompt
+        self.verbose = verbose
+
+    def _filtered_retriever(self, filters):
+        """絞り込み条件を適用したRetrieverを返す関数（条件がなければそのまま）"""
+        if not filters:
+            return self.retriever
+        return self.retriever.with_filters(filters)
+
+    def retrieve(self, query_str, timer=None, filters=None):
+        """クエリに関連するノードを取得する関数
+
+        filters（normalize_filtersで正規化した絞り込み条件）を指定した場合は、一致するノードだけを検索する。
+        """
+        timer = timer or StageTimer()
+        retriever = self._filtered_retriever(filters)
+        with span('retrieve', filtered=bool(filters)) as retrieve_span:
+            embedding = timer.measure('embed', retriever.get_query_embedding, query_str)
+            query_bundle = QueryBundle(query_str=query_str, embedding=embedding)
+            nodes = timer.measure('search', retriever.retrieve, query_bundle)
+            for postprocessor in self.node_postprocessors:
+                nodes = timer.measure('postprocess', postprocessor.postprocess_nodes, nodes, query_bundle=query_bundle)
+            retrieve_span.set(nodes=len(nodes))
+        return nodes, timer
+
+    def retrieve_batch(self, query_strs):
+        """複数クエリのエンベディングと検索をまとめて行う関数
+
+        [(nodes, timer), ...] を返す。embedとsearchにはバッチ全体の時間をクエリ数で割った値を記録する。
+        """
+        if not query_strs:
+            return []
+        batch_timer = StageTimer()
+        with span('retrieve_batch', queries=len(query_strs)):
+            embeddings = batch_timer.measure('embed', self.retriever.get_query_embeddings, query_strs)
+            node_lists = batch_timer.measure('search', self.retriever.retrieve_batch, query_strs, embeddings)
+
+        results = []
+        for query_str, embedding, nodes in zip(query_strs, embeddings, node_lists):
+            timer = StageTimer()
+            for stage, seconds in batch_timer.timings.items():
+                timer.add(stage, seconds / len(query_strs))
+            query_bundle = QueryBundle(query_str=query_str, embedding=embedding)
+            for postprocessor in self.node_postprocessors:
+                nodes = timer.measure('postprocess', postprocessor.postprocess_nodes, nodes, query_bundle=query_bundle)
+            results.append((nodes, timer))
+        return results
+
+    def _reserve_llm(self, timer, cancel_event=None):
+        """LLMGatewayを通すLLMなら、リクエスト用のラッパーを作って実行枠を確保する関数
+
+        順番待ちの時間はqueueとして記録する。
+        """
+        if not hasattr(self.llm, 'for_request'):
+            return self.llm
+        llm = self.llm.for_request(cancel_event)
+        timer.measure('queue', llm.reserve)
+        return llm
+
+    def _trace_prompt(self, llm):
+        """チャットエンジンの呼び出しからLLMの生成開始まで（プロンプトの組み立て）をpromptとして記録する"""
+        if not hasattr(llm, 'on_generation_start'):
+            return
+        parent = current_span()
+        start_time = time.perf_counter()
+        llm.on_generation_start(
+            lambda: record_span('prompt', time.perf_counter() - start_time, parent=current_span() or parent)
+        )
+
+    def _create_chat_engine(self, nodes, memory, llm):
+        kwargs = {}
+        if self.context_template is not None:
+            kwargs['context_template'] = self.context_template
+        if self.system_prompt is not None:
+            kwargs['system_prompt'] = self.system_prompt
+        return ContextChatEngine.from_defaults(
+            retriever=PrefetchedRetriever(nodes),
+            llm=llm,
+            memory=memory,
+            verbose=self.verbose,
+            **kwargs
+        )
+
+    def generate(self, message, nodes, memory, timer=None):
+        """検索済みのノードを使ってLLMで回答を生成する関数"""
+        timer = timer or StageTimer()
+        llm = self._reserve_llm(timer)
+        try:
+            chat_engine = self._create_chat_engine(nodes, memory, llm)
+            self._trace_prompt(llm)
+            response = timer.measure('llm', chat_engine.chat, message)
+        finally:
+            # 確保した実行枠がLLMの呼び出しで使われずに終わった場合に返す
+            if llm is not self.llm:
+                llm.release_reservation()
+        return PipelineResult(response.response, nodes, timer.timings)
+
+    def _lookup_answer(self, message, nodes, memory, timer):
+        """回答キャッシュを参照する関数
+
+        キャッシュを使えない場合はNone、使える場合は (エンベディング, キャッシュした回答またはNone) を返す。
+        ヒットした場合は、LLMで回答した場合と同じく質問と回答をチャットメモリに追加する。
+        """
+        if self.answer_cache is None or memory.get_all():
+            return None
+        # クエリのエンベディングは検索時にキャッシュされているため、ここでは計算し直さない
+        embedding = self.retriever.get_query_embedding(message)
+        node_ids = [node.node.node_id for node in nodes]
+        answer = timer.measure('answer_cache', self.answer_cache.lookup, embedding, node_ids)
+        if answer is not None:
+            memory.put(ChatMessage(role=MessageRole.USER, content=message))
+            memory.put(ChatMessage(role=MessageRole.ASSISTANT, content=answer))
+        return embedding, answer
+
+    def _store_answer(self, message, embedding, nodes, answer, llm_seconds):
+        self.answer_cache.put(message, embedding, [node.node.node_id for node in nodes], answer, llm_seconds)
+
+    def chat(self, message, memory, filters=None):
+        """検索とLLMによる回答生成を行う関数"""
+        with span('query') as query_span:
+            nodes, timer = self.retrieve(message, filters=filters)
+            cached = self._lookup_answer(message, nodes, memory, timer)
+            if cached is not None and cached[1] is not None:
+                query_span.set(cached=True)
+                return PipelineResult(cached[1], nodes, timer.timings, cached=True)
+            result = self.generate(message, nodes, memory, timer)
+            if cached is not None:
+                self._store_answer(message, cached[0], nodes, result.response, timer.timings.get('llm', 0.0))
+            return result
+
+    def stream_chat(self, message, memory, cancel_event=None, filters=None):
+        """検索後、LLMの回答をストリーミングで生成する関数
+
+        cancel_event（threading.Event）をセットするか、response_genを途中で閉じると生成を中止する。
+        """
+        # ストリーミングの終了までを1つのスパンにするため、ここでは終了せずに結果に渡す
+        query_span = Span('query', current_span())
+        release = None
+        try:
+            with activate(query_span):
+                nodes, timer = self.retrieve(message, filters=filters)
+                cached = self._lookup_answer(message, nodes, memory, timer)
+                if cached is not None and cached[1] is not None:
+                    query_span.set(cached=True)
+                    query_span.end()
+                    return PipelineResult(cached[1], nodes, timer.timings, cached=True)
+                on_complete = None
+                if cached is not None:
+                    embedding = cached[0]
+                    on_complete = lambda answer, llm_seconds: self._store_answer(
+                        message, embedding, nodes, answer, llm_seconds
+                    )
+                llm = self._reserve_llm(timer, cancel_event)
+                # 確保した実行枠がLLMの呼び出しで使われずに終わった場合に返す
+                release = llm.release_reservation if llm is not self.llm else None
+                chat_engine = self._create_chat_engine(nodes, memory, llm)
+                self._trace_prompt(llm)
+                llm_start_time = time.perf_counter()
+                response = chat_engine.stream_chat(message)
+        except BaseException as e:
+            if release is not None:
+                release()
+            query_span.set(error=type(e).__name__)
+            query_span.end()
+            raise
+        return StreamingPipelineResult(
+            response, nodes, timer, llm_start_time, cancel_event, on_close=release, query_span=query_span,
+            on_complete=on_complete
+        )
@@ -0,0 +1,140 @@
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import MetadataMode, NodeWithScore
+from config import (
+    RERANKER_MODEL, RERANKER_TOP_N, RERANKER_BATCH_SIZE, RERANKER_MAX_LENGTH, RERANKER_TIME_BUDGET_MS,
+    RERANKER_MIN_SCORE, RERANKER_CACHE_SIZE, EMBED_DEVICE
+)
+from utils.query_cache import LRUCache, normalize_query
+from utils.tracing import span
+import hashlib
+import threading
+import time
+
+class CrossEncoderReranker(BaseNodePostprocessor):
+    """クロスエンコーダーで候補を採点し直し、上位top_n件に絞るノードポストプロセッサ
+
+    候補はbatch_size件ずつ検索順位の上位から採点し、time_budget秒を超えたら残りの採点を打ち切る。
+    1件あたりの採点時間を記録しておき、予算内に収まらない候補は採点の前に除く。
+    採点結果は（クエリ, ノードの内容）ごとにキャッシュする。
+    採点できた候補がtop_nに満たない場合は、採点できなかった候補を検索順位のまま後ろに加える。
+    """
+
+    top_n: int = RERANKER_TOP_N
+    batch_size: int = RERANKER_BATCH_SIZE
+    time_budget: float = RERANKER_TIME_BUDGET_MS / 1000
+    min_score: float = RERANKER_MIN_SCORE
+    _model: object = PrivateAttr()
+    _cache: LRUCache = PrivateAttr()
+    _seconds_per_pair: float = PrivateAttr(default=None)
+    _lock: threading.Lock = PrivateAttr()
+
+    def __init__(self, model, top_n=RERANKER_TOP_N, batch_size=RERANKER_BATCH_SIZE,
+                 time_budget=RERANKER_TIME_BUDGET_MS / 1000, min_score=RERANKER_MIN_SCORE,
+                 cache_size=RERANKER_CACHE_SIZE):
+        super().__init__(top_n=top_n, batch_size=batch_size, time_budget=time_budget, min_score=min_score)
+        self._model = model
+        self._cache = LRUCache(cache_size)
+        self._seconds_per_pair = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def class_name(cls):
+        return "CrossEncoderReranker"
+
+    @property
+    def cache(self):
+        return self._cache
+
+    def warmup(self):
+        """モデルを一度実行し、1件あたりの採点時間を測っておく関数"""
+        pairs = [("準備", "再ランキングモデルの準備です。")] * self.batch_size
+        # 初回の実行は遅いため、見積もりには2回目の時間を使う
+        self._model.predict(pairs[:1], batch_size=self.batch_size, show_progress_bar=False)
+        self._score(pairs)
+
+    def _score(self, pairs):
+        """(クエリ, テキスト) の組を採点する関数（0〜1のスコアのリストを返す）"""
+        start_time = time.perf_counter()
+        scores = self._model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+        seconds_per_pair = (time.perf_counter() - start_time) / len(pairs)
+        with self._lock:
+            # 負荷による揺らぎをならすため指数移動平均で更新する
+            if self._seconds_per_pair is None:
+                self._seconds_per_pair = seconds_per_pair
+            else:
+                self._seconds_per_pair = 0.8 * self._seconds_per_pair + 0.2 * seconds_per_pair
+        return [float(score) for score in scores]
+
+    def max_candidates(self):
+        """時間の予算内に採点できる候補数の見積もりを返す関数（見積もれない場合はNone）"""
+        with self._lock:
+            seconds_per_pair = self._seconds_per_pair
+        if self.time_budget <= 0 or not seconds_per_pair:
+            return None
+        return max(self.batch_size, int(self.time_budget / seconds_per_pair))
+
+    def _postprocess_nodes(self, nodes, query_bundle=None):
+        if query_bundle is None or not nodes:
+            return nodes[:self.top_n]
+
+        with span('rerank', candidates=len(nodes)) as rerank_span:
+            query_key = normalize_query(query_bundle.query_str)
+            scores = {}
+            pending = []
+            for i, node_with_score in enumerate(nodes):
+                key = hashlib.sha1(f"{query_key}\0{node_with_score.node.hash}".encode('utf-8')).hexdigest()
+                score = self._cache.get(key)
+                if score is None:
+                    pending.append((i, key))
+                else:
+                    scores[i] = score
+            cached = len(scores)
+
+            limit = self.max_candidates()
+            if limit is not None and len(pending) > limit:
+                pending = pending[:limit]
+
+            start_time = time.perf_counter()
+            for start in range(0, len(pending), self.batch_size):
+                if start and self.time_budget > 0 and time.perf_counter() - start_time >= self.time_budget:
+                    break
+                batch = pending[start:start + self.batch_size]
+                pairs = [
+                    (query_bundle.query_str, nodes[i].node.get_content(metadata_mode=MetadataMode.NONE))
+                    for i, _ in batch
+                ]
+                batch_start_time = time.perf_counter()
+                batch_scores = self._score(pairs)
+                # 1件あたりの採点時間をキャッシュの削減時間として記録する
+                elapsed = (time.perf_counter() - batch_start_time) / len(batch)
+                for (i, key), score in zip(batch, batch_scores):
+                    scores[i] = score
+                    self._cache.put(key, score, elapsed)
+
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+            results = [
+                NodeWithScore(node=nodes[i].node, score=score)
+                for i, score in ranked if score >= self.min_score
+            ][:self.top_n]
+            unscored = [nodes[i] for i in range(len(nodes)) if i not in scores]
+            if len(ranked) < self.top_n:
+                results.extend(unscored[:self.top_n - len(ranked)])
+            rerank_span.set(
+                scored=len(scores) - cached, cached=cached, skipped=len(unscored), returned=len(results)
+            )
+        return results
+
+def create_reranker(model_name=RERANKER_MODEL, top_n=RERANKER_TOP_N, time_budget=RERANKER_TIME_BUDGET_MS / 1000,
+                    device=EMBED_DEVICE):
+    """クロスエンコーダーの再ランキングを作成する関数（sentence-transformersがなければNone）"""
+    try:
+        from sentence_transformers import CrossEncoder
+    except ImportError:
+        print("sentence-transformersがインストールされていないため、再ランキングは使用しません")
+        return None
+    print(f"再ランキングモデルをロードしています: {model_name}")
+    model = CrossEncoder(model_name, max_length=RERANKER_MAX_LENGTH, device=device)
+    reranker = CrossEncoderReranker(model, top_n=top_n, time_budget=time_budget)
+    reranker.warmup()
+    return reranker
@@ -0,0 +1,76 @@
+from collections import OrderedDict
+import threading
+import time
+
+class SessionStore:
+    """セッションごとのオブジェクトをLRU + TTLで保持するスレッドセーフなストア
+
+    max_sessionsを超えた場合は最も長く使われていないセッションから破棄し、
+    ttl_secondsより長くアクセスのないセッションはアクセス時にまとめて破棄する。
+    """
+
+    def __init__(self, max_sessions=256, ttl_seconds=3600, clock=time.monotonic):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get_or_create(self, session_id, factory):
+        """セッションのオブジェクトを取得し、なければfactoryで作成する関数"""
+        with self._lock:
+            now = self._clock()
+            self._evict_expired(now)
+
+            if session_id in self._sessions:
+                value, _ = self._sessions.pop(session_id)
+            else:
+                value = factory()
+            self._sessions[session_id] = (value, now)
+
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+            return value
+
+    def get(self, session_id):
+        """セッションのオブジェクトを取得する関数（なければNone、取得したセッションは最後に使われたものになる）"""
+        with self._lock:
+            now = self._clock()
+            self._evict_expired(now)
+            if session_id not in self._sessions:
+                return None
+            value, _ = self._sessions.pop(session_id)
+            self._sessions[session_id] = (value, now)
+            return value
+
+    def pop(self, session_id):
+        """セッションを明示的に破棄する関数"""
+        with self._lock:
+            item = self._sessions.pop(session_id, None)
+            return item[0] if item else None
+
+    def clear(self):
+        """全セッションを破棄する関数"""
+        with self._lock:
+            self._sessions.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def __contains__(self, session_id):
+        with self._lock:
+            return session_id in self._sessions
+
+    def _evict_expired(self, now):
+        """TTLを過ぎたセッションを古い順に破棄する（ロック取得済みで呼ぶこと）"""
+        if self.ttl_seconds is None:
+            return
+        while self._sessions:
+            session_id, (_, last_access) = next(iter(self._sessions.items()))
+            if now - last_access <= self.ttl_seconds:
+                break
+            del self._sessions[session_id]
+            self.evictions += 1
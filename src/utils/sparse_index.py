@@ -0,0 +1,150 @@
+import os
+import re
+import unicodedata
+from collections import Counter
+import numpy as np
+
+SPARSE_INDEX_FILENAME = 'sparse_index.npz'
+
+# 英数字の語（型番の「-」「.」を含む）と、日本語の連続部分を取り出す
+WORD_PATTERN = re.compile(r'[a-z0-9]+(?:[.\-][a-z0-9]+)*|[\u3005\u3041-\u30ff\u3400-\u9fff\uf900-\ufaff]+')
+ASCII_WORD_PATTERN = re.compile(r'[a-z0-9]')
+
+def tokenize(text):
+    """BM25用にテキストをトークンに分割する関数
+
+    NFKC正規化（全角英数字・半角カナの統一）と小文字化の後、英数字は語単位、
+    日本語は文字bigram（1文字だけの場合はその文字）に分割する。
+    形態素解析器に依存せず、未知語の専門用語でも部分一致で検索できる。
+    """
+    text = unicodedata.normalize('NFKC', text).lower()
+    tokens = []
+    for word in WORD_PATTERN.findall(text):
+        if ASCII_WORD_PATTERN.match(word) or len(word) == 1:
+            tokens.append(word)
+        else:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+class SparseIndex:
+    """BM25で検索する転置インデックス
+
+    ポスティングリストはCSR形式のnumpy配列（語ごとの開始位置・文書番号・出現回数）で保持し、
+    検索時は質問に含まれる語のスライスだけをベクトル演算でスコアに加算する。
+    """
+
+    def __init__(self, vocabulary, indptr, postings, term_freqs, doc_lengths, node_ids, k1=1.2, b=0.75):
+        self.vocabulary = vocabulary
+        self.indptr = indptr
+        self.postings = postings
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.node_ids = node_ids
+        self.k1 = k1
+        self.b = b
+        num_docs = len(node_ids)
+        doc_freqs = np.diff(indptr).astype(np.float32)
+        self.idf = np.log(1.0 + (num_docs - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+        avg_length = float(doc_lengths.mean()) if num_docs else 0.0
+        # 文書長による正規化項は検索ごとに変わらないため事前に計算しておく
+        self._length_norm = (k1 * (1.0 - b + b * doc_lengths / max(avg_length, 1e-9))).astype(np.float32)
+
+    @classmethod
+    def build(cls, node_ids, texts, k1=1.2, b=0.75):
+        """ノードIDとテキストから転置インデックスを作成する関数"""
+        vocabulary = {}
+        term_ids = []
+        doc_indices = []
+        counts = []
+        doc_lengths = np.zeros(len(node_ids), dtype=np.float32)
+        for doc_index, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths[doc_index] = len(tokens)
+            for token, count in Counter(tokens).items():
+                term_ids.append(vocabulary.setdefault(token, len(vocabulary)))
+                doc_indices.append(doc_index)
+                counts.append(count)
+
+        term_ids = np.asarray(term_ids, dtype=np.int32)
+        # 語ID順に並べ替えてCSR形式にする（同じ語の中では文書番号順を保つ）
+        order = np.argsort(term_ids, kind='stable')
+        indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(vocabulary)), out=indptr[1:])
+        return cls(
+            vocabulary,
+            indptr,
+            np.asarray(doc_indices, dtype=np.int32)[order],
+            np.asarray(counts, dtype=np.float32)[order],
+            doc_lengths,
+            list(node_ids),
+            k1=k1,
+            b=b,
+        )
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def search(self, query_str, top_k, allowed=None):
+        """BM25スコアの上位top_k件を [(ノードID, スコア), ...] で返す関数
+
+        allowed（文書番号ごとのbool配列）を指定した場合は、Trueの文書だけをスコアの計算対象にする。
+        """
+        term_ids = [self.vocabulary[token] for token in set(tokenize(query_str)) if token in self.vocabulary]
+        if not term_ids or top_k <= 0:
+            return []
+
+        scores = np.zeros(len(self.node_ids), dtype=np.float32)
+        for term_id in term_ids:
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            docs = self.postings[start:end]
+            tf = self.term_freqs[start:end]
+            if allowed is not None:
+                keep = allowed[docs]
+                docs = docs[keep]
+                tf = tf[keep]
+            # 各語の文書は重複しないため、ファンシーインデックスでそのまま加算できる
+            scores[docs] += self.idf[term_id] * tf * (self.k1 + 1.0) / (tf + self._length_norm[docs])
+
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return [(self.node_ids[i], float(scores[i])) for i in candidates]
+
+    def save(self, persist_dir):
+        """インデックスディレクトリに保存する関数（一時ファイル経由で置き換え）"""
+        path = os.path.join(persist_dir, SPARSE_INDEX_FILENAME)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                vocabulary=np.array(list(self.vocabulary), dtype=str),
+                indptr=self.indptr,
+                postings=self.postings,
+                term_freqs=self.term_freqs,
+                doc_lengths=self.doc_lengths,
+                node_ids=np.array(self.node_ids, dtype=str),
+                params=np.array([self.k1, self.b], dtype=np.float64),
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, persist_dir):
+        """保存済みの転置インデックスを読み込む関数"""
+        with np.load(os.path.join(persist_dir, SPARSE_INDEX_FILENAME)) as data:
+            vocabulary = {term: i for i, term in enumerate(data['vocabulary'].tolist())}
+            k1, b = data['params'].tolist()
+            return cls(
+                vocabulary,
+                data['indptr'],
+                data['postings'],
+                data['term_freqs'],
+                data['doc_lengths'],
+                data['node_ids'].tolist(),
+                k1=k1,
+                b=b,
+            )
+
+def sparse_index_exists(persist_dir):
+    """転置インデックスが保存済みか確認する関数"""
+    return os.path.exists(os.path.join(persist_dir, SPARSE_INDEX_FILENAME))
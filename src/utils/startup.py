@@ -0,0 +1,75 @@
+from contextlib import contextmanager
+from config import INDEX_DIR
+from utils.manifest import load_manifest, current_index_dir
+from utils.tracing import span
+import time
+
+# このモジュールを読み込んだ時刻をプロセスの起動時刻とみなす（エントリポイントの先頭で読み込む）
+PROCESS_START_TIME = time.perf_counter()
+
+STAGE_LABELS = {
+    'import': 'モジュールの読み込み',
+    'embed_model': 'エンベディングモデル',
+    'index': 'インデックス',
+    'pipeline': 'LLM・検索の準備',
+    'daemon': 'デーモンへの接続',
+}
+
+class StartupReport:
+    """起動時の段階（モジュールの読み込み・モデルのロード・インデックスのロード）ごとの時間を記録するクラス
+
+    重いモジュール（llama_index・faiss・torchなど）は必要になった時点で読み込むため、
+    読み込みの時間はstage('import')で囲んで計測する。各段階はstartup_<段階>のスパンとしても記録される。
+    """
+
+    def __init__(self, start_time=PROCESS_START_TIME):
+        self.start_time = start_time
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        start_time = time.perf_counter()
+        try:
+            with span(f'startup_{name}'):
+                yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start_time
+
+    def summary(self):
+        """起動時間の内訳を表示用の文字列にする関数（計測していない時間は「その他」）"""
+        total = time.perf_counter() - self.start_time
+        parts = [f"{STAGE_LABELS.get(name, name)} {seconds:.2f}秒" for name, seconds in self.timings.items()]
+        other = total - sum(self.timings.values())
+        if other >= 0.005:
+            parts.append(f"その他 {other:.2f}秒")
+        return f"起動時間: {total:.2f}秒（{', '.join(parts)}）"
+
+def load_persisted_index(index_dir=INDEX_DIR, report=None):
+    """保存済みのインデックスをロードする関数（なければNone）
+
+    main.pyはマニフェストを最後に保存するため、マニフェストがなければ
+    エンベディングモデルやllama_indexを読み込む前に終了する。
+    バージョンごとのディレクトリに保存されている場合は、公開中のバージョンをロードする。
+    検索用の索引も同じバージョンから読み込むため、呼び出し側でcurrent_index_dirを一度だけ解決して渡す。
+    """
+    report = report or StartupReport()
+    persist_dir = current_index_dir(index_dir)
+    if load_manifest(persist_dir) is None:
+        print(f"エラー: インデックス '{index_dir}' が見つかりません。")
+        print("先にmain.pyを実行してインデックスを作成してください。")
+        return None
+
+    try:
+        with report.stage('import'):
+            from llama_index.core import load_index_from_storage
+            from utils.vector_store import load_storage_context
+            from utils.embed_model import create_embed_model
+        with report.stage('index'):
+            storage_context = load_storage_context(persist_dir, read_only=True)
+        with report.stage('embed_model'):
+            embed_model = create_embed_model()
+        with report.stage('index'):
+            return load_index_from_storage(storage_context, embed_model=embed_model)
+    except Exception as e:
+        print(f"インデックスのロード中にエラーが発生しました: {e}")
+        return None
@@ -0,0 +1,285 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from config import TRACE_LOG
+import json
+import sys
+import threading
+import time
+import uuid
+
+# 処理段階の時間のヒストグラムの境界（秒）。エンベディング1回の数msからLLMの数十秒までを含める
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKENS_PER_SECOND_BUCKETS = (1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 50.0, 100.0, 200.0)
+
+class MetricsRegistry:
+    """カウンターとヒストグラムを保持し、Prometheusのテキスト形式で出力するクラス
+
+    値はプロセスごとに保持する（gunicornのワーカーごとに別の値になる）。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metadata = {}
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+
+    def _describe(self, name, metric_type, help_text):
+        if name not in self._metadata:
+            self._metadata[name] = (metric_type, help_text)
+
+    def inc(self, name, value=1.0, help_text='', **labels):
+        """カウンターを増やす関数"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._describe(name, 'counter', help_text)
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name, value, buckets=DURATION_BUCKETS, help_text='', **labels):
+        """ヒストグラムに値を記録する関数"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._describe(name, 'histogram', help_text)
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = {'buckets': buckets, 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            histogram = series[key]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram['counts'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def add_collector(self, collector):
+        """出力時に呼ばれ、[(名前, 種類, 説明, ラベル, 値), ...] を返す関数を登録する（待ち行列の長さなど）"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def clear(self):
+        """記録した値を破棄する関数（登録したcollectorは残す）"""
+        with self._lock:
+            self._metadata.clear()
+            self._counters.clear()
+            self._histograms.clear()
+
+    def get(self, name, **labels):
+        """カウンターの値、またはヒストグラムの件数を返す関数（テスト・表示用）"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            if name in self._counters:
+                return self._counters[name].get(key, 0.0)
+            if name in self._histograms and key in self._histograms[name]:
+                return self._histograms[name][key]['count']
+            return 0
+
+    def render(self):
+        """Prometheusのテキスト形式（version 0.0.4）の文字列を返す関数"""
+        with self._lock:
+            metadata = dict(self._metadata)
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {
+                name: {key: dict(value, counts=list(value['counts'])) for key, value in series.items()}
+                for name, series in self._histograms.items()
+            }
+            collectors = list(self._collectors)
+
+        lines = []
+        for name in sorted(counters):
+            lines.extend(_header(name, *metadata[name]))
+            for key, value in sorted(counters[name].items()):
+                lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+        for name in sorted(histograms):
+            lines.extend(_header(name, *metadata[name]))
+            for key, histogram in sorted(histograms[name].items()):
+                for bound, count in zip(histogram['buckets'], histogram['counts']):
+                    lines.append(f"{name}_bucket{_format_labels(key + (('le', _format_value(bound)),))} {count}")
+                lines.append(f"{name}_bucket{_format_labels(key + (('le', '+Inf'),))} {histogram['count']}")
+                lines.append(f"{name}_sum{_format_labels(key)} {_format_value(histogram['sum'])}")
+                lines.append(f"{name}_count{_format_labels(key)} {histogram['count']}")
+
+        samples = {}
+        for collector in collectors:
+            for name, metric_type, help_text, labels, value in collector():
+                samples.setdefault((name, metric_type, help_text), []).append((tuple(sorted(labels.items())), value))
+        for (name, metric_type, help_text), values in sorted(samples.items()):
+            lines.extend(_header(name, metric_type, help_text))
+            for key, value in values:
+                lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+def _header(name, metric_type, help_text):
+    lines = [f"# HELP {name} {help_text}"] if help_text else []
+    lines.append(f"# TYPE {name} {metric_type}")
+    return lines
+
+def _format_labels(key):
+    if not key:
+        return ''
+    escaped = (
+        (label, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for label, value in key
+    )
+    return '{' + ','.join(f'{label}="{value}"' for label, value in escaped) + '}'
+
+def _format_value(value):
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+# プロセス全体で共有するメトリクス
+metrics = MetricsRegistry()
+
+class TraceLog:
+    """終了したスパンを1行1件のJSONで書き出すクラス（target: stderr / stdout / ファイルパス）"""
+
+    def __init__(self, target):
+        self._lock = threading.Lock()
+        if target == 'stderr':
+            self._file, self._owned = sys.stderr, False
+        elif target == 'stdout':
+            self._file, self._owned = sys.stdout, False
+        else:
+            self._file, self._owned = open(target, 'a', encoding='utf-8', buffering=1), True
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        if self._owned:
+            self._file.close()
+
+_trace_log = TraceLog(TRACE_LOG) if TRACE_LOG else None
+
+def configure_trace_log(target):
+    """スパンのJSONログの出力先を設定する関数（空ならJSONログを出力しない）"""
+    global _trace_log
+    if _trace_log is not None:
+        _trace_log.close()
+    _trace_log = TraceLog(target) if target else None
+
+_current_span = ContextVar('current_span', default=None)
+
+class Span:
+    """1つの処理段階の実行時間と属性（件数・トークン数など）"""
+
+    def __init__(self, name, parent=None, **attributes):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:8]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = attributes
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.seconds = None
+
+    def set(self, **attributes):
+        """スパンに属性を追加する関数"""
+        self.attributes.update(attributes)
+
+    def end(self, seconds=None):
+        """スパンを終了してメトリクスとJSONログに記録する関数"""
+        if self.seconds is not None:
+            return
+        self.seconds = time.perf_counter() - self._start if seconds is None else seconds
+        metrics.observe(
+            'rag_stage_duration_seconds', self.seconds, help_text='処理段階ごとの実行時間（秒）', stage=self.name
+        )
+        if 'error' in self.attributes:
+            metrics.inc('rag_stage_errors_total', help_text='エラーで終わった処理段階の数', stage=self.name)
+        if _trace_log is not None:
+            _trace_log.write({
+                'timestamp': self.start_time,
+                'trace_id': self.trace_id,
+                'span_id': self.span_id,
+                'parent_id': self.parent_id,
+                'span': self.name,
+                'duration_ms': round(self.seconds * 1000, 3),
+                **self.attributes,
+            })
+
+def current_span():
+    """実行中のスパンを返す関数（別スレッドで続ける処理の親にする）"""
+    return _current_span.get()
+
+@contextmanager
+def span(name, parent=None, **attributes):
+    """処理段階をスパンとして計測するコンテキストマネージャ
+
+    parentを省略した場合は同じスレッド（コンテキスト）で実行中のスパンを親にする。
+    """
+    current = Span(name, parent if parent is not None else _current_span.get(), **attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set(error=type(e).__name__)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+@contextmanager
+def activate(current):
+    """終了していないスパンを実行中のスパンにするコンテキストマネージャ（抜けてもスパンは終了しない）"""
+    token = _current_span.set(current)
+    try:
+        yield current
+    finally:
+        _current_span.reset(token)
+
+def record_span(name, seconds, parent=None, **attributes):
+    """計測済みの時間をスパンとして記録する関数"""
+    Span(name, parent if parent is not None else _current_span.get(), **attributes).end(seconds)
+
+def _raw_value(raw, key):
+    try:
+        return raw[key]
+    except (KeyError, TypeError, IndexError):
+        return None
+
+def llm_usage(raw):
+    """Ollamaの応答からトークン数と生成速度を取り出す関数（取得できない項目は含めない）"""
+    if raw is None:
+        return {}
+    usage = {}
+    prompt_tokens = _raw_value(raw, 'prompt_eval_count')
+    completion_tokens = _raw_value(raw, 'eval_count')
+    eval_duration = _raw_value(raw, 'eval_duration')
+    if prompt_tokens is not None:
+        usage['prompt_tokens'] = prompt_tokens
+    if completion_tokens is not None:
+        usage['completion_tokens'] = completion_tokens
+        # eval_durationはナノ秒（プロンプトの処理時間を含まない生成のみの時間）
+        if eval_duration:
+            usage['eval_seconds'] = round(eval_duration / 1e9, 4)
+            usage['tokens_per_second'] = round(completion_tokens / (eval_duration / 1e9), 2)
+    return usage
+
+def record_llm_usage(usage):
+    """LLMのトークン数と生成速度をメトリクスに加える関数"""
+    if 'prompt_tokens' in usage:
+        metrics.inc('rag_llm_prompt_tokens_total', usage['prompt_tokens'], help_text='LLMに入力したトークン数')
+    if 'completion_tokens' in usage:
+        metrics.inc('rag_llm_completion_tokens_total', usage['completion_tokens'], help_text='LLMが生成したトークン数')
+    if 'eval_seconds' in usage:
+        metrics.inc('rag_llm_eval_seconds_total', usage['eval_seconds'], help_text='LLMがトークンの生成にかけた時間（秒）')
+        metrics.observe(
+            'rag_llm_tokens_per_second', usage['tokens_per_second'], buckets=TOKENS_PER_SECOND_BUCKETS,
+            help_text='1回の生成のトークン生成速度（トークン/秒）'
+        )
+
+def format_timings(timings):
+    """処理段階ごとの時間を表示用の文字列にする関数"""
+    return ", ".join(f"{stage}: {seconds:.2f}秒" for stage, seconds in timings.items())
+
+def print_cache_stats(query_cache):
+    """キャッシュの統計情報を表示する関数（stats()がキャッシュ名ごとの統計を返すオブジェクトを受け取る）"""
+    for name, stats in query_cache.stats().items():
+        print(
+            f"  {name}: ヒット {stats['hits']}件 / ミス {stats['misses']}件"
+            f" (ヒット率 {stats['hit_rate']:.1%}, 削減時間 {stats['saved_seconds']:.2f}秒)"
+        )
@@ -0,0 +1,509 @@
+from llama_index.core import StorageContext
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from llama_index.core.vector_stores.types import VectorStoreQueryResult
+from llama_index.vector_stores.faiss import FaissVectorStore, FaissMapVectorStore
+from config import (
+    VECTOR_INDEX_TYPE, EMBED_DIM, IVF_NLIST, IVF_NPROBE, HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH, VECTOR_MMAP,
+    VECTOR_QUANTIZATION, PQ_M, RERANK_FACTOR
+)
+from utils.blob_store import BlobDocumentStore, blob_store_exists, LEGACY_DOCSTORE_FILENAME
+import faiss
+import json
+import numpy as np
+import os
+
+VECTOR_STORE_FILENAME = 'default__vector_store.json'
+ID_MAP_FILENAME = 'id_map.npz'
+LEGACY_ID_MAP_FILENAME = 'id_map.json'
+EXACT_VECTORS_FILENAME = 'vectors.f32'
+INDEX_TYPES = ('flat', 'ivf', 'hnsw')
+QUANTIZATION_TYPES = ('none', 'int8', 'pq')
+
+# IVFの学習に必要なクラスタあたりのベクトル数の目安（FAISS推奨値）
+MIN_POINTS_PER_CENTROID = 39
+# PQの各サブ量子化器のビット数（256個のセントロイド）
+PQ_NBITS = 8
+
+class ExactVectorFile:
+    """量子化前のfloat32ベクトルをFAISS IDを行番号として保存するファイル（再スコアリング用）
+
+    ファイルはmmapで参照し、再スコアリングの候補になった行だけを読み込む。
+    追加したベクトルはpersist()までメモリ上に保持する。
+    """
+
+    def __init__(self, dim, path=None):
+        self.dim = dim
+        self._path = path
+        self._vectors = None
+        self._pending = {}  # FAISS ID -> ベクトル
+        if path is not None and os.path.exists(path):
+            self._open(path)
+
+    def _open(self, path):
+        self._path = path
+        num_rows = os.path.getsize(path) // (4 * self.dim)
+        self._vectors = np.memmap(path, dtype='float32', mode='r', shape=(num_rows, self.dim)) if num_rows else None
+
+    @property
+    def num_rows(self):
+        return len(self._vectors) if self._vectors is not None else 0
+
+    def add(self, faiss_ids, vectors):
+        for faiss_id, vector in zip(faiss_ids.tolist(), vectors):
+            self._pending[faiss_id] = vector
+
+    def remove(self, faiss_ids):
+        for faiss_id in faiss_ids:
+            self._pending.pop(faiss_id, None)
+
+    def get(self, faiss_ids):
+        """FAISS IDのベクトルを (件数, dim) の配列で返す関数"""
+        faiss_ids = np.asarray(faiss_ids, dtype=np.int64)
+        if len(faiss_ids) == 0:
+            return np.empty((0, self.dim), dtype='float32')
+        if not self._pending:
+            return np.asarray(self._vectors[faiss_ids])
+        vectors = np.empty((len(faiss_ids), self.dim), dtype='float32')
+        for i, faiss_id in enumerate(faiss_ids.tolist()):
+            pending = self._pending.get(faiss_id)
+            vectors[i] = pending if pending is not None else self._vectors[faiss_id]
+        return vectors
+
+    def persist(self, path):
+        """ベクトルをファイルに保存する関数
+
+        同じファイルへの差分更新で、追加されたIDがすべて既存の行より後ろにある場合は追記する
+        （読み込み中のプロセスが参照している行は変わらない）。それ以外は一時ファイル経由で書き直す。
+        """
+        append = (
+            self._path is not None and os.path.abspath(self._path) == os.path.abspath(path)
+            and os.path.exists(path) and min(self._pending, default=self.num_rows) >= self.num_rows
+        )
+        if append:
+            with open(path, 'r+b') as f:
+                for faiss_id in sorted(self._pending):
+                    f.seek(faiss_id * 4 * self.dim)
+                    f.write(np.asarray(self._pending[faiss_id], dtype='float32').tobytes())
+        else:
+            num_rows = max(self.num_rows, max(self._pending, default=-1) + 1)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.truncate(num_rows * 4 * self.dim)
+            if num_rows:
+                vectors = np.memmap(tmp_path, dtype='float32', mode='r+', shape=(num_rows, self.dim))
+                if self._vectors is not None:
+                    vectors[:self.num_rows] = self._vectors
+                for faiss_id, vector in self._pending.items():
+                    vectors[faiss_id] = vector
+                vectors.flush()
+                del vectors
+            os.replace(tmp_path, path)
+        self._pending = {}
+        self._open(path)
+
+class IdMapFaissVectorStore(FaissMapVectorStore):
+    """ノードIDとFAISS IDを対応付けたベクトルストア
+
+    FaissMapVectorStoreは新しいIDにntotalを使うため、削除後に追加すると
+    既存のIDと衝突する。ここでは最大ID + 1を割り当て、まとめて追加する。
+    IVFは自身でIDを保持して削除できるため、IndexIDMap2で包まずに受け付ける
+    （IndexIDMap2.remove_idsは内部IDが詰められるFlat以外では対応がずれる）。
+
+    量子化したインデックスでは、exact_vectors（元のfloat32ベクトル）があれば
+    上位 top_k × rerank_factor 件の候補を元のベクトルとの内積で再スコアリングする。
+    """
+
+    def __init__(self, faiss_index, exact_vectors=None, rerank_factor=RERANK_FACTOR):
+        FaissVectorStore.__init__(self, faiss_index=faiss_index)
+        self._node_id_to_faiss_id_map = {}
+        self._faiss_id_to_node_id_map = {}
+        self._exact_vectors = exact_vectors
+        self._rerank_factor = rerank_factor
+
+    def add(self, nodes, **add_kwargs):
+        if not nodes:
+            return []
+        next_id = max(self._faiss_id_to_node_id_map, default=-1) + 1
+        faiss_ids = np.arange(next_id, next_id + len(nodes), dtype=np.int64)
+        vectors = np.array([node.get_embedding() for node in nodes], dtype='float32')
+        self._faiss_index.add_with_ids(vectors, faiss_ids)
+        if self._exact_vectors is not None:
+            self._exact_vectors.add(faiss_ids, vectors)
+
+        new_ids = []
+        for node, faiss_id in zip(nodes, faiss_ids.tolist()):
+            self._node_id_to_faiss_id_map[node.id_] = faiss_id
+            self._faiss_id_to_node_id_map[faiss_id] = node.id_
+            new_ids.append(node.id_)
+        return new_ids
+
+    def delete_nodes(self, node_ids=None, filters=None, **delete_kwargs):
+        if self._exact_vectors is not None and node_ids is not None:
+            self._exact_vectors.remove([
+                self._node_id_to_faiss_id_map[node_id] for node_id in node_ids
+                if node_id in self._node_id_to_faiss_id_map
+            ])
+        super().delete_nodes(node_ids, filters=filters, **delete_kwargs)
+
+    def faiss_ids(self, node_ids):
+        """ノードIDに対応するFAISS IDのリストを返す関数（ベクトルがないノードは-1）"""
+        return [self._node_id_to_faiss_id_map.get(node_id, -1) for node_id in node_ids]
+
+    def search(self, query_vectors, similarity_top_k, selection=None):
+        """FAISSで検索し、(スコア, FAISS ID) の配列を返す関数（必要に応じて再スコアリング）
+
+        selectionは (FAISS IDのビットマップ, 対象のベクトル数)。指定した場合は対象のベクトルだけを検索する。
+        """
+        if self._exact_vectors is None or self._rerank_factor <= 0:
+            return faiss_search(self._faiss_index, query_vectors, similarity_top_k, selection)
+
+        _, candidate_ids = faiss_search(
+            self._faiss_index, query_vectors, similarity_top_k * self._rerank_factor, selection
+        )
+        scores = np.full((len(query_vectors), similarity_top_k), -np.inf, dtype='float32')
+        faiss_ids = np.full((len(query_vectors), similarity_top_k), -1, dtype=np.int64)
+        for row, (query_vector, row_ids) in enumerate(zip(query_vectors, candidate_ids)):
+            row_ids = row_ids[row_ids >= 0]
+            exact_scores = self._exact_vectors.get(row_ids) @ query_vector
+            order = np.argsort(-exact_scores, kind='stable')[:similarity_top_k]
+            scores[row, :len(order)] = exact_scores[order]
+            faiss_ids[row, :len(order)] = row_ids[order]
+        return scores, faiss_ids
+
+    def query(self, query, **kwargs):
+        if query.filters is not None:
+            raise ValueError("Metadata filters not implemented for Faiss yet.")
+        query_vector = np.array(query.query_embedding, dtype='float32')[np.newaxis, :]
+        scores, faiss_ids = self.search(query_vector, query.similarity_top_k)
+        similarities = []
+        ids = []
+        for score, faiss_id in zip(scores[0].tolist(), faiss_ids[0].tolist()):
+            # 件数が足りない場合、FAISSは-1を返す
+            if faiss_id >= 0 and faiss_id in self._faiss_id_to_node_id_map:
+                similarities.append(score)
+                ids.append(self._faiss_id_to_node_id_map[faiss_id])
+        return VectorStoreQueryResult(similarities=similarities, ids=ids)
+
+    def persist(self, persist_path, fs=None):
+        """FAISSインデックスとIDの対応表を保存する関数
+
+        mmapで読み込み中のプロセスがあっても壊れないよう、一時ファイルに書いてから置き換える。
+        IDの対応表はJSONではなく配列（npz）で保存する。
+        再スコアリング用のベクトルはインデックスより先に書き、新しいIDの行が必ず存在するようにする。
+        """
+        persist_dir = os.path.dirname(persist_path)
+        os.makedirs(persist_dir, exist_ok=True)
+        self._persist_exact_vectors(persist_dir)
+        faiss.write_index(self._faiss_index, persist_path + '.tmp')
+        os.replace(persist_path + '.tmp', persist_path)
+
+        id_map_path = os.path.join(persist_dir, ID_MAP_FILENAME)
+        faiss_ids = sorted(self._faiss_id_to_node_id_map)
+        with open(id_map_path + '.tmp', 'wb') as f:
+            np.savez(
+                f,
+                faiss_ids=np.array(faiss_ids, dtype=np.int64),
+                node_ids=np.array([self._faiss_id_to_node_id_map[i] for i in faiss_ids], dtype=str),
+            )
+        os.replace(id_map_path + '.tmp', id_map_path)
+
+        legacy_path = os.path.join(persist_dir, LEGACY_ID_MAP_FILENAME)
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+
+    def _persist_exact_vectors(self, persist_dir):
+        exact_path = os.path.join(persist_dir, EXACT_VECTORS_FILENAME)
+        if self._exact_vectors is not None:
+            self._exact_vectors.persist(exact_path)
+        elif os.path.exists(exact_path):
+            # 量子化せずに再構築した場合、古いIDのベクトルが残らないよう削除する
+            os.remove(exact_path)
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir, use_mmap=False):
+        """保存済みのベクトルストアを読み込む関数
+
+        use_mmapを指定するとベクトルをメモリに読み込まずmmapで参照する（読み取り専用）。
+        """
+        persist_path = os.path.join(persist_dir, VECTOR_STORE_FILENAME)
+        faiss_index = None
+        if use_mmap:
+            try:
+                faiss_index = faiss.read_index(persist_path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError:
+                # mmapに対応していない形式は通常どおり読み込む
+                faiss_index = None
+        if faiss_index is None:
+            faiss_index = faiss.read_index(persist_path)
+
+        exact_vectors = None
+        exact_path = os.path.join(persist_dir, EXACT_VECTORS_FILENAME)
+        if os.path.exists(exact_path):
+            exact_vectors = ExactVectorFile(faiss_index.d, exact_path)
+        vector_store = cls(faiss_index=faiss_index, exact_vectors=exact_vectors)
+        id_map_path = os.path.join(persist_dir, ID_MAP_FILENAME)
+        if os.path.exists(id_map_path):
+            with np.load(id_map_path) as data:
+                faiss_ids = data['faiss_ids'].tolist()
+                node_ids = data['node_ids'].tolist()
+        else:
+            # 旧形式（id_map.json）
+            with open(os.path.join(persist_dir, LEGACY_ID_MAP_FILENAME), 'r') as f:
+                id_map = json.load(f)['faiss_id_to_node_id_map']
+            faiss_ids = [int(faiss_id) for faiss_id in id_map]
+            node_ids = list(id_map.values())
+        vector_store._faiss_id_to_node_id_map = dict(zip(faiss_ids, node_ids))
+        vector_store._node_id_to_faiss_id_map = dict(zip(node_ids, faiss_ids))
+        return vector_store
+
+def pq_nbits(num_vectors=None):
+    """PQのサブ量子化器のビット数（学習ベクトルがセントロイド数より少ない場合は減らす）"""
+    if num_vectors is None or num_vectors >= 2 ** PQ_NBITS:
+        return PQ_NBITS
+    return max(1, int(np.log2(max(num_vectors, 2))))
+
+def create_faiss_index(index_type=VECTOR_INDEX_TYPE, dim=EMBED_DIM, num_vectors=None,
+                       quantization=VECTOR_QUANTIZATION):
+    """設定に応じたFAISSインデックス（内積 = 正規化済みベクトルのコサイン類似度）を作成する関数
+
+    quantizationがint8ならスカラー量子化（1次元1バイト）、pqなら直積量子化（1ベクトルPQ_Mバイト）で
+    ベクトルを圧縮して保持する。
+    """
+    if quantization not in QUANTIZATION_TYPES:
+        raise ValueError(
+            f"未対応のVECTOR_QUANTIZATIONです: {quantization}（{', '.join(QUANTIZATION_TYPES)}のいずれか）"
+        )
+    if quantization == 'pq' and dim % PQ_M != 0:
+        raise ValueError(f"PQ_M（{PQ_M}）はエンベディングの次元数（{dim}）を割り切れる値にしてください")
+    metric = faiss.METRIC_INNER_PRODUCT
+    int8 = faiss.ScalarQuantizer.QT_8bit
+    nbits = pq_nbits(num_vectors)
+
+    if index_type == 'flat':
+        if quantization == 'int8':
+            base_index = faiss.IndexScalarQuantizer(dim, int8, metric)
+        elif quantization == 'pq':
+            base_index = faiss.IndexPQ(dim, PQ_M, nbits, metric)
+        else:
+            base_index = faiss.IndexFlatIP(dim)
+    elif index_type == 'ivf':
+        nlist = IVF_NLIST
+        if num_vectors is not None:
+            # ベクトル数が少ない場合はクラスタ数を減らして学習可能にする
+            nlist = max(1, min(nlist, num_vectors // MIN_POINTS_PER_CENTROID))
+        quantizer = faiss.IndexFlatIP(dim)
+        if quantization == 'int8':
+            faiss_index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, int8, metric)
+        elif quantization == 'pq':
+            faiss_index = faiss.IndexIVFPQ(quantizer, dim, nlist, PQ_M, nbits, metric)
+        else:
+            faiss_index = faiss.IndexIVFFlat(quantizer, dim, nlist, metric)
+        set_search_params(faiss_index)
+        return faiss_index
+    elif index_type == 'hnsw':
+        if quantization == 'int8':
+            base_index = faiss.IndexHNSWSQ(dim, int8, HNSW_M, metric)
+        elif quantization == 'pq':
+            base_index = faiss.IndexHNSWPQ(dim, PQ_M, HNSW_M, nbits, metric)
+        else:
+            base_index = faiss.IndexHNSWFlat(dim, HNSW_M, metric)
+        base_index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    else:
+        raise ValueError(f"未対応のVECTOR_INDEX_TYPEです: {index_type}（{', '.join(INDEX_TYPES)}のいずれか）")
+
+    faiss_index = faiss.IndexIDMap2(base_index)
+    set_search_params(faiss_index)
+    return faiss_index
+
+def train_faiss_index(faiss_index, embeddings):
+    """IVFなど学習が必要なインデックスをエンベディングで学習する関数"""
+    if faiss_index.is_trained:
+        return
+    vectors = np.asarray(embeddings, dtype='float32')
+    print(f"FAISSインデックスを学習しています（ベクトル数: {len(vectors)}）...")
+    faiss_index.train(vectors)
+
+def set_search_params(faiss_index):
+    """検索時パラメータ（IVFのnprobe、HNSWのefSearch）を設定する関数"""
+    base_index = get_base_index(faiss_index)
+    if isinstance(base_index, faiss.IndexIVF):
+        base_index.nprobe = IVF_NPROBE
+    elif isinstance(base_index, faiss.IndexHNSW):
+        base_index.hnsw.efSearch = HNSW_EF_SEARCH
+
+def get_base_index(faiss_index):
+    """IndexIDMap2で包まれている場合は内側のインデックスを取り出す関数"""
+    faiss_index = faiss.downcast_index(faiss_index)
+    if isinstance(faiss_index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(faiss_index.index)
+    return faiss_index
+
+def faiss_search(faiss_index, query_vectors, similarity_top_k, selection=None):
+    """FAISSで検索する関数（selectionを指定した場合はビットマップに含まれるFAISS IDだけが対象）
+
+    IDSelectorで除かれたベクトルも探索の途中では辿られるため、IVFのnprobe・HNSWのefSearchは
+    対象の割合に反比例して増やし、絞り込んだときに件数が不足しないようにする。
+    """
+    if selection is None:
+        return faiss_index.search(query_vectors, similarity_top_k)
+    bitmap, num_selected = selection
+    if num_selected == 0:
+        shape = (len(query_vectors), similarity_top_k)
+        return np.full(shape, -np.inf, dtype='float32'), np.full(shape, -1, dtype=np.int64)
+
+    # selectorはbitmapを参照するだけなので、検索が終わるまで両方を保持しておく
+    selector = faiss.IDSelectorBitmap(len(bitmap) * 8, faiss.swig_ptr(bitmap))
+    fraction = min(1.0, num_selected / max(faiss_index.ntotal, 1))
+    base_index = get_base_index(faiss_index)
+    if isinstance(base_index, faiss.IndexIVF):
+        nprobe = min(base_index.nlist, int(np.ceil(base_index.nprobe / fraction)))
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=nprobe)
+    elif isinstance(base_index, faiss.IndexHNSW):
+        ef_search = max(similarity_top_k, int(np.ceil(base_index.hnsw.efSearch / fraction)))
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=min(ef_search, max(faiss_index.ntotal, 1)))
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    return faiss_index.search(query_vectors, similarity_top_k, params=params)
+
+def supports_delete(index_type=VECTOR_INDEX_TYPE):
+    """インデックスタイプがベクトルの削除に対応しているか（HNSWは非対応）"""
+    return index_type != 'hnsw'
+
+def create_vector_store(index_type=VECTOR_INDEX_TYPE, embeddings=None, quantization=VECTOR_QUANTIZATION,
+                        rerank_factor=RERANK_FACTOR):
+    """新規インデックス作成用のFAISSベクトルストアを作成する関数
+
+    量子化する場合、rerank_factorが1以上なら再スコアリング用に元のベクトルもファイルに保存する。
+    """
+    num_vectors = len(embeddings) if embeddings is not None else None
+    faiss_index = create_faiss_index(index_type, num_vectors=num_vectors, quantization=quantization)
+    if embeddings is not None:
+        train_faiss_index(faiss_index, embeddings)
+    exact_vectors = None
+    if quantization != 'none' and rerank_factor > 0:
+        exact_vectors = ExactVectorFile(faiss_index.d)
+    return IdMapFaissVectorStore(faiss_index=faiss_index, exact_vectors=exact_vectors, rerank_factor=rerank_factor)
+
+def vector_store_exists(persist_dir):
+    """FAISSベクトルストアが永続化済みか確認する関数"""
+    return any(
+        os.path.exists(os.path.join(persist_dir, filename))
+        for filename in (ID_MAP_FILENAME, LEGACY_ID_MAP_FILENAME)
+    )
+
+def load_vector_store(persist_dir, use_mmap=False):
+    """永続化済みのFAISSベクトルストアをロードする関数"""
+    if not vector_store_exists(persist_dir):
+        raise ValueError(
+            f"FAISSベクトルストアが見つかりません: {persist_dir}（main.py --full でインデックスを再作成してください）"
+        )
+    vector_store = IdMapFaissVectorStore.from_persist_dir(persist_dir, use_mmap=use_mmap)
+    set_search_params(vector_store.client)
+    return vector_store
+
+def docstore_exists(persist_dir):
+    """docstoreが保存済みか確認する関数（旧形式のdocstore.jsonを含む）"""
+    return blob_store_exists(persist_dir) or os.path.exists(os.path.join(persist_dir, LEGACY_DOCSTORE_FILENAME))
+
+def load_docstore(persist_dir, read_only=False):
+    """docstoreをロードする関数（旧形式のdocstore.jsonは次回保存時にdocstore.binへ移行）"""
+    if blob_store_exists(persist_dir):
+        return BlobDocumentStore.from_persist_dir(persist_dir)
+    docstore = SimpleDocumentStore.from_persist_dir(persist_dir)
+    if read_only:
+        return docstore
+    return BlobDocumentStore.from_simple_docstore(docstore)
+
+def load_storage_context(persist_dir, read_only=False):
+    """FAISSベクトルストアを含むStorageContextをロードする関数
+
+    read_onlyの場合（検索のみを行うCLI・Webアプリ）は、VECTOR_MMAPの設定に従いベクトルをmmapで参照する。
+    ノードのテキストとメタデータは検索結果として必要になったときにdocstore.binから読み込まれる。
+    """
+    vector_store = load_vector_store(persist_dir, use_mmap=read_only and VECTOR_MMAP)
+    return StorageContext.from_defaults(
+        docstore=load_docstore(persist_dir, read_only=read_only),
+        vector_store=vector_store,
+        persist_dir=persist_dir
+    )
+
+def search_vector_store(vector_store, query_embeddings, similarity_top_k, selection=None):
+    """複数クエリのエンベディングをまとめてFAISSで検索する関数
+
+    クエリごとに [(ノードID, スコア), ...] のリストを返す。
+    selection（FacetIndex.faiss_bitmapの戻り値）を指定した場合は対象のノードだけを検索する。
+    """
+    if len(query_embeddings) == 0:
+        return []
+    vectors = np.asarray(query_embeddings, dtype='float32')
+    if isinstance(vector_store, IdMapFaissVectorStore):
+        scores, faiss_ids = vector_store.search(vectors, similarity_top_k, selection)
+    else:
+        scores, faiss_ids = faiss_search(vector_store.client, vectors, similarity_top_k, selection)
+    id_map = vector_store._faiss_id_to_node_id_map
+    results = []
+    for row_scores, row_ids in zip(scores.tolist(), faiss_ids.tolist()):
+        # 件数が足りない場合、FAISSは-1を返す
+        results.append([
+            (id_map[faiss_id], score)
+            for score, faiss_id in zip(row_scores, row_ids)
+            if faiss_id >= 0 and faiss_id in id_map
+        ])
+    return results
+
+def faiss_index_bytes(faiss_index):
+    """FAISSインデックスをシリアライズしたときのバイト数（メモリ上のサイズの目安）"""
+    return faiss.serialize_index(faiss_index).nbytes
+
+def evaluate_quantization(vector_store, embeddings, node_ids, top_k=10, num_queries=200, seed=0):
+    """量子化したベクトルストアのrecall@kを、同じベクトルの厳密検索と比較して計算する関数
+
+    保存したチャンクからnum_queries件をクエリとして使い、クエリ自身を除いた上位top_k件で比較する。
+    再スコアリングなし（圧縮したコードのみ）と再スコアリングありの両方を返す。
+    """
+    vectors = np.asarray(embeddings, dtype='float32')
+    rng = np.random.default_rng(seed)
+    query_rows = rng.choice(len(vectors), size=min(num_queries, len(vectors)), replace=False)
+    queries = vectors[query_rows]
+
+    exact_index = faiss.IndexFlatIP(vectors.shape[1])
+    exact_index.add(vectors)
+    _, exact_rows = exact_index.search(queries, top_k + 1)
+    exact = [[node_ids[i] for i in rows if i >= 0] for rows in exact_rows.tolist()]
+
+    id_map = vector_store._faiss_id_to_node_id_map
+    _, compressed_ids = vector_store.client.search(queries, top_k + 1)
+    _, reranked_ids = vector_store.search(queries, top_k + 1)
+
+    def recall(result_ids):
+        hits = 0
+        total = 0
+        for query_row, expected, row_ids in zip(query_rows.tolist(), exact, result_ids.tolist()):
+            query_node_id = node_ids[query_row]
+            expected = [node_id for node_id in expected if node_id != query_node_id][:top_k]
+            found = [id_map.get(faiss_id) for faiss_id in row_ids if faiss_id >= 0]
+            found = [node_id for node_id in found if node_id != query_node_id][:top_k]
+            hits += len(set(expected) & set(found))
+            total += len(expected)
+        return hits / total if total else 1.0
+
+    return {
+        'top_k': top_k,
+        'num_queries': len(query_rows),
+        'compressed': recall(compressed_ids),
+        'reranked': recall(reranked_ids),
+    }
+
+def delete_documents(index, doc_ids):
+    """ドキュメントIDに対応するノードをベクトルストア・docstoreから削除する関数"""
+    node_ids = []
+    for doc_id in doc_ids:
+        ref_doc_info = index.docstore.get_ref_doc_info(doc_id)
+        if ref_doc_info is not None:
+            node_ids.extend(ref_doc_info.node_ids)
+    if node_ids:
+        # FaissMapVectorStore.delete()はノードIDしか扱わないため、ノード単位でまとめて削除する
+        index.vector_store.delete_nodes(node_ids)
+    for doc_id in doc_ids:
+        index.delete_ref_doc(doc_id, delete_from_docstore=True)
+    return len(node_ids)
@@ -1,57 +1,299 @@
-from flask import Flask, render_template, request, jsonify
-from llama_index.core import VectorStoreIndex, StorageContext, load_index_from_storage
-from llama_index.core.chat_engine import ContextChatEngine
-from llama_index.llms import Ollama
+from flask import Flask, Response, request, jsonify, stream_with_context, g
+from llama_index.core import load_index_from_storage
 from llama_index.core.memory import ChatMemoryBuffer
-from config import INDEX_DIR, LLM_MODEL
+from config import (
+    INDEX_DIR, LLM_MODEL, SESSION_MAX_COUNT, SESSION_TTL_SECONDS,
+    QUERY_EMBED_CACHE_SIZE, RETRIEVAL_CACHE_SIZE, WEB_HOST, WEB_PORT,
+    RERANKER_ENABLED, RERANKER_CANDIDATES, RERANKER_TOP_N, ANSWER_CACHE_ENABLED, INDEX_WATCH_INTERVAL
+)
+from utils.session_store import SessionStore
+from utils.embed_model import create_embed_model
+from utils.vector_store import load_storage_context
+from utils.manifest import get_index_version, current_index_dir
+from utils.query_cache import QueryCache
+from utils.hybrid_retriever import create_retriever
+from utils.query_pipeline import QueryPipeline
+from utils.reranker import create_reranker
+from utils.context_packer import create_context_packer
+from utils.llm_gateway import LLMOverloadedError
+from utils.tracing import metrics
+from utils.facet_index import normalize_filters
+from utils.answer_cache import create_answer_cache
+from utils.index_watcher import IndexWatcher
+import gc
+import json
 import os
+import threading
+import time
 
 app = Flask(__name__)
 
-# チャットエンジンのインスタンスを保持する辞書
-chat_engines = {}
+CONTEXT_PROMPT = (
+    "あなたは日本語で応答するアシスタントです。"
+    "以下の情報源を参考にして、ユーザーの質問に答えてください。"
+    "情報源に含まれない内容についてはわからないと正直に答えてください。"
+    "回答には参照した情報源の箇所を引用してください。"
+)
 
-def initialize_chat_engine():
-    """チャットエンジンを初期化する関数"""
+# プロセス全体で共有するリソース（インデックス・エンベディングモデル・LLM）
+shared_resources = None
+shared_resources_lock = threading.Lock()
+
+# 新しいバージョンのインデックスの公開を検知して差し替えるスレッド（ワーカーごとにstart_index_watcherで開始）
+index_watcher = None
+
+# セッションごとに保持するのは軽量なチャットメモリのみ
+chat_memories = SessionStore(max_sessions=SESSION_MAX_COUNT, ttl_seconds=SESSION_TTL_SECONDS)
+
+# 全セッションで共有するクエリのエンベディング・検索結果のキャッシュ
+query_cache = QueryCache(embedding_maxsize=QUERY_EMBED_CACHE_SIZE, retrieval_maxsize=RETRIEVAL_CACHE_SIZE)
+
+def collect_metrics():
+    """/metricsの出力時にLLMの待ち行列・セッション・キャッシュの現在値を返す関数"""
+    from llm_integration import get_llm_gateway
+    llm_stats = get_llm_gateway().stats()
+    samples = [
+        ('rag_llm_in_flight', 'gauge', '生成中のLLMリクエスト数', {}, llm_stats['in_flight']),
+        ('rag_llm_queued', 'gauge', '順番待ちのLLMリクエスト数', {}, llm_stats['queued']),
+        ('rag_llm_rejected_total', 'counter', '混雑のため断ったLLMリクエスト数', {}, llm_stats['rejected']),
+        ('rag_llm_timed_out_total', 'counter', '順番待ちがタイムアウトしたLLMリクエスト数', {}, llm_stats['timed_out']),
+        ('rag_sessions_active', 'gauge', '保持しているセッション数', {}, len(chat_memories)),
+    ]
+    caches = [('embedding', query_cache.embeddings), ('retrieval', query_cache.retrievals)]
+    reranker = (shared_resources or {}).get("reranker")
+    if reranker is not None:
+        caches.append(('rerank', reranker.cache))
+    answer_cache = (shared_resources or {}).get("answer_cache")
+    if answer_cache is not None:
+        caches.append(('answer', answer_cache))
+    for cache_name, cache in caches:
+        cache_stats = cache.stats()
+        samples.append(('rag_cache_hits_total', 'counter', 'キャッシュのヒット数', {'cache': cache_name}, cache_stats['hits']))
+        samples.append(('rag_cache_misses_total', 'counter', 'キャッシュのミス数', {'cache': cache_name}, cache_stats['misses']))
+    return samples
+
+metrics.add_collector(collect_metrics)
+
+def initialize_shared_resources(previous=None):
+    """インデックス・エンベディングモデル・LLMをロードする関数
+
+    previous（使用中の共有リソース）を渡した場合は、エンベディングモデルと再ランキングのモデルを再利用し、
+    公開中のバージョンのインデックスのみをロードする。
+    """
     try:
-        # インデックスのロード
+        # インデックスのロード（公開中のバージョンのディレクトリを1回だけ解決し、全てそこから読み込む）
         if not os.path.exists(INDEX_DIR):
             return {"error": f"インデックスディレクトリ '{INDEX_DIR}' が見つかりません。"}
-        
-        storage_context = StorageContext.from_defaults(persist_dir=INDEX_DIR)
-        index = load_index_from_storage(storage_context)
-        
+        index_dir = current_index_dir(INDEX_DIR)
+
+        embed_model = previous["embed_model"] if previous else create_embed_model()
+        storage_context = load_storage_context(index_dir, read_only=True)
+        index = load_index_from_storage(storage_context, embed_model=embed_model)
+
         # LLMの設定
         from llm_integration import get_ollama_llm
-        llm = get_ollama_llm()
-        
-        # チャットメモリの設定
-        memory = ChatMemoryBuffer.from_defaults(token_limit=4096)
-        
-        # コンテキストチャットエンジンの設定
-        chat_engine = ContextChatEngine.from_defaults(
-            index=index,
+        llm = get_ollama_llm(model_name=LLM_MODEL)
+        if llm is None:
+            return {"error": "LLMの初期化に失敗しました。"}
+
+        # 再ランキングする場合は候補を多めに検索し、採点し直した上位だけをLLMに渡す
+        if previous:
+            reranker = previous["reranker"]
+        else:
+            reranker = create_reranker(top_n=RERANKER_TOP_N) if RERANKER_ENABLED else None
+        index_version = get_index_version(index_dir)
+        retriever = create_retriever(
+            index,
+            query_cache,
+            index_version=index_version,
+            similarity_top_k=RERANKER_CANDIDATES if reranker is not None else 3,
+            embed_model=embed_model,
+            persist_dir=index_dir
+        )
+        # 同じインデックスに対する言い換えの質問は、LLMを呼ばずにキャッシュした回答を返す
+        answer_cache = create_answer_cache(index_version) if ANSWER_CACHE_ENABLED else None
+        # 検索は1回だけ行い、取得したノードをそのままLLMに渡す
+        pipeline = QueryPipeline(
+            retriever=retriever,
             llm=llm,
-            memory=memory,
-            context_prompt=(
-                "あなたは日本語で応答するアシスタントです。"
-                "以下の情報源を参考にして、ユーザーの質問に答えてください。"
-                "情報源に含まれない内容についてはわからないと正直に答えてください。"
-                "回答には参照した情報源の箇所を引用してください。"
-            ),
-            citation_query_kwargs={"similarity_top_k": 3},
-            verbose=True
+            node_postprocessors=([reranker] if reranker is not None else []) + [create_context_packer()],
+            system_prompt=CONTEXT_PROMPT,
+            verbose=True,
+            answer_cache=answer_cache
         )
-        
-        return {"chat_engine": chat_engine}
-    
+        return {
+            "index": index,
+            "embed_model": embed_model,
+            "retriever": retriever,
+            "llm": llm,
+            "pipeline": pipeline,
+            "reranker": reranker,
+            "answer_cache": answer_cache,
+            "index_version": index_version,
+            # 使用中のリクエスト数と、差し替え済みかどうか（使用中のリクエストがなくなったらファイルを閉じる）
+            "active_requests": 0,
+            "retired": False,
+        }
+
     except Exception as e:
         return {"error": f"チャットエンジンの初期化中にエラーが発生しました: {str(e)}"}
 
+def get_shared_resources():
+    """共有リソースを取得する関数（初回のみロードし、失敗時は次回再試行する）"""
+    global shared_resources
+    with shared_resources_lock:
+        if shared_resources is None:
+            result = initialize_shared_resources()
+            if "error" in result:
+                return result
+            shared_resources = result
+        return shared_resources
+
+def acquire_shared_resources():
+    """共有リソースを取得し、使用中のリクエスト数を増やす関数（使い終わったらrelease_shared_resourcesを呼ぶ）"""
+    resources = get_shared_resources()
+    if "error" in resources:
+        return resources
+    with shared_resources_lock:
+        # 取得した直後に差し替えられた場合は新しいリソースを使う
+        resources = shared_resources or resources
+        resources["active_requests"] += 1
+    return resources
+
+def release_shared_resources(resources):
+    """使用中のリクエスト数を減らし、差し替え済みのリソースを使うリクエストがなくなればファイルを閉じる関数"""
+    with shared_resources_lock:
+        resources["active_requests"] -= 1
+        unused = resources["retired"] and resources["active_requests"] == 0
+    if unused:
+        close_index_resources(resources)
+
+def close_index_resources(resources):
+    """インデックスのバージョンごとに開いたファイル（mmapしたdocstore・回答キャッシュのDB）を閉じる関数"""
+    docstore = resources["index"].docstore
+    if hasattr(docstore, "close"):
+        docstore.close()
+    if resources.get("answer_cache") is not None:
+        resources["answer_cache"].close()
+
+def reload_shared_resources(version):
+    """公開された新しいバージョンのインデックスをロードし、共有リソースを差し替える関数（IndexWatcherのスレッドで実行）
+
+    ロード中のリクエストは使用中のリソースで処理し、差し替えはロックの中で参照を入れ替えるだけにする。
+    処理中のリクエストは古いリソースを最後まで使い、最後のリクエストが終わった時点で古いリソースのファイルを閉じる。
+    """
+    global shared_resources
+    previous = shared_resources
+    print(f"新しいバージョンのインデックス（{version}）をロードしています...")
+    start_time = time.perf_counter()
+    result = initialize_shared_resources(previous=previous)
+    if "error" in result:
+        raise RuntimeError(result["error"])
+    with shared_resources_lock:
+        shared_resources = result
+        previous["retired"] = True
+        unused = previous["active_requests"] == 0
+    if unused:
+        close_index_resources(previous)
+    # 古いバージョンの検索結果はキーが異なり参照されないため、メモリを空けるために破棄する
+    query_cache.retrievals.clear()
+    metrics.inc('rag_index_reloads_total', help_text='インデックスを差し替えた回数')
+    print(f"インデックスを差し替えました: {previous['index_version']} → {result['index_version']}"
+          f"（ロード時間: {time.perf_counter() - start_time:.2f}秒）")
+    # 古いインデックス（FAISS）を参照しているのは処理中のリクエストのみにし、
+    # 循環参照があっても次のGCを待たずにメモリが解放されるようにする
+    del previous
+    gc.collect()
+
+def start_index_watcher():
+    """インデックスの監視を開始する関数（gunicornではforkした後のワーカーごとに呼ぶ）"""
+    global index_watcher
+    if INDEX_WATCH_INTERVAL <= 0 or index_watcher is not None:
+        return
+    index_watcher = IndexWatcher(
+        lambda: (shared_resources or {}).get("index_version"), reload_shared_resources, INDEX_DIR, INDEX_WATCH_INTERVAL
+    )
+    index_watcher.start()
+
+def close_shared_resources():
+    """終了時に共有リソースを解放する関数（Ollamaへの接続とmmapしたファイルを閉じる）"""
+    global shared_resources, index_watcher
+    if index_watcher is not None:
+        index_watcher.stop()
+        index_watcher = None
+    with shared_resources_lock:
+        resources, shared_resources = shared_resources, None
+    if resources is None:
+        return
+    from llm_integration import close_ollama_clients
+    close_ollama_clients()
+    close_index_resources(resources)
+
+def get_session_pipeline(session_id):
+    """共有のクエリパイプラインとセッションのチャットメモリを取得する関数
+
+    応答を返し終えたらrelease_shared_resources(result["resources"])を呼ぶこと。
+    """
+    resources = acquire_shared_resources()
+    if "error" in resources:
+        return resources
+    
+    # セッションIDに対応するチャットメモリを取得または作成
+    memory = chat_memories.get_or_create(
+        session_id,
+        lambda: ChatMemoryBuffer.from_defaults(token_limit=4096)
+    )
+    return {"pipeline": resources["pipeline"], "memory": memory, "resources": resources}
+
+def extract_sources(source_nodes):
+    """参照ノードからファイル名の一覧を取り出す関数"""
+    sources = []
+    for node in source_nodes or []:
+        if hasattr(node, 'metadata') and 'file_path' in node.metadata:
+            source = os.path.basename(node.metadata['file_path'])
+            sources.append(source)
+    return sources
+
+def sse_event(event, data):
+    """Server-Sent Events形式のメッセージを作成する関数"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.before_request
+def start_request_timer():
+    g.request_start_time = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """エンドポイントごとのリクエスト数と応答時間を記録する関数（ストリーミングは応答開始まで）"""
+    start_time = g.pop('request_start_time', None)
+    endpoint = request.endpoint or 'unknown'
+    if start_time is not None and endpoint != 'metrics_endpoint':
+        metrics.inc(
+            'rag_http_requests_total', help_text='HTTPリクエスト数', endpoint=endpoint, status=str(response.status_code)
+        )
+        metrics.observe(
+            'rag_http_request_duration_seconds', time.perf_counter() - start_time,
+            help_text='HTTPリクエストの応答時間（秒）', endpoint=endpoint
+        )
+    return response
+
 @app.route('/')
 def home():
     """ホームページのルート"""
-    return render_template('index.html')
+    return Response(INDEX_HTML, mimetype='text/html')
+
+@app.route('/healthz')
+def healthz():
+    """プロセスが応答できるかを返すエンドポイント（liveness）"""
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz')
+def readyz():
+    """インデックスとLLMのロードが完了し、リクエストを処理できるかを返すエンドポイント（readiness）"""
+    resources = shared_resources
+    if resources is None:
+        return jsonify({"status": "loading"}), 503
+    return jsonify({"status": "ready", "index_version": resources["index_version"]})
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
@@ -60,45 +302,130 @@ def chat():
     data = request.json
     session_id = data.get('session_id', 'default')
     message = data.get('message', '')
+    try:
+        filters = normalize_filters(data.get('filters'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
-    # セッションIDに対応するチャットエンジンを取得または作成
-    if session_id not in chat_engines:
-        result = initialize_chat_engine()
-        if "error" in result:
-            return jsonify({"error": result["error"]})
-        chat_engines[session_id] = result["chat_engine"]
-    
-    chat_engine = chat_engines[session_id]
+    result = get_session_pipeline(session_id)
+    if "error" in result:
+        return jsonify({"error": result["error"]})
     
     try:
         # クエリの実行
-        response = chat_engine.chat(message)
-        
-        # 引用元の取得
-        sources = []
-        if hasattr(response, 'source_nodes') and response.source_nodes:
-            for node in response.source_nodes:
-                if hasattr(node, 'metadata') and 'file_path' in node.metadata:
-                    source = os.path.basename(node.metadata['file_path'])
-                    sources.append(source)
+        response = result["pipeline"].chat(message, result["memory"], filters=filters)
         
         return jsonify({
             "response": response.response,
-            "sources": sources
+            "sources": extract_sources(response.source_nodes),
+            "timings": response.timings,
+            "cached": response.cached
         })
     
+    except LLMOverloadedError as e:
+        # Ollamaの処理能力を超えるリクエストは待たせ続けずに断る
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "10"}
+    except ValueError as e:
+        # 絞り込み用の索引がない場合など
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": f"エラーが発生しました: {str(e)}"})
+    finally:
+        release_shared_resources(result["resources"])
 
-# テンプレートディレクトリの作成
-@app.before_first_request
-def setup_templates():
-    """テンプレートディレクトリのセットアップ"""
-    templates_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
-    os.makedirs(templates_dir, exist_ok=True)
+@app.route('/api/stats')
+def stats():
+    """キャッシュ・セッション・LLMの待ち行列の統計情報を返すエンドポイント"""
+    from llm_integration import get_llm_gateway
+    cache_stats = query_cache.stats()
+    reranker = (shared_resources or {}).get("reranker")
+    if reranker is not None:
+        cache_stats["rerank"] = reranker.cache.stats()
+    answer_cache = (shared_resources or {}).get("answer_cache")
+    if answer_cache is not None:
+        cache_stats["answer"] = answer_cache.stats()
+    index_stats = {"version": (shared_resources or {}).get("index_version")}
+    if index_watcher is not None:
+        index_stats.update(index_watcher.stats())
+    return jsonify({
+        "cache": cache_stats,
+        "sessions": {"active": len(chat_memories), "evictions": chat_memories.evictions},
+        "llm": get_llm_gateway().stats(),
+        "index": index_stats,
+    })
+
+@app.route('/api/facets')
+def facets():
+    """絞り込みに指定できるフォルダ・ファイル名と、それぞれのノード数を返すエンドポイント"""
+    resources = acquire_shared_resources()
+    if "error" in resources:
+        return jsonify({"error": resources["error"]})
+    try:
+        # 応答を返すまでに差し替えられても、読み込み中のバージョンのファイルは閉じられない
+        facet_index = resources["pipeline"].retriever.facet_index
+        if facet_index is None:
+            return jsonify({"error": "絞り込み用の索引がありません（main.py --full で作成してください）"}), 404
+        return jsonify(facet_index.facets())
+    finally:
+        release_shared_resources(resources)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """処理段階ごとの時間・LLMのトークン数などをPrometheusのテキスト形式で返すエンドポイント"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """チャットAPIエンドポイント（生成されたトークンをServer-Sent Eventsで逐次送信）"""
+    data = request.json
+    session_id = data.get('session_id', 'default')
+    message = data.get('message', '')
+    try:
+        filters = normalize_filters(data.get('filters'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
-    # index.htmlの作成
-    index_html = """
+    def generate():
+        result = get_session_pipeline(session_id)
+        if "error" in result:
+            yield sse_event("error", {"error": result["error"]})
+            return
+        
+        try:
+            # 検索後、Ollamaが出力したトークンをそのまま転送する
+            response = result["pipeline"].stream_chat(
+                message, result["memory"], cancel_event=threading.Event(), filters=filters
+            )
+            tokens = response.response_gen
+            try:
+                for token in tokens:
+                    yield sse_event("token", {"token": token})
+            finally:
+                # クライアントが切断するとここで閉じられ、Ollamaでの生成も中止される
+                tokens.close()
+            
+            # 引用元は最後にまとめて送信
+            yield sse_event("sources", {"sources": extract_sources(response.source_nodes)})
+            yield sse_event("done", {"timings": response.timings, "cached": response.cached})
+        except LLMOverloadedError as e:
+            yield sse_event("error", {"error": str(e)})
+        except Exception as e:
+            yield sse_event("error", {"error": f"エラーが発生しました: {str(e)}"})
+        finally:
+            # クライアントが切断した場合もここで使用中のリクエスト数を減らす
+            release_shared_resources(result["resources"])
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # リバースプロキシでのバッファリングを無効化
+        }
+    )
+
+# チャット画面のHTML（テンプレートファイルに書き出さず、メモリ上の文字列をそのまま返す）
+INDEX_HTML = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -204,18 +531,37 @@ def setup_templates():
             function addMessage(content, isUser, sources = []) {
                 const messageDiv = document.createElement('div');
                 messageDiv.className = `message ${isUser ? 'user-message' : 'assistant-message'}`;
-                messageDiv.textContent = content;
+                const textSpan = document.createElement('span');
+                textSpan.className = 'message-text';
+                textSpan.textContent = content;
+                messageDiv.appendChild(textSpan);
                 
                 // 情報源の追加
-                if (!isUser && sources.length > 0) {
-                    const sourcesDiv = document.createElement('div');
-                    sourcesDiv.className = 'sources';
-                    sourcesDiv.textContent = '参照: ' + sources.join(', ');
-                    messageDiv.appendChild(sourcesDiv);
+                if (!isUser) {
+                    setSources(messageDiv, sources);
                 }
                 
                 chatContainer.appendChild(messageDiv);
                 chatContainer.scrollTop = chatContainer.scrollHeight;
+                return messageDiv;
+            }
+
+            // 情報源の表示
+            function setSources(messageDiv, sources) {
+                if (!sources || sources.length === 0) return;
+                const sourcesDiv = document.createElement('div');
+                sourcesDiv.className = 'sources';
+                sourcesDiv.textContent = '参照: ' + sources.join(', ');
+                messageDiv.appendChild(sourcesDiv);
+            }
+
+            // エラーメッセージの表示
+            function addError(content) {
+                const errorDiv = document.createElement('div');
+                errorDiv.className = 'message assistant-message error';
+                errorDiv.textContent = content;
+                chatContainer.appendChild(errorDiv);
+                chatContainer.scrollTop = chatContainer.scrollHeight;
             }
 
             // ローディング表示の追加/削除
@@ -233,7 +579,18 @@ def setup_templates():
                 chatContainer.scrollTop = chatContainer.scrollHeight;
             }
 
-            // メッセージの送信
+            // Server-Sent Eventsの1イベント分を解析
+            function parseEvent(raw) {
+                let event = 'message';
+                let data = '';
+                for (const line of raw.split('\\n')) {
+                    if (line.startsWith('event: ')) event = line.slice(7);
+                    else if (line.startsWith('data: ')) data += line.slice(6);
+                }
+                return { event, data: data ? JSON.parse(data) : {} };
+            }
+
+            // メッセージの送信（回答はトークンごとに逐次表示）
             async function sendMessage() {
                 const message = userInput.value.trim();
                 if (!message) return;
@@ -244,10 +601,11 @@ def setup_templates():
                 
                 // ローディング表示
                 toggleLoading(true);
+                let messageDiv = null;
                 
                 try {
                     // APIにリクエスト
-                    const response = await fetch('/api/chat', {
+                    const response = await fetch('/api/chat/stream', {
                         method: 'POST',
                         headers: {
                             'Content-Type': 'application/json',
@@ -258,30 +616,47 @@ def setup_templates():
                         }),
                     });
                     
-                    const data = await response.json();
-                    
-                    // ローディング表示を削除
-                    toggleLoading(false);
+                    const reader = response.body.getReader();
+                    const decoder = new TextDecoder();
+                    let buffer = '';
                     
-                    if (data.error) {
-                        // エラーメッセージの表示
-                        const errorDiv = document.createElement('div');
-                        errorDiv.className = 'message assistant-message error';
-                        errorDiv.textContent = data.error;
-                        chatContainer.appendChild(errorDiv);
-                    } else {
-                        // アシスタントの応答を表示
-                        addMessage(data.response, false, data.sources);
+                    while (true) {
+                        const { value, done } = await reader.read();
+                        if (done) break;
+                        buffer += decoder.decode(value, { stream: true });
+                        
+                        let boundary;
+                        while ((boundary = buffer.indexOf('\\n\\n')) >= 0) {
+                            const { event, data } = parseEvent(buffer.slice(0, boundary));
+                            buffer = buffer.slice(boundary + 2);
+                            
+                            if (event === 'token') {
+                                // 最初のトークンでローディング表示を回答に置き換える
+                                if (!messageDiv) {
+                                    toggleLoading(false);
+                                    messageDiv = addMessage('', false);
+                                }
+                                messageDiv.querySelector('.message-text').textContent += data.token;
+                                chatContainer.scrollTop = chatContainer.scrollHeight;
+                            } else if (event === 'sources') {
+                                if (!messageDiv) {
+                                    toggleLoading(false);
+                                    messageDiv = addMessage('', false);
+                                }
+                                setSources(messageDiv, data.sources);
+                            } else if (event === 'error') {
+                                toggleLoading(false);
+                                addError(data.error);
+                            }
+                        }
                     }
+                    toggleLoading(false);
                 } catch (error) {
                     // ローディング表示を削除
                     toggleLoading(false);
                     
                     // エラーメッセージの表示
-                    const errorDiv = document.createElement('div');
-                    errorDiv.className = 'message assistant-message error';
-                    errorDiv.textContent = 'ネットワークエラーが発生しました。';
-                    chatContainer.appendChild(errorDiv);
+                    addError('ネットワークエラーが発生しました。');
                     console.error('Error:', error);
                 }
             }
@@ -298,9 +673,13 @@ def setup_templates():
     </body>
     </html>
     """
-    
-    with open(os.path.join(templates_dir, 'index.html'), 'w', encoding='utf-8') as f:
-        f.write(index_html)
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # 開発用サーバー（本番環境では python src/serve.py でマルチワーカーのサーバーを使う）
+    # 起動時に共有リソースをロードしておき、最初のリクエストの待ち時間をなくす
+    # （リローダーはモジュールを別プロセスで実行し直し、インデックスとモデルを二重にロードするため使わない）
+    resources = get_shared_resources()
+    if "error" in resources:
+        print(resources["error"])
+    start_index_watcher()
+    app.run(debug=True, use_reloader=False, host=WEB_HOST, port=WEB_PORT)
\ No newline at end of file
@@ -0,0 +1,37 @@
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, TextNode
+import os
+import sys
+
+# srcディレクトリをパスに追加して、src内のモジュール同士のimport（from config import ...）を解決する
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+class FakeRetriever(BaseRetriever):
+    """質問文にかかわらず同じノードを返すテスト用のRetriever（from conftest import FakeRetriever で使う）
+
+    nodesは返す (ノード, スコア) のリスト（省略時は人工衛星の軌道のノード1件）。
+    embeddingはget_query_embeddingが返すエンベディングで、質問ごとに変える場合は {質問: エンベディング} の辞書を渡す。
+    検索とエンベディングの呼び出し回数と、検索に渡されたエンベディングを記録する。
+    """
+
+    facet_index = None
+
+    def __init__(self, nodes=None, embedding=(1.0, 0.0)):
+        super().__init__()
+        self.nodes = nodes if nodes is not None else [(TextNode(id_='n1', text='人工衛星の軌道について'), 0.9)]
+        self.embedding = embedding
+        self.retrieve_calls = 0
+        self.embed_calls = 0
+        self.last_embedding = None
+
+    def get_query_embedding(self, query_str):
+        self.embed_calls += 1
+        if isinstance(self.embedding, dict):
+            return self.embedding[query_str]
+        return list(self.embedding)
+
+    def _retrieve(self, query_bundle):
+        self.retrieve_calls += 1
+        assert query_bundle.embedding is not None
+        self.last_embedding = query_bundle.embedding
+        return [NodeWithScore(node=node, score=score) for node, score in self.nodes]
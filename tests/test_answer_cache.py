@@ -0,0 +1,125 @@
+from llama_index.core.llms import MockLLM
+from llama_index.core.memory import ChatMemoryBuffer
+from src.utils.answer_cache import AnswerCache
+from src.utils.query_pipeline import QueryPipeline
+from conftest import FakeRetriever
+import os
+import pytest
+
+class CountingLLM(MockLLM):
+    calls: int = 0
+
+    def complete(self, prompt, formatted=False, **kwargs):
+        self.calls += 1
+        return super().complete(prompt, formatted=formatted, **kwargs)
+
+def test_answer_cache_lookup(tmp_path):
+    """類似度が閾値以上で、ノードの集合が一致する場合のみヒットすることをテストする"""
+    cache = AnswerCache(str(tmp_path / 'answers.sqlite'), 'v1', threshold=0.9)
+    cache.put('軌道とは？', [1.0, 0.0], ['n1', 'n2'], '軌道の説明です。', llm_seconds=2.0)
+    assert cache.lookup([0.99, 0.05], ['n2', 'n1']) == '軌道の説明です。'
+    assert cache.lookup([0.99, 0.05], ['n1']) is None
+    assert cache.lookup([0.0, 1.0], ['n1', 'n2']) is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['saved_seconds']) == (1, 2, 2.0)
+    # 空の回答は保存しない
+    cache.put('空', [0.0, 1.0], ['n1'], '  ')
+    assert len(cache) == 1
+    cache.close()
+
+def test_answer_cache_persistence_and_invalidation(tmp_path):
+    """再起動後も回答が残り、インデックスのバージョンが変わると破棄されることをテストする"""
+    path = str(tmp_path / 'answers.sqlite')
+    cache = AnswerCache(path, 'v1')
+    cache.put('軌道とは？', [1.0, 0.0], ['n1'], '軌道の説明です。')
+    cache.close()
+
+    cache = AnswerCache(path, 'v1')
+    assert cache.lookup([1.0, 0.0], ['n1']) == '軌道の説明です。'
+    cache.close()
+
+    cache = AnswerCache(path, 'v2')
+    assert len(cache) == 0
+    cache.close()
+    assert len(AnswerCache(path, 'v1')) == 0
+
+def test_answer_cache_eviction(tmp_path):
+    """件数の上限を超えると、最後に使われた時刻が古いものから削除されることをテストする"""
+    cache = AnswerCache(str(tmp_path / 'answers.sqlite'), 'v1', max_entries=2)
+    cache.put('a', [1.0, 0.0, 0.0], ['n1'], 'A')
+    cache.put('b', [0.0, 1.0, 0.0], ['n1'], 'B')
+    assert cache.lookup([1.0, 0.0, 0.0], ['n1']) == 'A'
+    cache.put('c', [0.0, 0.0, 1.0], ['n1'], 'C')
+    assert len(cache) == 2
+    assert cache.lookup([0.0, 1.0, 0.0], ['n1']) is None
+    assert cache.lookup([1.0, 0.0, 0.0], ['n1']) == 'A'
+    cache.close()
+
+def test_answer_cache_shared_between_workers(tmp_path):
+    """別の接続（ワーカー）が追加・削除したエントリがメモリ上のエントリに反映されることをテストする"""
+    path = str(tmp_path / 'answers.sqlite')
+    first = AnswerCache(path, 'v1', max_entries=2)
+    second = AnswerCache(path, 'v1', max_entries=2)
+    first.put('a', [1.0, 0.0, 0.0], ['n1'], 'A')
+    first.put('b', [0.0, 1.0, 0.0], ['n1'], 'B')
+    assert second.lookup([0.0, 1.0, 0.0], ['n1']) == 'B'
+    # secondが追加したときに、最後に使われた時刻が最も古いAが削除される
+    second.put('c', [0.0, 0.0, 1.0], ['n1'], 'C')
+    assert first.lookup([0.0, 0.0, 1.0], ['n1']) == 'C'
+    assert first.lookup([1.0, 0.0, 0.0], ['n1']) is None
+    assert len(first) == len(second) == 2
+    first.close()
+    second.close()
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='forkが使えない環境')
+def test_answer_cache_after_fork(tmp_path):
+    """fork後のプロセスは接続を開き直し、プロセス間で保存した回答を共有できることをテストする"""
+    cache = AnswerCache(str(tmp_path / 'answers.sqlite'), 'v1')
+    cache.put('軌道とは？', [1.0, 0.0], ['n1'], '軌道の説明です。')
+    parent_conn = cache._conn
+
+    pid = os.fork()
+    if pid == 0:
+        # 子プロセス（gunicornのワーカーに相当）。結果は終了コードで返す
+        try:
+            found = cache.lookup([1.0, 0.0], ['n1']) == '軌道の説明です。'
+            cache.put('電源とは？', [0.0, 1.0], ['n2'], '電源の説明です。')
+            cache.close()
+            os._exit(0 if found and cache._conn is not parent_conn else 1)
+        except BaseException:
+            os._exit(2)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+
+    assert cache._conn is parent_conn
+    assert cache.lookup([0.0, 1.0], ['n2']) == '電源の説明です。'
+    assert len(cache) == 2
+    cache.close()
+
+def test_pipeline_uses_answer_cache(tmp_path):
+    """言い換えの質問はLLMを呼ばずに回答し、会話の途中の質問はキャッシュを使わないことをテストする"""
+    cache = AnswerCache(str(tmp_path / 'answers.sqlite'), 'v1', threshold=0.9)
+    llm = CountingLLM()
+    retriever = FakeRetriever(embedding={'軌道とは？': [1.0, 0.0], '軌道って何？': [0.98, 0.1], '続けて': [0.98, 0.1]})
+    pipeline = QueryPipeline(retriever=retriever, llm=llm, answer_cache=cache)
+
+    first = pipeline.chat('軌道とは？', ChatMemoryBuffer.from_defaults(token_limit=2048))
+    assert not first.cached and llm.calls == 1
+
+    memory = ChatMemoryBuffer.from_defaults(token_limit=2048)
+    second = pipeline.chat('軌道って何？', memory)
+    assert second.cached and llm.calls == 1
+    assert second.response == first.response
+    assert [node.node.node_id for node in second.source_nodes] == ['n1']
+    assert 'answer_cache' in second.timings
+    # キャッシュした回答も会話履歴に残る
+    assert len(memory.get_all()) == 2
+
+    # 会話履歴がある場合は回答が変わりうるため、LLMで生成する
+    third = pipeline.chat('続けて', memory)
+    assert not third.cached and llm.calls == 2
+
+    streamed = pipeline.stream_chat('軌道って何？', ChatMemoryBuffer.from_defaults(token_limit=2048))
+    assert streamed.cached
+    assert "".join(streamed.response_gen) == first.response
+    cache.close()
@@ -0,0 +1,44 @@
+import json
+import pytest
+from src.utils.batch_io import load_queries, load_completed_ids, open_output, append_result
+
+def test_load_queries_jsonl(tmp_path):
+    """JSONLから質問を読み込み、IDがなければ行番号を使うことをテストする"""
+    path = tmp_path / 'queries.jsonl'
+    path.write_text(
+        '{"id": "q1", "question": "衛星とは？"}\n\n{"query": "センサーの種類"}\n{"id": "q3"}\n',
+        encoding='utf-8'
+    )
+    queries = load_queries(str(path))
+    assert queries == [
+        {'id': 'q1', 'question': '衛星とは？'},
+        {'id': '2', 'question': 'センサーの種類'},
+    ]
+
+def test_load_queries_csv(tmp_path):
+    """CSVから質問を読み込めることをテストする"""
+    path = tmp_path / 'queries.csv'
+    path.write_text('id,question\na,衛星とは？\nb,軌道について\n', encoding='utf-8')
+    assert [q['id'] for q in load_queries(str(path))] == ['a', 'b']
+
+def test_load_queries_rejects_duplicate_ids(tmp_path):
+    """IDが重複している場合はエラーになることをテストする"""
+    path = tmp_path / 'queries.csv'
+    path.write_text('id,question\na,衛星\na,軌道\n', encoding='utf-8')
+    with pytest.raises(ValueError):
+        load_queries(str(path))
+
+def test_resume_skips_completed_and_repairs_partial_line(tmp_path):
+    """再開時は成功した回答のみスキップし、途中で切れた行を壊さずに追記できることをテストする"""
+    path = tmp_path / 'answers.jsonl'
+    path.write_text(
+        json.dumps({'id': 'q1', 'answer': 'ok'}) + '\n'
+        + json.dumps({'id': 'q2', 'error': 'timeout'}) + '\n'
+        + '{"id": "q3", "ans',
+        encoding='utf-8'
+    )
+    assert load_completed_ids(str(path)) == {'q1'}
+
+    with open_output(str(path)) as f:
+        append_result(f, {'id': 'q3', 'answer': 'ok'})
+    assert load_completed_ids(str(path)) == {'q1', 'q3'}
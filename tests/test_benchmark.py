@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+from pdfminer.high_level import extract_text
+from src.utils.benchmark import (
+    BENCHMARK_SCHEMA_VERSION, HashingEmbedding, generate_corpus, generate_queries, latency_summary,
+    flatten_metrics, compare_results, save_results, load_results
+)
+
+def make_results(load_seconds=1.0, p95_ms=10.0):
+    return {
+        'schema_version': BENCHMARK_SCHEMA_VERSION,
+        'runs': [{
+            'num_docs': 100,
+            'stages': {'load': {'seconds': load_seconds, 'files_per_second': 100 / load_seconds}},
+            'retrieval': {'5': {'p50_ms': 5.0, 'p95_ms': p95_ms, 'p99_ms': 20.0}},
+            'query': {},
+        }],
+    }
+
+def test_generate_corpus_pdf(tmp_path):
+    """合成コーパスのPDFから日本語のテキストを抽出できることをテストする"""
+    paths = generate_corpus(str(tmp_path), 3, pages_per_doc=2, lines_per_page=5, file_format='pdf')
+    assert len(paths) == 3
+    text = extract_text(paths[0])
+    assert "。" in text
+    assert len(text.split("\f")) - 1 == 2
+
+def test_generate_corpus_is_deterministic(tmp_path):
+    """同じシードなら同じコーパスが作られることをテストする"""
+    first = generate_corpus(str(tmp_path / 'a'), 2, file_format='txt', seed=1)
+    second = generate_corpus(str(tmp_path / 'b'), 2, file_format='txt', seed=1)
+    for a, b in zip(first, second):
+        assert open(a, encoding='utf-8').read() == open(b, encoding='utf-8').read()
+    assert len(set(generate_queries(50))) == 50
+
+def test_hashing_embedding():
+    """スタブのエンベディングが正規化され、語彙が重なるテキストほど類似度が高いことをテストする"""
+    embed_model = HashingEmbedding()
+    query = np.array(embed_model.get_query_embedding("人工衛星の軌道"))
+    near = np.array(embed_model.get_text_embedding("人工衛星は軌道を計算する。"))
+    far = np.array(embed_model.get_text_embedding("患者の検査値を記録する。"))
+    assert len(query) == 384
+    assert np.linalg.norm(near) == pytest.approx(1.0, abs=1e-5)
+    assert query @ near > query @ far
+
+def test_latency_summary():
+    """レイテンシのパーセンタイルがミリ秒で集計されることをテストする"""
+    summary = latency_summary([i / 1000 for i in range(1, 101)])
+    assert summary['count'] == 100
+    assert summary['p50_ms'] == pytest.approx(50.5)
+    assert summary['p99_ms'] == pytest.approx(99.01)
+    assert summary['max_ms'] == pytest.approx(100.0)
+    assert latency_summary([]) == {'count': 0}
+
+def test_compare_results_detects_regression():
+    """閾値を超えて遅くなった指標だけが検出されることをテストする"""
+    baseline = make_results()
+    assert set(flatten_metrics(baseline)) == {
+        'docs=100/load/seconds',
+        'docs=100/retrieval/top_k=5/p50_ms',
+        'docs=100/retrieval/top_k=5/p95_ms',
+        'docs=100/retrieval/top_k=5/p99_ms',
+    }
+    assert compare_results(baseline, make_results(load_seconds=1.1)) == []
+
+    regressions = compare_results(baseline, make_results(load_seconds=1.5, p95_ms=30.0))
+    assert [name for name, *_ in regressions] == ['docs=100/retrieval/top_k=5/p95_ms', 'docs=100/load/seconds']
+
+    # 割合が大きくても差がわずかなら無視する
+    assert compare_results(make_results(p95_ms=0.1), make_results(p95_ms=0.3)) == []
+
+def test_load_results_checks_schema(tmp_path):
+    """保存した結果を読み込めること、形式が異なる場合はエラーになることをテストする"""
+    path = str(tmp_path / 'results.json')
+    save_results(path, make_results())
+    assert load_results(path) == make_results()
+
+    save_results(path, {'schema_version': BENCHMARK_SCHEMA_VERSION + 1})
+    with pytest.raises(ValueError):
+        load_results(path)
@@ -0,0 +1,66 @@
+import os
+import pytest
+from llama_index.core.schema import TextNode
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from src.utils.blob_store import BlobKVStore, BlobDocumentStore, BLOB_STORE_FILENAME, list_node_ids
+
+def make_nodes(count):
+    return [
+        TextNode(id_=f'n{i}', text=f'衛星データ {i}', metadata={'file_name': f'doc{i}.pdf'})
+        for i in range(count)
+    ]
+
+def test_kvstore_put_get_delete_and_persist(tmp_path):
+    """追加・削除が保存後のファイルに反映されることをテストする"""
+    path = str(tmp_path / BLOB_STORE_FILENAME)
+    kvstore = BlobKVStore(path)
+    kvstore.put('a', {'text': 'りんご'})
+    kvstore.put('b', {'text': 'みかん'}, collection='other')
+    kvstore.persist(path)
+
+    reloaded = BlobKVStore(path)
+    assert reloaded.get('a') == {'text': 'りんご'}
+    assert reloaded.get('b', collection='other') == {'text': 'みかん'}
+
+    assert reloaded.delete('a')
+    assert not reloaded.delete('a')
+    reloaded.put('c', {'text': 'ぶどう'})
+    assert reloaded.get('a') is None
+    assert reloaded.get_all() == {'c': {'text': 'ぶどう'}}
+    reloaded.persist(path)
+
+    assert BlobKVStore(path).get_all() == {'c': {'text': 'ぶどう'}}
+    assert BlobKVStore(path).keys(collection='other') == ['b']
+
+def test_invalid_file(tmp_path):
+    """形式が不正なファイルはエラーになることをテストする"""
+    path = tmp_path / BLOB_STORE_FILENAME
+    path.write_bytes(b'x' * 64)
+    with pytest.raises(ValueError):
+        BlobKVStore(str(path))
+
+def test_docstore_roundtrip(tmp_path):
+    """docstoreとして保存したノードを個別に取り出せることをテストする"""
+    docstore = BlobDocumentStore()
+    docstore.add_documents(make_nodes(5))
+    docstore.persist(persist_path=str(tmp_path / 'docstore.json'))
+    assert os.path.exists(str(tmp_path / BLOB_STORE_FILENAME))
+
+    loaded = BlobDocumentStore.from_persist_dir(str(tmp_path))
+    assert sorted(list_node_ids(loaded)) == [f'n{i}' for i in range(5)]
+    assert loaded.node_count() == 5
+    node = loaded.get_node('n3')
+    assert node.text == '衛星データ 3'
+    assert node.metadata['file_name'] == 'doc3.pdf'
+    assert loaded.get_node('missing', raise_error=False) is None
+
+def test_migrate_from_simple_docstore(tmp_path):
+    """docstore.jsonから移行すると古いファイルが削除されることをテストする"""
+    simple = SimpleDocumentStore()
+    simple.add_documents(make_nodes(3))
+    simple.persist(str(tmp_path / 'docstore.json'))
+
+    docstore = BlobDocumentStore.from_simple_docstore(SimpleDocumentStore.from_persist_dir(str(tmp_path)))
+    docstore.persist(persist_path=str(tmp_path / 'docstore.json'))
+    assert not os.path.exists(str(tmp_path / 'docstore.json'))
+    assert BlobDocumentStore.from_persist_dir(str(tmp_path)).get_node('n1').text == '衛星データ 1'
@@ -0,0 +1,56 @@
+from llama_index.core.schema import Document
+from src.utils.chunking import (
+    NodeCache, split_sentences, create_node_parser, chunking_signature, group_ref_doc_ids_by_file, chunk_report
+)
+
+def make_document(text, page='1'):
+    return Document(text=text, id_=f'/pdf/a.pdf_part_{page}', metadata={'file_path': '/pdf/a.pdf', 'page_label': page})
+
+def test_split_sentences_japanese():
+    """日本語の句点・感嘆符・疑問符と閉じ括弧で区切られ、連結すると元に戻ることをテストする"""
+    text = "衛星は「軌道」を回る。本当ですか？はい！値は3.14です。It works. 次の行\n\n段落です。"
+    sentences = split_sentences(text)
+    assert sentences == [
+        "衛星は「軌道」を回る。", "本当ですか？", "はい！", "値は3.14です。", "It works. ", "次の行\n\n", "段落です。"
+    ]
+    assert "".join(sentences) == text
+    assert split_sentences("「そうです。」と言った。") == ["「そうです。」", "と言った。"]
+
+def test_node_parser_keeps_page_metadata():
+    """チャンクが文の途中で切れず、ページ番号のメタデータが引き継がれることをテストする"""
+    sentence = "人工衛星の軌道は地球の重力と速度で決まります。"
+    documents = [make_document(sentence * 30, page='1'), make_document(sentence * 30, page='2')]
+    nodes = create_node_parser(chunk_size=128, chunk_overlap=0).get_nodes_from_documents(documents)
+    assert len(nodes) > 2
+    assert {node.metadata['page_label'] for node in nodes} == {'1', '2'}
+    assert all(node.text.endswith("。") for node in nodes)
+    assert group_ref_doc_ids_by_file(nodes) == {'/pdf/a.pdf': ['/pdf/a.pdf_part_1', '/pdf/a.pdf_part_2']}
+
+    report = chunk_report(nodes)
+    assert report['chunks'] == len(nodes)
+    assert report['chars']['max'] <= len(sentence * 30)
+    assert chunk_report([]) == {'chunks': 0}
+
+def test_node_cache(tmp_path):
+    """ハッシュが一致する場合のみキャッシュしたノードが返されることをテストする"""
+    nodes = create_node_parser(chunk_size=128, chunk_overlap=0).get_nodes_from_documents(
+        [make_document("人工衛星の軌道について説明します。" * 20)]
+    )
+    nodes[0].embedding = [0.1, 0.2]
+    entry = {'path': '/pdf/a.pdf', 'sha256': 'abc'}
+    cache = NodeCache(str(tmp_path / 'nodes.sqlite'), chunking_signature(128, 0))
+    cache.put_many([(entry, nodes)])
+
+    cached = cache.get_many([entry])['/pdf/a.pdf']
+    assert [node.node_id for node in cached] == [node.node_id for node in nodes]
+    assert cached[0].text == nodes[0].text
+    assert cached[0].metadata['page_label'] == '1'
+    assert cached[0].embedding is None
+    assert cached[1].prev_node.node_id == nodes[0].node_id
+
+    assert cache.get_many([dict(entry, sha256='changed')]) == {}
+    other = NodeCache(str(tmp_path / 'nodes.sqlite'), chunking_signature(256, 0))
+    assert other.get_many([entry]) == {}
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+    other.close()
@@ -0,0 +1,67 @@
+from llama_index.core import Settings
+from llama_index.core.schema import NodeRelationship, NodeWithScore, RelatedNodeInfo, TextNode
+from src.utils.context_packer import ContextPacker, load_tokenizer
+
+# 1文字を1トークンとして数えるトークナイザー
+char_tokenizer = lambda text: list(text)
+
+def make_node(node_id, text, score, start=None, previous=None, following=None):
+    relationships = {}
+    if previous:
+        relationships[NodeRelationship.PREVIOUS] = RelatedNodeInfo(node_id=previous)
+    if following:
+        relationships[NodeRelationship.NEXT] = RelatedNodeInfo(node_id=following)
+    node = TextNode(
+        id_=node_id, text=text, relationships=relationships,
+        start_char_idx=start, end_char_idx=start + len(text) if start is not None else None
+    )
+    return NodeWithScore(node=node, score=score)
+
+def test_deduplicate_keeps_best_score():
+    """ほぼ同じ内容のノードはスコアが高い方だけが残ることをテストする"""
+    packer = ContextPacker(tokenizer=char_tokenizer, token_budget=1000)
+    text = "人工衛星の軌道は地球の重力と衛星の速度によって決まります。"
+    nodes = [
+        make_node('a', text, 0.5),
+        make_node('b', text + "以上。", 0.9),
+        make_node('c', "患者の検査値は毎日記録します。", 0.3),
+    ]
+    results = packer.postprocess_nodes(nodes)
+    assert [result.node.node_id for result in results] == ['b', 'c']
+
+def test_merge_adjacent_chunks_removes_overlap():
+    """同じファイルの隣り合うチャンクが重なりを除いて連結されることをテストする"""
+    packer = ContextPacker(tokenizer=char_tokenizer, token_budget=1000, dedup_threshold=0)
+    nodes = [
+        make_node('b', "第二の文です。第三の文です。", 0.8, start=7, previous='a'),
+        make_node('a', "第一の文です。第二の文です。", 0.6, start=0, following='b'),
+        make_node('x', "別の文書です。", 0.7),
+    ]
+    results = packer.postprocess_nodes(nodes)
+    assert [result.node.node_id for result in results] == ['a', 'x']
+    assert results[0].node.text == "第一の文です。第二の文です。第三の文です。"
+    assert results[0].score == 0.8
+
+    # 位置情報がない場合はテキストの重なりから連結する
+    nodes = [
+        make_node('a', "第一の文です。第二の文です。", 0.6, following='b'),
+        make_node('b', "第二の文です。第三の文です。", 0.8, previous='a'),
+    ]
+    assert packer.postprocess_nodes(nodes)[0].node.text == "第一の文です。第二の文です。第三の文です。"
+
+def test_pack_within_token_budget():
+    """スコアの高い順にトークン数の上限まで詰め、収まらないノードは文の区切りで切り詰めることをテストする"""
+    packer = ContextPacker(tokenizer=char_tokenizer, token_budget=30, dedup_threshold=0, min_tokens=5)
+    nodes = [
+        make_node('low', "あいうえお。" * 5, 0.1),
+        make_node('high', "かきくけこ。" * 3, 0.9),
+        make_node('middle', "さしすせそ。たちつてと。" * 2, 0.5),
+    ]
+    results = packer.postprocess_nodes(nodes)
+    assert [result.node.node_id for result in results] == ['high', 'middle']
+    assert results[1].node.text == "さしすせそ。たちつてと。"
+    assert sum(packer.count_tokens(result.node) for result in results) <= 30
+
+def test_load_tokenizer_fallback():
+    """トークナイザー名が空の場合はLlamaIndexの既定のトークナイザーを使うことをテストする"""
+    assert load_tokenizer('') is Settings.tokenizer
@@ -56,4 +56,41 @@ def test_load_documents_exceptions(mock_reader, exception, expected_message):
     # 実行とアサート
     with pytest.raises(exception) as excinfo:
         load_documents()
-    assert expected_message in str(excinfo.value)
\ No newline at end of file
+    assert expected_message in str(excinfo.value)
+
+class FakeReader:
+    """ファイル名に応じて正常終了・例外・異常終了・ハングを再現するリーダー"""
+
+    def __init__(self, input_files, **kwargs):
+        self.path = input_files[0]
+
+    def load_data(self):
+        if 'error' in self.path:
+            raise ValueError("Invalid PDF file")
+        if 'crash' in self.path:
+            os._exit(1)
+        if 'hang' in self.path:
+            import time
+            time.sleep(60)
+        return [self.path + ':page0']
+
+@patch('src.utils.data_loader.SimpleDirectoryReader', FakeReader)
+def test_iter_documents_parallel_isolates_failures():
+    """1ファイルの例外・異常終了・タイムアウトが他のファイルに影響しないことをテストする"""
+    from src.utils.data_loader import iter_documents_parallel
+    files = ['a.pdf', 'error.pdf', 'crash.pdf', 'hang.pdf', 'b.pdf', 'c.pdf']
+
+    results = {path: (docs, error) for path, docs, error in iter_documents_parallel(files, num_workers=2, timeout=2)}
+
+    assert set(results) == set(files)
+    for path in ['a.pdf', 'b.pdf', 'c.pdf']:
+        assert results[path] == ([path + ':page0'], None)
+    assert 'Invalid PDF file' in results['error.pdf'][1]
+    assert results['crash.pdf'][0] == [] and results['crash.pdf'][1]
+    assert results['hang.pdf'][0] == [] and results['hang.pdf'][1]
+
+@patch('src.utils.data_loader.SimpleDirectoryReader', FakeReader)
+def test_load_documents_parallel():
+    """num_workersを指定すると並列読み込みが使われることをテストする"""
+    result = load_documents(input_files=['a.pdf', 'b.pdf', 'error.pdf'], num_workers=2)
+    assert sorted(result) == ['a.pdf:page0', 'b.pdf:page0']
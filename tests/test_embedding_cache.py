@@ -0,0 +1,91 @@
+import pytest
+from src.utils.embedding_cache import (
+    EmbeddingCache, EmbeddingStats, embed_texts, embed_in_batches, count_tokens, text_hash
+)
+
+class CountingEmbedModel:
+    """呼び出されたテキストを記録するエンベディングモデル"""
+
+    def __init__(self):
+        self.calls = []
+
+    def get_text_embedding_batch(self, texts, show_progress=False):
+        self.calls.append(list(texts))
+        return [[float(len(text)), 1.0, 0.5] for text in texts]
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / 'cache.sqlite'), 'test-model')
+    yield cache
+    cache.close()
+
+def test_text_hash_normalization():
+    """改行コードと前後の空白の違いが同じキーになることをテストする"""
+    assert text_hash("本文\r\n次の行 ") == text_hash("本文\n次の行")
+    assert text_hash("本文") != text_hash("別の本文")
+
+def test_embed_texts_without_cache():
+    """キャッシュなしではモデルをそのまま呼ぶことをテストする"""
+    model = CountingEmbedModel()
+    assert embed_texts(["a", "bb"], model) == [[1.0, 1.0, 0.5], [2.0, 1.0, 0.5]]
+
+def test_embed_texts_uses_cache(cache):
+    """2回目以降はキャッシュが使われ、重複テキストは1回だけ計算されることをテストする"""
+    model = CountingEmbedModel()
+    first = embed_texts(["a", "bb", "a"], model, cache=cache)
+    # 長さ順にまとめて計算される
+    assert model.calls == [["bb", "a"]]
+    assert first[0] == first[2]
+
+    second = embed_texts(["bb", "ccc", "a"], model, cache=cache)
+    assert model.calls[-1] == ["ccc"]
+    assert second == [[2.0, 1.0, 0.5], [3.0, 1.0, 0.5], [1.0, 1.0, 0.5]]
+    assert cache.hits == 2
+    assert cache.misses == 4
+    assert len(cache) == 3
+
+def test_cache_is_persistent_and_per_model(tmp_path):
+    """キャッシュが再オープン後も残り、モデルごとに分離されることをテストする"""
+    path = str(tmp_path / 'cache.sqlite')
+    cache = EmbeddingCache(path, 'model-a')
+    embed_texts(["a"], CountingEmbedModel(), cache=cache)
+    cache.close()
+
+    reopened = EmbeddingCache(path, 'model-a')
+    assert len(reopened) == 1
+    reopened.close()
+
+    other_model = EmbeddingCache(path, 'model-b')
+    assert len(other_model) == 0
+    other_model.close()
+
+class FakeTokenizer:
+    def __call__(self, texts, add_special_tokens=True):
+        return {'input_ids': [[0] * (len(text) + 2) for text in texts]}
+
+class FakeSentenceTransformer:
+    tokenizer = FakeTokenizer()
+    max_seq_length = 5
+
+def test_embed_in_batches_sorts_by_length():
+    """長さの近いテキストが同じバッチになり、結果は元の順序で返ることをテストする"""
+    model = CountingEmbedModel()
+    texts = ["a", "dddd", "bb", "eeeee", "ccc"]
+    stats = EmbeddingStats()
+    embeddings = embed_in_batches(texts, model, batch_size=2, stats=stats)
+    assert model.calls == [["eeeee", "dddd"], ["ccc", "bb"], ["a"]]
+    assert [embedding[0] for embedding in embeddings] == [1.0, 4.0, 2.0, 5.0, 3.0]
+    assert stats.chunks == 5
+    assert stats.batches == 3
+    assert "文字/秒" in stats.summary()
+
+def test_count_tokens_uses_model_tokenizer():
+    """モデルのトークナイザーで最大長までのトークン数を数えることをテストする"""
+    model = CountingEmbedModel()
+    assert count_tokens(model, ["abc"]) is None
+    model._model = FakeSentenceTransformer()
+    assert count_tokens(model, ["a", "abcdef"]) == 3 + 5
+    stats = EmbeddingStats()
+    embed_in_batches(["a", "abcdef"], model, batch_size=8, stats=stats)
+    assert stats.tokens == 8
+    assert "トークン/秒" in stats.summary()
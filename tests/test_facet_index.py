@@ -0,0 +1,86 @@
+from src.utils.facet_index import FacetIndex, normalize_filters, facet_index_exists
+from src.utils.sparse_index import SparseIndex
+from src.utils.vector_store import faiss_search
+import faiss
+import numpy as np
+import pytest
+
+ROOT = '/data/pdfs'
+
+def make_facet_index():
+    metadatas = [
+        {'file_path': f'{ROOT}/衛星/軌道.pdf', 'folder': f'{ROOT}/衛星', 'last_modified_date': '2024-01-10'},
+        {'file_path': f'{ROOT}/衛星/軌道.pdf', 'folder': f'{ROOT}/衛星', 'last_modified_date': '2024-01-10'},
+        {'file_path': f'{ROOT}/衛星/古い/電源.pdf', 'folder': f'{ROOT}/衛星/古い', 'last_modified_date': '2022-05-01'},
+        {'file_path': f'{ROOT}/ロケット/エンジン.pdf', 'folder': f'{ROOT}/ロケット', 'last_modified_date': '2023-08-20'},
+        {'file_path': f'{ROOT}/ロケット/manual.PDF', 'folder': f'{ROOT}/ロケット'},
+    ]
+    node_ids = [f'node-{i}' for i in range(len(metadatas))]
+    return FacetIndex.build(node_ids, metadatas, [10, 11, 12, 13, -1], root_dir=ROOT)
+
+def test_normalize_filters():
+    """絞り込み条件の正規化と不正な条件のエラーをテストする"""
+    assert normalize_filters(None) is None
+    assert normalize_filters({'folders': [], 'files': None}) is None
+    filters = normalize_filters({'folders': '衛星/', 'date_from': '2024-01-01'})
+    assert filters['folders'] == ('衛星',)
+    assert isinstance(filters['date_from'], int)
+    with pytest.raises(ValueError):
+        normalize_filters({'folder': ['衛星']})
+    with pytest.raises(ValueError):
+        normalize_filters({'date_from': '2024/01/01'})
+    with pytest.raises(ValueError):
+        normalize_filters({'date_from': '2024-02-01', 'date_to': '2024-01-01'})
+
+def test_facet_index_mask():
+    """フォルダ（配下を含む）・ファイル名・日付の条件で絞り込めることをテストする"""
+    facet_index = make_facet_index()
+
+    def matched(**filters):
+        mask = facet_index.mask(normalize_filters(filters))
+        return [i for i, selected in enumerate(mask) if selected]
+
+    assert matched(folders=['衛星']) == [0, 1, 2]
+    assert matched(folders=['衛星/古い']) == [2]
+    assert matched(folders=['古い', 'ロケット']) == [2, 3, 4]
+    assert matched(files=['manual']) == [4]
+    assert matched(files=['*.pdf'], folders=['ロケット']) == [3, 4]
+    assert matched(date_from='2023-01-01') == [0, 1, 3]
+    assert matched(date_to='2023-12-31') == [2, 3]
+    assert matched(folders=['存在しない']) == []
+
+def test_facet_index_faiss_bitmap_and_search():
+    """FAISS IDのビットマップで、絞り込んだベクトルだけを検索できることをテストする"""
+    facet_index = make_facet_index()
+    bitmap, count = facet_index.faiss_bitmap(normalize_filters({'folders': ['衛星']}))
+    assert count == 3
+    assert np.unpackbits(bitmap, bitorder='little')[10:14].tolist() == [1, 1, 1, 0]
+
+    vectors = np.eye(4, dtype='float32')
+    faiss_index = faiss.IndexIDMap2(faiss.IndexFlatIP(4))
+    faiss_index.add_with_ids(vectors, np.arange(10, 14, dtype=np.int64))
+    # 最も近いベクトル（ID 13）は対象外のため、絞り込んだ中で検索される
+    _, ids = faiss_search(faiss_index, np.array([[0.5, 0.2, 0.0, 1.0]], dtype='float32'), 2, (bitmap, count))
+    assert ids[0].tolist() == [10, 11]
+
+    _, ids = faiss_search(faiss_index, vectors[:1], 2, facet_index.faiss_bitmap(normalize_filters({'folders': ['なし']})))
+    assert ids[0].tolist() == [-1, -1]
+
+def test_sparse_index_allowed():
+    """BM25の検索で対象外の文書がスコアの計算から除かれることをテストする"""
+    sparse_index = SparseIndex.build(['a', 'b', 'c'], ['人工衛星の軌道', '人工衛星の電源', 'ロケット'])
+    assert {node_id for node_id, _ in sparse_index.search('人工衛星', 3)} == {'a', 'b'}
+    allowed = np.array([False, True, True])
+    assert [node_id for node_id, _ in sparse_index.search('人工衛星', 3, allowed)] == ['b']
+
+def test_facet_index_save_load(tmp_path):
+    """保存した索引を読み込んで同じ結果になることをテストする"""
+    facet_index = make_facet_index()
+    assert not facet_index_exists(tmp_path)
+    facet_index.save(tmp_path)
+    assert facet_index_exists(tmp_path)
+    loaded = FacetIndex.load(tmp_path)
+    filters = normalize_filters({'folders': ['衛星'], 'date_from': '2024-01-01'})
+    assert loaded.mask(filters).tolist() == facet_index.mask(filters).tolist()
+    assert loaded.facets() == facet_index.facets()
+    assert loaded.facets()['folders'] == {'衛星': 2, '衛星/古い': 1, 'ロケット': 2}
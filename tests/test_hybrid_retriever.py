@@ -0,0 +1,36 @@
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, TextNode
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from src.utils.sparse_index import SparseIndex
+from src.utils.hybrid_retriever import HybridRetriever, reciprocal_rank_fusion
+
+class FakeDenseRetriever(BaseRetriever):
+    def __init__(self, nodes):
+        super().__init__()
+        self.nodes = nodes
+
+    def _retrieve(self, query_bundle):
+        return [NodeWithScore(node=node, score=0.5) for node in self.nodes]
+
+def test_reciprocal_rank_fusion():
+    """両方の結果に含まれるノードが上位になり、重みが反映されることをテストする"""
+    fused = reciprocal_rank_fusion([['a', 'b'], ['b', 'c']], [1.0, 1.0], rrf_k=60)
+    assert [node_id for node_id, _ in fused] == ['b', 'a', 'c']
+    fused = reciprocal_rank_fusion([['a', 'b'], ['b', 'c']], [0.0, 1.0], rrf_k=60)
+    assert fused[0][0] == 'b'
+
+def test_hybrid_retriever_adds_keyword_matches():
+    """ベクトル検索で見つからない完全一致のノードがBM25から補われることをテストする"""
+    nodes = [
+        TextNode(id_='n0', text='人工衛星の軌道'),
+        TextNode(id_='n1', text='AVHRR-3 の校正手順'),
+        TextNode(id_='n2', text='植生指数の計算'),
+    ]
+    docstore = SimpleDocumentStore()
+    docstore.add_documents(nodes)
+    sparse_index = SparseIndex.build([node.node_id for node in nodes], [node.text for node in nodes])
+    retriever = HybridRetriever(FakeDenseRetriever([nodes[0], nodes[2]]), sparse_index, docstore, similarity_top_k=2)
+
+    results = retriever.retrieve('AVHRR-3')
+    assert [result.node.node_id for result in results] == ['n0', 'n1']
+    assert results[1].node.text == 'AVHRR-3 の校正手順'
@@ -0,0 +1,48 @@
+from src.utils.index_watcher import IndexWatcher
+from src.utils.manifest import new_manifest, save_manifest, version_dir, publish_index_version
+import os
+
+def publish(index_dir, index_version):
+    manifest = new_manifest()
+    manifest['index_version'] = index_version
+    os.makedirs(version_dir(index_dir, index_version))
+    save_manifest(version_dir(index_dir, index_version), manifest)
+    publish_index_version(index_dir, index_version)
+
+def test_index_watcher_reloads_new_version(tmp_path):
+    """新しいバージョンが公開された場合のみreloadを呼ぶことをテストする"""
+    index_dir = str(tmp_path)
+    publish(index_dir, 'v1')
+    state = {'version': 'v1'}
+    watcher = IndexWatcher(lambda: state['version'], lambda version: state.update(version=version), index_dir)
+    assert not watcher.check()
+    publish(index_dir, 'v2')
+    assert watcher.check()
+    assert state['version'] == 'v2' and watcher.reloads == 1
+    assert not watcher.check()
+
+def test_index_watcher_does_not_retry_failed_version(tmp_path):
+    """ロードに失敗したバージョンは再試行せず、次のバージョンはロードすることをテストする"""
+    index_dir = str(tmp_path)
+    publish(index_dir, 'v1')
+    calls = []
+
+    def reload(version):
+        calls.append(version)
+        if version == 'v2':
+            raise RuntimeError('壊れたインデックス')
+
+    watcher = IndexWatcher(lambda: 'v1', reload, index_dir)
+    publish(index_dir, 'v2')
+    assert not watcher.check() and not watcher.check()
+    assert calls == ['v2'] and watcher.stats()['failed_version'] == 'v2'
+    publish(index_dir, 'v3')
+    assert watcher.check()
+    assert calls == ['v2', 'v3'] and watcher.stats()['last_error'] is None
+
+def test_index_watcher_waits_for_initial_load(tmp_path):
+    """使用中のインデックスがまだない場合はロードしないことをテストする"""
+    index_dir = str(tmp_path)
+    publish(index_dir, 'v1')
+    watcher = IndexWatcher(lambda: None, lambda version: None, index_dir)
+    assert not watcher.check()
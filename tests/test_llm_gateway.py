@@ -0,0 +1,164 @@
+from llama_index.core.llms import MockLLM, ChatMessage
+from src.utils.llm_gateway import LLMGateway, GatedLLM, GatedStream, LLMOverloadedError, LLMCancelledError
+import asyncio
+import pytest
+import threading
+import time
+
+MESSAGES = [ChatMessage(role='user', content='人工衛星の軌道について教えてください')]
+
+class FakeStream:
+    def __init__(self, count):
+        self.items = iter(range(count))
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.items)
+
+    def close(self):
+        self.closed = True
+
+def test_gateway_limits_concurrency():
+    """同時実行数の上限を超えないことをテストする"""
+    gateway = LLMGateway(max_concurrency=2, max_queue=10)
+    lock = threading.Lock()
+    active = []
+    peak = []
+
+    def work():
+        with gateway.slot():
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.05)
+            with lock:
+                active.pop()
+
+    threads = [threading.Thread(target=work) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = gateway.stats()
+    assert max(peak) == 2
+    assert stats['completed'] == 6
+    assert stats['max_queued'] >= 1
+    assert stats['in_flight'] == 0 and stats['queued'] == 0
+
+def test_gateway_rejects_when_queue_full():
+    """待ち行列が一杯の場合はすぐにエラーになることをテストする"""
+    gateway = LLMGateway(max_concurrency=1, max_queue=0)
+    gateway.acquire()
+    with pytest.raises(LLMOverloadedError):
+        gateway.acquire()
+    gateway.release()
+    gateway.acquire()
+    assert gateway.stats()['rejected'] == 1
+
+def test_gateway_queue_timeout():
+    """待ち時間の上限を超えるとエラーになることをテストする"""
+    gateway = LLMGateway(max_concurrency=1, max_queue=1, queue_timeout=0.1, poll_interval=0.01)
+    gateway.acquire()
+    with pytest.raises(LLMOverloadedError):
+        gateway.acquire()
+    stats = gateway.stats()
+    assert stats['timed_out'] == 1
+    assert stats['queued'] == 0
+
+def test_gateway_cancel_while_queued():
+    """順番待ちの間に中止できることをテストする"""
+    gateway = LLMGateway(max_concurrency=1, max_queue=1, poll_interval=0.01)
+    gateway.acquire()
+    cancel_event = threading.Event()
+    cancel_event.set()
+    with pytest.raises(LLMCancelledError):
+        gateway.acquire(cancel_event)
+    assert gateway.stats()['cancelled'] == 1
+
+def test_gateway_serves_waiters_in_order():
+    """実行枠が空いたとき、後から来たリクエストより先に待機中のリクエストが実行されることをテストする"""
+    gateway = LLMGateway(max_concurrency=1, max_queue=5, queue_timeout=5, poll_interval=0.01)
+    order = []
+
+    def work(name):
+        with gateway.slot():
+            order.append(name)
+
+    gateway.acquire()
+    waiter = threading.Thread(target=work, args=('queued',))
+    waiter.start()
+    while gateway.stats()['queued'] == 0:
+        time.sleep(0.001)
+    # 待機中のスレッドが起きる前に、後から来たリクエストが空いた実行枠を取りに行く
+    with gateway._condition:
+        gateway.release()
+        work('later')
+    waiter.join()
+    assert order == ['queued', 'later']
+    assert gateway.stats()['in_flight'] == 0 and gateway.stats()['queued'] == 0
+
+def test_gateway_async_slot():
+    """asyncioのタスクからも同時実行数が制限されることをテストする"""
+    gateway = LLMGateway(max_concurrency=1, max_queue=5, poll_interval=0.01)
+    active = []
+    peak = []
+
+    async def work():
+        async with gateway.aslot():
+            active.append(1)
+            peak.append(len(active))
+            await asyncio.sleep(0.02)
+            active.pop()
+
+    async def run():
+        await asyncio.gather(*[work() for _ in range(3)])
+
+    asyncio.run(run())
+    assert max(peak) == 1
+    assert gateway.stats()['completed'] == 3
+
+def test_gated_stream_cancel_closes_stream():
+    """中止するとストリームが閉じられ、実行枠が返されることをテストする"""
+    gateway = LLMGateway(max_concurrency=1, max_queue=0)
+    gateway.acquire()
+    cancel_event = threading.Event()
+    stream = FakeStream(10)
+    gated = GatedStream(gateway, stream, cancel_event)
+    assert next(gated) == 0
+    cancel_event.set()
+    assert list(gated) == []
+    assert stream.closed
+    stats = gateway.stats()
+    assert stats['in_flight'] == 0
+    assert stats['cancelled'] == 1
+
+def test_gated_llm_stream_holds_slot_until_finished():
+    """ストリーミング中は実行枠を保持し、読み終えると返すことをテストする"""
+    gateway = LLMGateway(max_concurrency=1, max_queue=0)
+    llm = GatedLLM(MockLLM(max_tokens=3), gateway)
+    stream = llm.stream_chat(MESSAGES)
+    assert gateway.stats()['in_flight'] == 1
+    with pytest.raises(LLMOverloadedError):
+        llm.chat(MESSAGES)
+    assert len(list(stream)) == 3
+    assert gateway.stats()['in_flight'] == 0
+    assert llm.chat(MESSAGES).message.content
+
+def test_gated_llm_reservation():
+    """reserve()で確保した実行枠が次の生成で使われ、使われなければ返されることをテストする"""
+    gateway = LLMGateway(max_concurrency=1, max_queue=0)
+    llm = GatedLLM(MockLLM(max_tokens=3), gateway).for_request()
+    llm.reserve()
+    assert gateway.stats()['in_flight'] == 1
+    # 確保済みの実行枠を使うため、待ち行列がなくても拒否されない
+    llm.chat(MESSAGES)
+    assert gateway.stats()['in_flight'] == 0
+
+    llm.reserve()
+    llm.release_reservation()
+    llm.release_reservation()
+    assert gateway.stats()['in_flight'] == 0
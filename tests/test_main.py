@@ -0,0 +1,55 @@
+import os
+from llama_index.core import Document
+from llama_index.core.embeddings import MockEmbedding
+from src.utils.chunking import create_node_parser
+from src.utils.manifest import scan_pdf_files, new_manifest, diff_manifest, update_manifest
+from src.config import EMBED_DIM
+import src.main as main_module
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+def test_failed_file_is_retried_on_next_run(tmp_path, monkeypatch):
+    """読み込みに失敗したファイルはマニフェストに記録されず、次回の実行で再び読み込まれることをテストする"""
+    write_file(str(tmp_path / 'a' / 'good.pdf'), b'good')
+    write_file(str(tmp_path / 'a' / 'bad.pdf'), b'bad')
+    good_path = str(tmp_path / 'a' / 'good.pdf')
+
+    def fake_load_documents(input_files, num_workers):
+        # bad.pdfは解析に失敗したものとしてドキュメントを返さない
+        return [
+            Document(id_=path, text='人工衛星の軌道について説明します。', metadata={'file_path': path})
+            for path in input_files if path == good_path
+        ]
+
+    monkeypatch.setattr(main_module, 'load_documents', fake_load_documents)
+    added, _, _, _ = diff_manifest(None, scan_pdf_files(str(tmp_path)))
+    nodes, documents, loaded_entries = main_module.prepare_nodes(added, 1, create_node_parser())
+    assert [entry['path'] for entry in loaded_entries] == [good_path]
+    manifest = update_manifest(new_manifest(), loaded_entries, main_module.group_ref_doc_ids_by_file(nodes))
+
+    added, changed, removed, unchanged = diff_manifest(manifest, scan_pdf_files(str(tmp_path)))
+    assert [os.path.basename(entry['path']) for entry in added] == ['bad.pdf']
+    assert [entry['path'] for entry in unchanged] == [good_path]
+
+def test_embed_model_is_created_after_loading(tmp_path, monkeypatch):
+    """エンベディングモデルはPDFの読み込み（ワーカープロセスのfork）が終わってから初期化されることをテストする"""
+    write_file(str(tmp_path / 'a' / 'good.pdf'), b'good')
+    calls = []
+
+    def fake_load_documents(input_files, num_workers):
+        calls.append('load_documents')
+        return [Document(id_=path, text='人工衛星の軌道について説明します。', metadata={'file_path': path})
+                for path in input_files]
+
+    def load_embed_model():
+        calls.append('embed_model')
+        return MockEmbedding(embed_dim=EMBED_DIM)
+
+    monkeypatch.setattr(main_module, 'load_documents', fake_load_documents)
+    added, _, _, _ = diff_manifest(None, scan_pdf_files(str(tmp_path)))
+    index, manifest = main_module.build_full_index(added, load_embed_model, 1, create_node_parser(), quantization='none')
+    assert calls == ['load_documents', 'embed_model']
+    assert index is not None and len(manifest['files']) == 1
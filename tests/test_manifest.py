@@ -0,0 +1,107 @@
+import os
+import pytest
+from src.utils.manifest import (
+    scan_pdf_files, load_manifest, save_manifest, new_manifest, diff_manifest, update_manifest,
+    current_index_dir, version_dir, publish_index_version, remove_old_versions, get_index_version
+)
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+@pytest.fixture
+def pdf_dir(tmp_path):
+    write_file(str(tmp_path / 'a' / 'doc1.pdf'), b'doc1')
+    write_file(str(tmp_path / 'a' / 'doc2.pdf'), b'doc2')
+    write_file(str(tmp_path / 'b' / 'note.txt'), b'not a pdf')
+    write_file(str(tmp_path / '.hidden' / 'doc3.pdf'), b'hidden')
+    return tmp_path
+
+def test_scan_pdf_files(pdf_dir):
+    """PDFファイルのみが列挙されることをテストする"""
+    files = scan_pdf_files(str(pdf_dir))
+    assert [os.path.basename(f) for f in files] == ['doc1.pdf', 'doc2.pdf']
+
+def test_diff_manifest_without_manifest(pdf_dir):
+    """マニフェストがない場合は全て追加扱いになることをテストする"""
+    files = scan_pdf_files(str(pdf_dir))
+    added, changed, removed, unchanged = diff_manifest(None, files)
+    assert len(added) == 2
+    assert changed == removed == unchanged == []
+    assert all(len(entry['sha256']) == 64 for entry in added)
+
+def test_diff_manifest_detects_changes(pdf_dir):
+    """追加・変更・削除・未変更が正しく分類されることをテストする"""
+    files = scan_pdf_files(str(pdf_dir))
+    added, _, _, _ = diff_manifest(None, files)
+    manifest = update_manifest(new_manifest(), added, {files[0]: ['id1'], files[1]: ['id2']})
+
+    # doc1を変更、doc2を削除、doc4を追加
+    write_file(files[0], b'doc1 changed')
+    os.remove(files[1])
+    new_file = str(pdf_dir / 'b' / 'doc4.pdf')
+    write_file(new_file, b'doc4')
+
+    added, changed, removed, unchanged = diff_manifest(manifest, scan_pdf_files(str(pdf_dir)))
+    assert [entry['path'] for entry in added] == [new_file]
+    assert [entry['path'] for entry in changed] == [files[0]]
+    assert removed == [files[1]]
+    assert unchanged == []
+
+def test_diff_manifest_touched_file_is_unchanged(pdf_dir):
+    """更新時刻のみ変わったファイルは未変更として扱われることをテストする"""
+    files = scan_pdf_files(str(pdf_dir))
+    added, _, _, _ = diff_manifest(None, files)
+    manifest = update_manifest(new_manifest(), added)
+
+    stat = os.stat(files[0])
+    os.utime(files[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    added, changed, removed, unchanged = diff_manifest(manifest, files)
+    assert added == changed == removed == []
+    assert len(unchanged) == 2
+
+def test_save_and_load_manifest(tmp_path):
+    """マニフェストの保存と読み込みをテストする"""
+    manifest = new_manifest()
+    manifest['files']['/x.pdf'] = {'size': 1, 'mtime_ns': 2, 'sha256': 'abc', 'doc_ids': ['d']}
+    save_manifest(str(tmp_path), manifest)
+    assert load_manifest(str(tmp_path)) == manifest
+
+def test_load_manifest_missing(tmp_path):
+    """マニフェストが存在しない場合はNoneを返すことをテストする"""
+    assert load_manifest(str(tmp_path)) is None
+
+def save_version(index_dir, index_version):
+    manifest = new_manifest()
+    manifest['index_version'] = index_version
+    os.makedirs(version_dir(index_dir, index_version))
+    save_manifest(version_dir(index_dir, index_version), manifest)
+
+def test_publish_index_version(tmp_path):
+    """CURRENTを置き換えると公開中のディレクトリとバージョンが切り替わることをテストする"""
+    index_dir = str(tmp_path)
+    # CURRENTがない旧形式ではINDEX_DIR自体を使う
+    assert current_index_dir(index_dir) == index_dir
+    save_version(index_dir, '20240101000000-a')
+    assert get_index_version(index_dir) is None
+    publish_index_version(index_dir, '20240101000000-a')
+    assert current_index_dir(index_dir) == version_dir(index_dir, '20240101000000-a')
+    assert get_index_version(index_dir) == '20240101000000-a'
+    save_version(index_dir, '20240102000000-b')
+    publish_index_version(index_dir, '20240102000000-b')
+    assert get_index_version(index_dir) == '20240102000000-b'
+    assert not os.path.exists(os.path.join(index_dir, 'CURRENT.tmp'))
+
+def test_remove_old_versions_keeps_current(tmp_path):
+    """新しい順にkeep個と公開中のバージョンを残して削除することをテストする"""
+    index_dir = str(tmp_path)
+    for index_version in ('20240101000000-a', '20240102000000-b', '20240103000000-c', '20240104000000-d'):
+        save_version(index_dir, index_version)
+    # 最新のdは保存途中で公開されていない
+    publish_index_version(index_dir, '20240102000000-b')
+    assert remove_old_versions(index_dir, 2) == ['20240101000000-a']
+    assert sorted(os.listdir(os.path.join(index_dir, 'versions'))) == [
+        '20240102000000-b', '20240103000000-c', '20240104000000-d'
+    ]
@@ -48,4 +48,15 @@ def test_add_folder_metadata_missing_file_path():
     
     # 実行とアサート
     with pytest.raises(KeyError):
-        add_folder_metadata(docs)
\ No newline at end of file
+        add_folder_metadata(docs)
+
+def test_add_folder_metadata_excludes_paths_from_embedding():
+    """パス情報がエンベディング対象から除外されることをテストする"""
+    from llama_index.core import Document
+    from llama_index.core.schema import MetadataMode
+    doc = Document(text="本文", metadata={'file_path': '/path/to/file.pdf'})
+
+    add_folder_metadata([doc])
+
+    assert doc.get_content(metadata_mode=MetadataMode.EMBED) == "本文"
+    assert '/path/to' in doc.get_content(metadata_mode=MetadataMode.LLM)
@@ -0,0 +1,168 @@
+import threading
+import faiss
+import pytest
+from llama_index.core import StorageContext, VectorStoreIndex
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.schema import TextNode
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from src.utils.facet_index import FacetIndex, normalize_filters
+from src.utils.query_cache import LRUCache, QueryCache, CachedRetriever, create_cached_retriever
+from src.utils.vector_store import IdMapFaissVectorStore
+from conftest import FakeRetriever
+
+class CountingEmbedModel:
+    def __init__(self):
+        self.calls = 0
+
+    def get_query_embedding(self, query_str):
+        self.calls += 1
+        return [float(len(query_str)), 1.0]
+
+class KeywordEmbedding(MockEmbedding):
+    """キーワードの出現回数をベクトルにするエンベディング"""
+
+    def _get_vector(self, text):
+        return [float(text.count(word)) + 0.01 for word in ('衛星', 'センサー', '軌道', '画像')]
+
+    def _get_query_embedding(self, query):
+        return self._get_vector(query)
+
+    def _get_text_embedding(self, text):
+        return self._get_vector(text)
+
+def make_retriever(index_version='v1', similarity_cutoff=None, query_cache=None):
+    nodes = [(TextNode(id_='n1', text='衛星'), 0.9), (TextNode(id_='n2', text='センサー'), 0.5)]
+    docstore = SimpleDocumentStore()
+    docstore.add_documents([node for node, _ in nodes])
+    inner = FakeRetriever(nodes)
+    embed_model = CountingEmbedModel()
+    retriever = CachedRetriever(
+        inner, embed_model, docstore, query_cache or QueryCache(), index_version,
+        similarity_top_k=2, similarity_cutoff=similarity_cutoff
+    )
+    return retriever, inner, embed_model
+
+def test_lru_cache_eviction_and_stats():
+    """LRUキャッシュの上限と統計情報をテストする"""
+    cache = LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+    stats = cache.stats()
+    assert stats['hits'] == 2
+    assert stats['misses'] == 1
+    assert stats['size'] == 2
+
+def test_lru_cache_thread_safety():
+    """複数スレッドから同時に使用できることをテストする"""
+    cache = LRUCache(maxsize=50)
+
+    def worker(offset):
+        for i in range(500):
+            cache.put((offset, i % 100), i)
+            cache.get((offset, (i * 7) % 100))
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(cache) == 50
+    assert cache.hits + cache.misses == 8 * 500
+
+def test_cached_retriever_reuses_results():
+    """同じ質問では埋め込みと検索が再実行されないことをテストする"""
+    retriever, inner, embed_model = make_retriever()
+    first = retriever.retrieve("衛星について")
+    second = retriever.retrieve("  衛星について ")
+    assert [n.node.node_id for n in first] == [n.node.node_id for n in second] == ['n1', 'n2']
+    assert [n.score for n in second] == [0.9, 0.5]
+    assert inner.retrieve_calls == 1
+    assert embed_model.calls == 1
+
+def test_cached_retriever_applies_cutoff():
+    """類似度の閾値未満のノードが除外されることをテストする"""
+    retriever, _, _ = make_retriever(similarity_cutoff=0.7)
+    assert [n.node.node_id for n in retriever.retrieve("衛星")] == ['n1']
+
+def test_cached_retriever_invalidated_by_index_version():
+    """インデックスのバージョンが変わると検索結果が再計算されることをテストする"""
+    query_cache = QueryCache()
+    old_retriever, old_inner, _ = make_retriever('v1', query_cache=query_cache)
+    old_retriever.retrieve("衛星")
+    new_retriever, new_inner, new_embed_model = make_retriever('v2', query_cache=query_cache)
+    new_retriever.retrieve("衛星")
+    assert new_inner.retrieve_calls == 1
+    # クエリのエンベディングはバージョンに依存しないため再利用される
+    assert new_embed_model.calls == 0
+
+def test_retrieve_batch_matches_single_queries():
+    """まとめて検索した結果が1件ずつの検索結果と一致することをテストする"""
+    embed_model = KeywordEmbedding(embed_dim=4)
+    texts = ['衛星 衛星', 'センサー', '軌道 軌道 衛星', '画像']
+    nodes = [TextNode(id_=f'n{i}', text=text) for i, text in enumerate(texts)]
+    vector_store = IdMapFaissVectorStore(faiss_index=faiss.IndexIDMap2(faiss.IndexFlatIP(4)))
+    storage_context = StorageContext.from_defaults(vector_store=vector_store)
+    index = VectorStoreIndex(nodes, storage_context=storage_context, embed_model=embed_model)
+
+    queries = ['衛星', '画像', '軌道']
+    query_cache = QueryCache()
+    retriever = create_cached_retriever(index, query_cache, 'v1', similarity_top_k=2)
+    batch_results = retriever.retrieve_batch(queries)
+
+    single_retriever = create_cached_retriever(index, QueryCache(), 'v1', similarity_top_k=2)
+    for query_str, results in zip(queries, batch_results):
+        expected = single_retriever.retrieve(query_str)
+        assert [r.node.node_id for r in results] == [r.node.node_id for r in expected]
+        assert [r.score for r in results] == pytest.approx([r.score for r in expected])
+
+    # まとめて検索した結果は1件ずつの検索でもキャッシュから返される
+    retriever.retrieve('衛星')
+    assert query_cache.retrievals.stats()['hits'] == 1
+
+def test_retrieve_batch_skips_missing_nodes():
+    """docstoreにないノードを除いても、残りのノードのスコアがずれないことをテストする"""
+    embed_model = KeywordEmbedding(embed_dim=4)
+    texts = ['衛星 衛星', 'センサー', '軌道 軌道 衛星', '画像']
+    nodes = [TextNode(id_=f'n{i}', text=text) for i, text in enumerate(texts)]
+    vector_store = IdMapFaissVectorStore(faiss_index=faiss.IndexIDMap2(faiss.IndexFlatIP(4)))
+    storage_context = StorageContext.from_defaults(vector_store=vector_store)
+    index = VectorStoreIndex(nodes, storage_context=storage_context, embed_model=embed_model)
+    expected = create_cached_retriever(index, QueryCache(), 'v1', similarity_top_k=3).retrieve_batch(['衛星'])[0]
+    assert expected[0].node.node_id == 'n0'
+
+    index.docstore.delete_document('n0')
+    results = create_cached_retriever(index, QueryCache(), 'v1', similarity_top_k=3).retrieve_batch(['衛星'])[0]
+    assert [r.node.node_id for r in results] == [r.node.node_id for r in expected[1:]]
+    assert [r.score for r in results] == pytest.approx([r.score for r in expected[1:]])
+
+def test_filtered_search_skips_missing_nodes():
+    """絞り込み検索でもdocstoreにないノードを除き、残りのノードのスコアがずれないことをテストする"""
+    embed_model = KeywordEmbedding(embed_dim=4)
+    texts = ['衛星 衛星', 'センサー', '軌道 軌道 衛星', '画像']
+    nodes = [
+        TextNode(id_=f'n{i}', text=text, metadata={'file_path': f'/data/pdfs/a/{i}.pdf', 'folder': '/data/pdfs/a'})
+        for i, text in enumerate(texts)
+    ]
+    vector_store = IdMapFaissVectorStore(faiss_index=faiss.IndexIDMap2(faiss.IndexFlatIP(4)))
+    storage_context = StorageContext.from_defaults(vector_store=vector_store)
+    index = VectorStoreIndex(nodes, storage_context=storage_context, embed_model=embed_model)
+    node_ids = [node.node_id for node in nodes]
+    facet_index = FacetIndex.build(
+        node_ids, [node.metadata for node in nodes], vector_store.faiss_ids(node_ids), root_dir='/data/pdfs'
+    )
+    filters = normalize_filters({'folders': ['a']})
+    expected = create_cached_retriever(
+        index, QueryCache(), 'v1', similarity_top_k=3, facet_index=facet_index
+    ).with_filters(filters).retrieve('衛星')
+    assert expected[0].node.node_id == 'n0'
+
+    index.docstore.delete_document('n0')
+    results = create_cached_retriever(
+        index, QueryCache(), 'v1', similarity_top_k=3, facet_index=facet_index
+    ).with_filters(filters).retrieve('衛星')
+    assert [r.node.node_id for r in results] == [r.node.node_id for r in expected[1:]]
+    assert [r.score for r in results] == pytest.approx([r.score for r in expected[1:]])
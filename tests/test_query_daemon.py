@@ -0,0 +1,84 @@
+from llama_index.core.llms import MockLLM
+from llama_index.core.schema import TextNode
+from src.query_daemon import QueryDaemon, create_app
+from src.utils.daemon_client import DaemonError, connect_daemon
+from src.utils.manifest import save_manifest, new_manifest
+from src.utils.query_pipeline import QueryPipeline
+from werkzeug.serving import make_server
+from conftest import FakeRetriever
+import threading
+import pytest
+
+def make_daemon():
+    created = []
+
+    def factory(index, index_dir, query_cache, profile, options):
+        created.append((profile, options))
+        node = TextNode(id_='n1', text='人工衛星の軌道について', metadata={'file_path': '/data/pdfs/a/orbit.pdf'})
+        return QueryPipeline(retriever=FakeRetriever([(node, 0.9)]), llm=MockLLM())
+
+    return QueryDaemon(index=None, index_version='v1', pipeline_factory=factory), created
+
+def test_daemon_sessions_share_pipelines():
+    """同じ設定のセッションはパイプラインを共有し、会話履歴はセッションごとに保持することをテストする"""
+    daemon, created = make_daemon()
+    client = create_app(daemon).test_client()
+
+    first = client.post('/api/sessions', json={'profile': 'advanced', 'options': {'top_k': 5}}).get_json()['session_id']
+    second = client.post('/api/sessions', json={'profile': 'advanced', 'options': {'top_k': 5}}).get_json()['session_id']
+    assert first != second
+    assert len(created) == 1 and created[0][1]['top_k'] == 5 and created[0][1]['cutoff'] == 0.7
+
+    result = client.post(f'/api/sessions/{first}/chat', json={'message': '軌道とは？'}).get_json()
+    assert result['response'] and result['cached'] is False
+    assert result['source_nodes'][0]['metadata']['file_path'] == '/data/pdfs/a/orbit.pdf'
+    assert list(result['timings'])[:2] == ['embed', 'search']
+    assert len(daemon.sessions.get(first)['memory'].get_all()) == 2
+    assert daemon.sessions.get(second)['memory'].get_all() == []
+
+    assert client.delete(f'/api/sessions/{first}').get_json() == {'closed': True}
+    assert client.post(f'/api/sessions/{first}/chat', json={'message': '軌道とは？'}).status_code == 404
+
+def test_daemon_rejects_invalid_sessions():
+    """未対応のprofile・オプションや、索引がない場合の絞り込みは400を返すことをテストする"""
+    daemon, _ = make_daemon()
+    client = create_app(daemon).test_client()
+    assert client.post('/api/sessions', json={'profile': 'unknown'}).status_code == 400
+    assert client.post('/api/sessions', json={'profile': 'advanced', 'options': {'foo': 1}}).status_code == 400
+    response = client.post('/api/sessions', json={'profile': 'interactive', 'filters': {'folders': ['a']}})
+    assert response.status_code == 400 and '絞り込み' in response.get_json()['error']
+    response = client.post('/api/sessions', json={'profile': 'advanced', 'filters': {'date_from': '2024-13-01'}})
+    assert response.status_code == 400
+
+def test_client_connects_only_to_matching_index(tmp_path, capsys):
+    """クライアントはインデックスのバージョンが同じデーモンにだけ接続し、結果をPipelineResultと同じ形で返すことをテストする"""
+    daemon, _ = make_daemon()
+    server = make_server('127.0.0.1', 0, create_app(daemon), threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f'http://127.0.0.1:{server.server_port}'
+    try:
+        manifest = new_manifest()
+        manifest['index_version'] = 'v1'
+        save_manifest(str(tmp_path), manifest)
+        client = connect_daemon(str(tmp_path), url)
+        assert client is not None
+
+        session = client.open_session('interactive')
+        result = session.chat('軌道とは？')
+        assert result.response and result.source_nodes[0].score == 0.9
+        assert 'query_embedding' in session.stats()
+        session.close()
+        with pytest.raises(DaemonError) as e:
+            session.chat('軌道とは？')
+        assert e.value.status == 404
+
+        manifest['index_version'] = 'v2'
+        save_manifest(str(tmp_path), manifest)
+        assert connect_daemon(str(tmp_path), url) is None
+        assert 'デーモンを再起動' in capsys.readouterr().out
+    finally:
+        server.shutdown()
+        thread.join()
+    # デーモンが停止していれば接続しない
+    assert connect_daemon(str(tmp_path), url) is None
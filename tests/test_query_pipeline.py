@@ -0,0 +1,49 @@
+from llama_index.core.llms import MockLLM
+from llama_index.core.memory import ChatMemoryBuffer
+from src.utils.query_pipeline import QueryPipeline, format_timings
+from src.utils.llm_gateway import LLMGateway, GatedLLM
+from conftest import FakeRetriever
+import threading
+
+def make_pipeline():
+    retriever = FakeRetriever()
+    return QueryPipeline(retriever=retriever, llm=MockLLM(), system_prompt="日本語で答えてください。"), retriever
+
+def test_chat_retrieves_once():
+    """回答生成までに検索が1回だけ行われることをテストする"""
+    pipeline, retriever = make_pipeline()
+    memory = ChatMemoryBuffer.from_defaults(token_limit=2048)
+    result = pipeline.chat("軌道とは？", memory)
+    assert retriever.retrieve_calls == 1
+    assert retriever.embed_calls == 1
+    # 検索には計算済みのエンベディングが渡される
+    assert retriever.last_embedding == [1.0, 0.0]
+    assert [node.node.node_id for node in result.source_nodes] == ['n1']
+    assert {'embed', 'search', 'llm'} <= set(result.timings)
+    # 会話履歴はメモリに保存される
+    assert len(memory.get_all()) == 2
+
+def test_stream_chat_records_llm_timings():
+    """ストリーミングでも検索は1回で、読み終えるとLLMの時間が記録されることをテストする"""
+    pipeline, retriever = make_pipeline()
+    memory = ChatMemoryBuffer.from_defaults(token_limit=2048)
+    result = pipeline.stream_chat("軌道とは？", memory)
+    text = "".join(result.response_gen)
+    assert text == result.response
+    assert retriever.retrieve_calls == 1
+    assert {'embed', 'search', 'first_token', 'llm'} <= set(result.timings)
+    assert "秒" in format_timings(result.timings)
+
+def test_stream_chat_close_cancels_generation():
+    """ストリーミングを途中で閉じると生成が中止され、実行枠が返されることをテストする"""
+    gateway = LLMGateway(max_concurrency=1, max_queue=0)
+    pipeline = QueryPipeline(retriever=FakeRetriever(), llm=GatedLLM(MockLLM(max_tokens=200), gateway))
+    memory = ChatMemoryBuffer.from_defaults(token_limit=2048)
+    cancel_event = threading.Event()
+    result = pipeline.stream_chat("軌道とは？", memory, cancel_event=cancel_event)
+    assert 'queue' in result.timings
+    tokens = result.response_gen
+    next(tokens)
+    tokens.close()
+    assert cancel_event.is_set()
+    assert gateway.stats()['in_flight'] == 0
@@ -0,0 +1,62 @@
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+from src.utils.reranker import CrossEncoderReranker
+import time
+
+class FakeCrossEncoder:
+    """テキストに含まれるクエリの文字数をスコアにするテスト用のクロスエンコーダー"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+
+    def predict(self, pairs, batch_size=32, show_progress_bar=False):
+        self.calls.append(len(pairs))
+        time.sleep(self.delay * len(pairs))
+        return [sum(1 for char in set(query) if char in text) / len(set(query)) for query, text in pairs]
+
+def make_nodes(texts):
+    return [
+        NodeWithScore(node=TextNode(text=text, id_=f"node-{i}"), score=1.0 - i * 0.1)
+        for i, text in enumerate(texts)
+    ]
+
+def test_reranker_reorders_nodes():
+    """クロスエンコーダーのスコア順に並べ替え、上位top_n件を返すことをテストする"""
+    reranker = CrossEncoderReranker(FakeCrossEncoder(), top_n=2, min_score=-1)
+    nodes = make_nodes(["関係のない文章", "衛星の話", "人工衛星の軌道"])
+    results = reranker.postprocess_nodes(nodes, query_bundle=QueryBundle("人工衛星の軌道"))
+    assert [result.node.node_id for result in results] == ["node-2", "node-1"]
+    assert results[0].score == 1.0
+
+def test_reranker_uses_cache():
+    """同じクエリとノードの組は採点し直さないことをテストする"""
+    model = FakeCrossEncoder()
+    reranker = CrossEncoderReranker(model, top_n=2, min_score=-1)
+    nodes = make_nodes(["関係のない文章", "衛星の話", "人工衛星の軌道"])
+    first = reranker.postprocess_nodes(nodes, query_bundle=QueryBundle("人工衛星の軌道"))
+    # 空白の違いは同じクエリとして扱う
+    second = reranker.postprocess_nodes(nodes, query_bundle=QueryBundle("人工衛星の軌道 "))
+    assert model.calls == [3]
+    assert [node.node.node_id for node in first] == [node.node.node_id for node in second]
+    assert reranker.cache.stats()["hits"] == 3
+
+def test_reranker_time_budget():
+    """時間の予算を超えた候補は採点せず、検索順位のまま補うことをテストする"""
+    model = FakeCrossEncoder(delay=0.01)
+    reranker = CrossEncoderReranker(model, top_n=3, batch_size=2, time_budget=0.03, min_score=-1)
+    texts = ["関係のない文章"] * 9 + ["人工衛星の軌道"]
+    results = reranker.postprocess_nodes(make_nodes(texts), query_bundle=QueryBundle("人工衛星の軌道"))
+    assert sum(model.calls) < len(texts)
+    assert len(results) == 3
+
+    # 1件あたりの採点時間がわかった後は、予算内に収まる件数だけを採点する
+    model.calls.clear()
+    reranker.postprocess_nodes(make_nodes(texts), query_bundle=QueryBundle("別の質問"))
+    assert sum(model.calls) <= reranker.max_candidates() < len(texts)
+
+def test_reranker_min_score():
+    """スコアがmin_score未満のノードを除くことをテストする"""
+    reranker = CrossEncoderReranker(FakeCrossEncoder(), top_n=2, min_score=0.5)
+    nodes = make_nodes(["関係のない文章", "人工衛星の軌道"])
+    results = reranker.postprocess_nodes(nodes, query_bundle=QueryBundle("人工衛星の軌道"))
+    assert [result.node.node_id for result in results] == ["node-1"]
@@ -0,0 +1,59 @@
+from src.utils.session_store import SessionStore
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_get_or_create_reuses_session():
+    """同じセッションIDでは同じオブジェクトが返されることをテストする"""
+    store = SessionStore(max_sessions=4, ttl_seconds=60)
+    first = store.get_or_create('a', object)
+    second = store.get_or_create('a', object)
+    assert first is second
+    assert len(store) == 1
+
+def test_lru_eviction():
+    """上限を超えると最も古いセッションが破棄されることをテストする"""
+    store = SessionStore(max_sessions=2, ttl_seconds=None)
+    store.get_or_create('a', object)
+    store.get_or_create('b', object)
+    store.get_or_create('a', object)  # aを最近使用にする
+    store.get_or_create('c', object)
+    assert 'a' in store
+    assert 'b' not in store
+    assert 'c' in store
+    assert store.evictions == 1
+
+def test_ttl_eviction():
+    """TTLを過ぎたセッションが破棄されることをテストする"""
+    clock = FakeClock()
+    store = SessionStore(max_sessions=10, ttl_seconds=30, clock=clock)
+    old = store.get_or_create('a', object)
+    clock.now = 20
+    store.get_or_create('b', object)
+    clock.now = 40
+    renewed = store.get_or_create('a', object)
+    assert renewed is not old
+    assert 'b' in store
+    assert store.evictions == 1
+
+def test_pop():
+    """セッションを明示的に破棄できることをテストする"""
+    store = SessionStore()
+    value = store.get_or_create('a', object)
+    assert store.pop('a') is value
+    assert store.pop('a') is None
+
+def test_get_existing_session():
+    """getは既存のセッションのみを返し、期限切れのセッションは返さないことをテストする"""
+    clock = FakeClock()
+    store = SessionStore(max_sessions=4, ttl_seconds=60, clock=clock)
+    value = store.get_or_create('a', object)
+    assert store.get('a') is value
+    assert store.get('b') is None
+    assert 'b' not in store
+    clock.now = 61
+    assert store.get('a') is None
@@ -0,0 +1,44 @@
+import numpy as np
+from src.utils.sparse_index import tokenize, SparseIndex, sparse_index_exists
+
+TEXTS = [
+    '人工衛星の軌道について説明します。',
+    'MODISセンサーで観測した海面温度の画像',
+    '軌道 軌道 衛星 AVHRR-3',
+    '植生指数の計算方法',
+]
+
+def make_index():
+    return SparseIndex.build([f'n{i}' for i in range(len(TEXTS))], TEXTS)
+
+def test_tokenize_japanese_and_model_numbers():
+    """日本語は文字bigram、英数字は語単位（全角・大文字も統一）で分割されることをテストする"""
+    assert tokenize('ＭＯＤＩＳセンサー') == ['modis', 'セン', 'ンサ', 'サー']
+    assert tokenize('AVHRR-3の年') == ['avhrr-3', 'の年']
+    assert tokenize('年') == ['年']
+
+def test_search_ranks_exact_matches():
+    """完全一致する型番や専門用語を含むノードが上位になることをテストする"""
+    index = make_index()
+    assert [node_id for node_id, _ in index.search('avhrr-3', 3)] == ['n2']
+    results = index.search('衛星の軌道', 2)
+    # 「星の」「の軌」まで一致するn0が、語の出現回数が多いn2より上位になる
+    assert [node_id for node_id, _ in results] == ['n0', 'n2']
+    assert results[0][1] >= results[1][1] > 0
+    assert index.search('存在しない語彙', 3) == []
+
+def test_postings_are_compact_arrays():
+    """ポスティングリストがnumpy配列で保持されることをテストする"""
+    index = make_index()
+    assert isinstance(index.postings, np.ndarray) and index.postings.dtype == np.int32
+    assert index.indptr[-1] == len(index.postings) == len(index.term_freqs)
+
+def test_save_and_load(tmp_path):
+    """保存・読み込み後も同じ検索結果になることをテストする"""
+    index = make_index()
+    assert not sparse_index_exists(str(tmp_path))
+    index.save(str(tmp_path))
+    assert sparse_index_exists(str(tmp_path))
+    loaded = SparseIndex.load(str(tmp_path))
+    assert loaded.node_ids == index.node_ids
+    assert loaded.search('MODIS 画像', 4) == index.search('MODIS 画像', 4)
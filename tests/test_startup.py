@@ -0,0 +1,47 @@
+from src.utils.startup import StartupReport, load_persisted_index
+import os
+import subprocess
+import sys
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+# エントリポイントを--helpで実行し、読み込まれた重いモジュールを出力するスクリプト
+HELP_SCRIPT = """
+import runpy, sys
+sys.argv = [sys.argv[1], '--help']
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+except SystemExit:
+    pass
+print('LOADED:' + ','.join(m for m in ('llama_index.core', 'faiss', 'torch') if m in sys.modules))
+"""
+
+def test_startup_report_summary():
+    """段階ごとの時間と計測していない時間が内訳に表示されることをテストする"""
+    report = StartupReport(start_time=time.perf_counter() - 0.5)
+    with report.stage('import'):
+        pass
+    with report.stage('embed_model'):
+        time.sleep(0.01)
+    summary = report.summary()
+    assert summary.startswith("起動時間: ")
+    assert "モジュールの読み込み" in summary and "エンベディングモデル" in summary and "その他" in summary
+    assert list(report.timings) == ['import', 'embed_model']
+
+def test_load_persisted_index_without_manifest(tmp_path, capsys):
+    """インデックスがない場合はモデルをロードせずにNoneを返すことをテストする"""
+    report = StartupReport()
+    assert load_persisted_index(str(tmp_path), report) is None
+    assert report.timings == {}
+    assert "main.py" in capsys.readouterr().out
+
+def test_cli_help_does_not_import_heavy_modules():
+    """CLIの--helpではllama_index・faiss・torchを読み込まないことをテストする"""
+    for script in ('advanced_rag.py', 'interactive_rag.py', 'batch_qa.py'):
+        result = subprocess.run(
+            [sys.executable, '-c', HELP_SCRIPT, os.path.join(SRC_DIR, script)],
+            capture_output=True, text=True, stdin=subprocess.DEVNULL, timeout=60,
+            env=dict(os.environ, PYTHONPATH=SRC_DIR, INDEX_DIR=os.path.join(SRC_DIR, 'no_such_index')),
+        )
+        assert 'LOADED:\n' in result.stdout, (script, result.stdout[-200:], result.stderr[-500:])
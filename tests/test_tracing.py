@@ -0,0 +1,112 @@
+from llama_index.core.base.llms.types import ChatMessage, CompletionResponse, LLMMetadata
+from llama_index.core.llms import CustomLLM
+from src.utils.llm_gateway import LLMGateway, GatedLLM
+# src内のモジュールと同じメトリクス・JSONログを参照するよう、src内と同じ名前でインポートする
+from utils.tracing import (
+    MetricsRegistry, metrics, span, record_span, current_span, configure_trace_log, llm_usage
+)
+import json
+import pytest
+import threading
+
+OLLAMA_RAW = {'prompt_eval_count': 120, 'eval_count': 40, 'eval_duration': 2_000_000_000}
+
+class UsageLLM(CustomLLM):
+    """Ollamaと同じ形式のトークン数をrawに含めて返すテスト用のLLM"""
+
+    @property
+    def metadata(self):
+        return LLMMetadata()
+
+    def complete(self, prompt, formatted=False, **kwargs):
+        return CompletionResponse(text="回答", raw=dict(OLLAMA_RAW))
+
+    def stream_complete(self, prompt, formatted=False, **kwargs):
+        def gen():
+            yield CompletionResponse(text="回", delta="回", raw={'eval_count': None})
+            yield CompletionResponse(text="回答", delta="答", raw=dict(OLLAMA_RAW))
+        return gen()
+
+@pytest.fixture
+def trace_records(tmp_path):
+    path = tmp_path / 'trace.jsonl'
+    metrics.clear()
+    configure_trace_log(str(path))
+    records = lambda: [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+    yield records
+    configure_trace_log('')
+    metrics.clear()
+
+def test_span_nesting_and_trace_log(trace_records):
+    """子のスパンが親と同じトレースIDで記録され、JSONログに属性が出力されることをテストする"""
+    with span('query') as query_span:
+        with span('retrieve', nodes=3):
+            assert current_span().name == 'retrieve'
+        record_span('prompt', 0.25)
+    assert current_span() is None
+
+    records = {record['span']: record for record in trace_records()}
+    assert set(records) == {'query', 'retrieve', 'prompt'}
+    assert records['retrieve']['parent_id'] == query_span.span_id
+    assert records['prompt']['duration_ms'] == 250.0
+    assert records['retrieve']['nodes'] == 3
+    assert len({record['trace_id'] for record in records.values()}) == 1
+    assert metrics.get('rag_stage_duration_seconds', stage='query') == 1
+
+def test_span_records_error(trace_records):
+    """例外で終わったスパンにエラーが記録されることをテストする"""
+    with pytest.raises(ValueError):
+        with span('search'):
+            raise ValueError("失敗")
+    assert trace_records()[0]['error'] == 'ValueError'
+    assert metrics.get('rag_stage_errors_total', stage='search') == 1
+
+def test_registry_render():
+    """Prometheusのテキスト形式で出力されることをテストする"""
+    registry = MetricsRegistry()
+    registry.inc('requests_total', help_text='リクエスト数', endpoint='chat')
+    registry.inc('requests_total', 2, endpoint='chat')
+    registry.observe('duration_seconds', 0.3, buckets=(0.1, 0.5), stage='llm')
+    registry.add_collector(lambda: [('queued', 'gauge', '待機数', {}, 4)])
+
+    lines = registry.render().splitlines()
+    assert '# HELP requests_total リクエスト数' in lines
+    assert '# TYPE requests_total counter' in lines
+    assert 'requests_total{endpoint="chat"} 3' in lines
+    assert 'duration_seconds_bucket{stage="llm",le="0.1"} 0' in lines
+    assert 'duration_seconds_bucket{stage="llm",le="0.5"} 1' in lines
+    assert 'duration_seconds_bucket{stage="llm",le="+Inf"} 1' in lines
+    assert 'duration_seconds_sum{stage="llm"} 0.3' in lines
+    assert 'duration_seconds_count{stage="llm"} 1' in lines
+    assert '# TYPE queued gauge' in lines
+    assert 'queued 4' in lines
+
+def test_llm_usage():
+    """Ollamaの応答からトークン数と生成速度が計算されることをテストする"""
+    assert llm_usage(OLLAMA_RAW) == {
+        'prompt_tokens': 120, 'completion_tokens': 40, 'eval_seconds': 2.0, 'tokens_per_second': 20.0
+    }
+    assert llm_usage(None) == {}
+    assert llm_usage({'message': {}}) == {}
+
+def test_gated_llm_records_generation(trace_records):
+    """LLMの生成がgenerateスパンとして記録され、トークン数がメトリクスに加算されることをテストする"""
+    llm = GatedLLM(UsageLLM(), LLMGateway(max_concurrency=1, max_queue=1))
+    with span('query') as query_span:
+        request_llm = llm.for_request()
+    started = []
+    request_llm.on_generation_start(lambda: started.append(True))
+
+    request_llm.chat([ChatMessage(role='user', content='質問')])
+    # ストリーミングは別スレッドで読まれても、リクエストのスパンの子として記録される
+    thread = threading.Thread(target=lambda: list(request_llm.stream_chat([ChatMessage(role='user', content='質問')])))
+    thread.start()
+    thread.join()
+
+    generations = [record for record in trace_records() if record['span'] == 'generate']
+    assert len(generations) == 2
+    assert all(record['parent_id'] == query_span.span_id for record in generations)
+    assert all(record['tokens_per_second'] == 20.0 for record in generations)
+    assert started == [True]
+    assert metrics.get('rag_llm_completion_tokens_total') == 80
+    assert metrics.get('rag_llm_prompt_tokens_total') == 240
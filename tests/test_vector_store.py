@@ -0,0 +1,198 @@
+import numpy as np
+import pytest
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+from src.utils.vector_store import (
+    create_vector_store, load_vector_store, get_base_index, supports_delete, search_vector_store,
+    evaluate_quantization, ID_MAP_FILENAME, LEGACY_ID_MAP_FILENAME, EXACT_VECTORS_FILENAME
+)
+import faiss
+import json
+import os
+
+DIM = 384
+
+def make_nodes(count, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(count, DIM)).astype('float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return [TextNode(id_=f"node-{seed}-{i}", text=f"text {i}", embedding=v.tolist()) for i, v in enumerate(vectors)]
+
+def query(vector_store, node, top_k=1):
+    return vector_store.query(VectorStoreQuery(query_embedding=node.embedding, similarity_top_k=top_k))
+
+@pytest.mark.parametrize(
+    "index_type,expected_class",
+    [
+        ('flat', faiss.IndexFlatIP),
+        ('ivf', faiss.IndexIVFFlat),
+        ('hnsw', faiss.IndexHNSWFlat),
+    ],
+)
+def test_create_vector_store(index_type, expected_class):
+    """インデックスタイプごとに正しいFAISSインデックスが作成されることをテストする"""
+    nodes = make_nodes(100)
+    vector_store = create_vector_store(index_type, embeddings=[n.embedding for n in nodes])
+    assert isinstance(get_base_index(vector_store.client), expected_class)
+
+    vector_store.add(nodes)
+    result = query(vector_store, nodes[5])
+    assert result.ids == [nodes[5].id_]
+    assert result.similarities[0] == pytest.approx(1.0, abs=1e-4)
+
+def test_create_vector_store_invalid_type():
+    """未対応のインデックスタイプでエラーになることをテストする"""
+    with pytest.raises(ValueError):
+        create_vector_store('unknown')
+
+@pytest.mark.parametrize("index_type", ['flat', 'ivf'])
+def test_delete_then_add_does_not_reuse_ids(index_type):
+    """削除後に追加してもFAISS IDが衝突しないことをテストする"""
+    nodes = make_nodes(50)
+    vector_store = create_vector_store(index_type, embeddings=[n.embedding for n in nodes])
+    vector_store.add(nodes)
+    vector_store.delete_nodes([nodes[0].id_, nodes[10].id_])
+
+    new_nodes = make_nodes(2, seed=1)
+    vector_store.add(new_nodes)
+
+    assert vector_store.client.ntotal == 50
+    for node in nodes[1:10] + new_nodes:
+        assert query(vector_store, node).ids == [node.id_]
+    assert nodes[0].id_ not in query(vector_store, nodes[0], top_k=5).ids
+    # 削除したノードにはFAISS IDがなく、追加したノードには最大ID + 1から割り当てられる
+    assert vector_store.faiss_ids([nodes[0].id_, nodes[1].id_, new_nodes[0].id_]) == [-1, 1, 50]
+
+def test_supports_delete():
+    """HNSWのみ削除非対応として扱われることをテストする"""
+    assert supports_delete('flat')
+    assert supports_delete('ivf')
+    assert not supports_delete('hnsw')
+
+def test_persist_and_load(tmp_path):
+    """永続化したベクトルストアをロードできることをテストする"""
+    nodes = make_nodes(20)
+    vector_store = create_vector_store('flat')
+    vector_store.add(nodes)
+    vector_store.persist(persist_path=os.path.join(str(tmp_path), 'default__vector_store.json'))
+    assert os.path.exists(os.path.join(str(tmp_path), ID_MAP_FILENAME))
+
+    loaded = load_vector_store(str(tmp_path))
+    assert query(loaded, nodes[3]).ids == [nodes[3].id_]
+
+@pytest.mark.parametrize("index_type", ['flat', 'ivf', 'hnsw'])
+def test_load_vector_store_mmap(tmp_path, index_type):
+    """mmapで読み込んでも同じ検索結果になることをテストする"""
+    nodes = make_nodes(100)
+    vector_store = create_vector_store(index_type, embeddings=[n.embedding for n in nodes])
+    vector_store.add(nodes)
+    vector_store.persist(persist_path=os.path.join(str(tmp_path), 'default__vector_store.json'))
+
+    loaded = load_vector_store(str(tmp_path), use_mmap=True)
+    assert query(loaded, nodes[42]).ids == [nodes[42].id_]
+
+def test_load_legacy_id_map(tmp_path):
+    """旧形式のid_map.jsonも読み込めることをテストする"""
+    nodes = make_nodes(10)
+    vector_store = create_vector_store('flat')
+    vector_store.add(nodes)
+    faiss.write_index(vector_store.client, os.path.join(str(tmp_path), 'default__vector_store.json'))
+    with open(os.path.join(str(tmp_path), LEGACY_ID_MAP_FILENAME), 'w') as f:
+        json.dump({
+            'node_id_to_faiss_id_map': vector_store._node_id_to_faiss_id_map,
+            'faiss_id_to_node_id_map': {str(k): v for k, v in vector_store._faiss_id_to_node_id_map.items()},
+        }, f)
+
+    loaded = load_vector_store(str(tmp_path))
+    assert query(loaded, nodes[7]).ids == [nodes[7].id_]
+    # 保存し直すと新形式に置き換わる
+    loaded.persist(persist_path=os.path.join(str(tmp_path), 'default__vector_store.json'))
+    assert os.path.exists(os.path.join(str(tmp_path), ID_MAP_FILENAME))
+    assert not os.path.exists(os.path.join(str(tmp_path), LEGACY_ID_MAP_FILENAME))
+
+def test_load_vector_store_missing(tmp_path):
+    """ベクトルストアがない場合にエラーになることをテストする"""
+    with pytest.raises(ValueError):
+        load_vector_store(str(tmp_path))
+
+@pytest.mark.parametrize(
+    "index_type,quantization,expected_class",
+    [
+        ('flat', 'int8', faiss.IndexScalarQuantizer),
+        ('flat', 'pq', faiss.IndexPQ),
+        ('ivf', 'int8', faiss.IndexIVFScalarQuantizer),
+        ('ivf', 'pq', faiss.IndexIVFPQ),
+        ('hnsw', 'int8', faiss.IndexHNSWSQ),
+    ],
+)
+def test_quantized_vector_store_reranks_with_exact_vectors(tmp_path, index_type, quantization, expected_class):
+    """量子化したインデックスでも元のベクトルで再スコアリングされ、保存・mmap読み込み後も同じ結果になることをテストする"""
+    nodes = make_nodes(300)
+    vector_store = create_vector_store(index_type, embeddings=[n.embedding for n in nodes], quantization=quantization)
+    assert isinstance(get_base_index(vector_store.client), expected_class)
+    vector_store.add(nodes)
+
+    result = query(vector_store, nodes[5], top_k=3)
+    assert result.ids[0] == nodes[5].id_
+    # 再スコアリング後のスコアは元のベクトルの内積
+    assert result.similarities[0] == pytest.approx(1.0, abs=1e-5)
+
+    vector_store.persist(persist_path=os.path.join(str(tmp_path), 'default__vector_store.json'))
+    assert os.path.getsize(os.path.join(str(tmp_path), EXACT_VECTORS_FILENAME)) == 300 * DIM * 4
+
+    loaded = load_vector_store(str(tmp_path), use_mmap=True)
+    assert query(loaded, nodes[5], top_k=3).ids == result.ids
+    matches = search_vector_store(loaded, [nodes[5].embedding], 3)
+    assert [node_id for node_id, _ in matches[0]] == result.ids
+
+def test_quantized_incremental_add_and_delete(tmp_path):
+    """量子化したインデックスへの差分追加・削除が元のベクトルのファイルにも反映されることをテストする"""
+    persist_path = os.path.join(str(tmp_path), 'default__vector_store.json')
+    nodes = make_nodes(300)
+    vector_store = create_vector_store('flat', embeddings=[n.embedding for n in nodes], quantization='int8')
+    vector_store.add(nodes)
+    vector_store.persist(persist_path=persist_path)
+
+    loaded = load_vector_store(str(tmp_path))
+    loaded.delete_nodes([nodes[0].id_])
+    new_nodes = make_nodes(5, seed=1)
+    loaded.add(new_nodes)
+    # 保存前は追加分をメモリ上のベクトルで再スコアリングする
+    assert query(loaded, new_nodes[2]).similarities[0] == pytest.approx(1.0, abs=1e-5)
+    loaded.persist(persist_path=persist_path)
+
+    reloaded = load_vector_store(str(tmp_path), use_mmap=True)
+    for node in new_nodes + nodes[1:3]:
+        result = query(reloaded, node)
+        assert result.ids == [node.id_]
+        assert result.similarities[0] == pytest.approx(1.0, abs=1e-5)
+    assert nodes[0].id_ not in query(reloaded, nodes[0], top_k=5).ids
+
+def test_rebuild_without_quantization_removes_exact_vectors(tmp_path):
+    """量子化なしで再構築すると再スコアリング用のファイルが削除されることをテストする"""
+    persist_path = os.path.join(str(tmp_path), 'default__vector_store.json')
+    nodes = make_nodes(300)
+    vector_store = create_vector_store('flat', embeddings=[n.embedding for n in nodes], quantization='int8')
+    vector_store.add(nodes)
+    vector_store.persist(persist_path=persist_path)
+
+    vector_store = create_vector_store('flat', quantization='none')
+    vector_store.add(nodes[:10])
+    vector_store.persist(persist_path=persist_path)
+    assert not os.path.exists(os.path.join(str(tmp_path), EXACT_VECTORS_FILENAME))
+
+def test_create_vector_store_invalid_quantization():
+    """未対応の量子化方式でエラーになることをテストする"""
+    with pytest.raises(ValueError):
+        create_vector_store('flat', quantization='int4')
+
+def test_evaluate_quantization():
+    """再スコアリングによりrecall@kが圧縮のみの場合以上になることをテストする"""
+    nodes = make_nodes(500)
+    embeddings = [n.embedding for n in nodes]
+    vector_store = create_vector_store('flat', embeddings=embeddings, quantization='pq')
+    vector_store.add(nodes)
+
+    report = evaluate_quantization(vector_store, embeddings, [n.id_ for n in nodes], top_k=5, num_queries=50)
+    assert report['num_queries'] == 50
+    assert 0.0 <= report['compressed'] <= report['reranked'] <= 1.0